@@ -0,0 +1,203 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# pylint: disable=protected-access
+"""
+Micro-benchmark for the client side overhead of one RestAPI request.
+
+Requests are answered by an in-memory transport adapter, so the measured time is RestAPI's own work:
+header building, request and response logging, body cleaning and status code assertion.
+Requests are made from the given call stack depth, pytest runs test cases roughly 50 frames deep.
+With --baseline the same requests are measured also with the earlier request path, which formatted every log
+message whether it was written or not and took the caller name from inspect.stack().
+
+Usage, from the repository root:
+    python -m benchmarks.rest_api_overhead [request count] [stack depth] [--baseline]
+"""
+
+import argparse
+import inspect
+import json
+import logging
+import time
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from izuma_systest_lib.cloud.libraries.rest_api.rest_api import REST_TIMEOUT, RestAPI, log as rest_log
+from izuma_systest_lib.tools import assert_status, create_curl_command
+
+BODY = b'{"id": "016f0e5b3cf70000000000010010dcba", "state": "registered", "token": "secret"}'
+
+
+class LocalAdapter(BaseAdapter):
+    """
+    Transport adapter answering every request with the same json response
+    """
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        r = requests.Response()
+        r.status_code = 200
+        r.headers = CaseInsensitiveDict({'Content-Type': 'application/json', 'X-Request-ID': 'benchmark'})
+        r._content = BODY
+        r.encoding = 'utf-8'
+        r.request = request
+        r.url = request.url
+        return r
+
+    def close(self):
+        pass
+
+
+class BaselineRestAPI(RestAPI):
+    """
+    RestAPI with the earlier request path: log messages, cURL command and cleaned bodies are built for every
+    request and the caller name comes from inspect.stack(). Transport is the same session as in RestAPI.
+    """
+
+    @staticmethod
+    def _clean_response_text(resp):
+        resp_text = resp.text
+        try:
+            resp_dict = resp.json()
+            if resp_dict.get('token') is not None:
+                resp_dict['token'] = '*'
+                resp_text = str(resp_dict)
+        except (AttributeError, json.JSONDecodeError):
+            pass
+        return resp_text
+
+    def _write_log_response(self, method, api_url, r, measured_time):
+        if self._log_command_body != 'none':
+            req_body = self._clean_request_body(r.request.body)
+            self._log(self._log_command_body, 'Request body: {}'.format(req_body))
+        if self._log_responses != 'none':
+            self._log(self._log_responses, '{} {} - Response: {} - X-Request-ID: {}'.
+                      format(method, api_url, r.status_code, r.headers.get('X-Request-ID', '')))
+        if self._log_timing:
+            rest_log.debug('{} {} - [time][{:.4f} s]'.format(method, api_url, measured_time))
+        if self._log_response_texts != 'none':
+            resp_text = self._clean_response_text(r)
+            self._log(self._log_response_texts, 'Response text: {}'.format(resp_text))
+        if self._log_response_headers != 'none':
+            self._log(self._log_response_headers, 'Response headers: {}'.format(r.headers))
+
+    def _do_request(self, method, api_url, request_headers=None, certificate=None, request_data=None, files=None,
+                    timeout=REST_TIMEOUT, logged_payload=None, expected_status_code=None, **kwargs):
+        rest_log.debug(request_headers)
+        log_head = dict(request_headers)
+        if self._log_commands != 'none':
+            if not self._api_key_logging:
+                log_head['Authorization'] = 'Bearer API_KEY'
+            if not logged_payload:
+                logged_payload = request_data
+            self._log(self._log_commands,
+                      '{}: {}  Headers: {}  Payload: {}'.format(method.upper(), self._add_request_params(api_url,
+                                                                                                         **kwargs),
+                                                                log_head, logged_payload))
+        if self._add_curl_logging != 'none':
+            self._log(self._add_curl_logging, create_curl_command(log_head['Authorization'], None, method,
+                                                                  self._add_request_params(api_url, **kwargs), '-v',
+                                                                  self._api_key_logging))
+        if not certificate:
+            certificate = self._client_certificate_and_key
+
+        time_start = time.time()
+        r = self.session.request(method.upper(), api_url, headers=request_headers, cert=certificate,
+                                 data=request_data, files=files, timeout=timeout, **kwargs)
+        time_end = time.time()
+
+        self._write_log_response(method.upper(), api_url, r, time_end - time_start)
+        if expected_status_code is not None:
+            assert_status(r, inspect.stack()[1][3].upper(), expected_status_code, api_url)
+        return r
+
+
+def measure(func, count, repeat=5):
+    """
+    Measures average time of one call, best of the repeats
+    :param func: Function to call
+    :param count: Call count in one repeat
+    :param repeat: Repeat count
+    :return: Microseconds per call
+    """
+    for _ in range(100):
+        func()
+    best = None
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        for _ in range(count):
+            func()
+        elapsed = (time.perf_counter() - time_start) / count * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def at_depth(depth, func, *args):
+    """
+    Calls function from given call stack depth
+    """
+    if depth > 0:
+        return at_depth(depth - 1, func, *args)
+    return func(*args)
+
+
+def main(count, depth, baseline=False):
+    config = {'api_gw': 'https://api.local', 'api_key': 'ak_benchmark'}
+    rest_apis = [('', RestAPI(config))]
+    if baseline:
+        rest_apis.append(('baseline, ', BaselineRestAPI(config)))
+    for _, rest_api in rest_apis:
+        rest_api.session.mount('https://', LocalAdapter())
+    rest_api = rest_apis[0][1]
+    lib_log = logging.getLogger('izuma_systest_lib')
+    lib_log.addHandler(logging.NullHandler())
+    lib_log.propagate = False
+
+    def transport_get():
+        rest_api.session.request('GET', 'https://api.local/v3/devices/016f0e5b3cf70000000000010010dcba')
+
+    results = []
+    for prefix, api in rest_apis:
+        def rest_get(api=api):
+            api.get('/v3/devices/016f0e5b3cf70000000000010010dcba', expected_status_code=200)
+
+        for name, level in (('logger level WARNING (logs not written)', logging.WARNING),
+                            ('logger level INFO', logging.INFO),
+                            ('logger level DEBUG (everything formatted)', logging.DEBUG)):
+            lib_log.setLevel(level)
+            results.append((prefix + name, at_depth(depth, measure, rest_get, count)))
+
+    lib_log.setLevel(logging.WARNING)
+    transport = at_depth(depth, measure, transport_get, count)
+
+    print('{} requests from stack depth {}, in-memory transport alone {:.1f} us/request'.format(count, depth,
+                                                                                                transport))
+    for name, per_request in results:
+        overhead = per_request - transport
+        print('{:55} {:8.1f} us/request, RestAPI overhead {:8.1f} us'.format(name, per_request, overhead))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the client side overhead of one RestAPI request')
+    parser.add_argument('count', nargs='?', type=int, default=500, help='Request count in one repeat')
+    parser.add_argument('depth', nargs='?', type=int, default=50, help='Call stack depth of the requests')
+    parser.add_argument('--baseline', action='store_true', help='Measure also the earlier request path')
+    args = parser.parse_args()
+    main(args.count, args.depth, args.baseline)
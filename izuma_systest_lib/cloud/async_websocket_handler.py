@@ -0,0 +1,462 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+asyncio version of the WebSocket notification channel, running on aiohttp
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from contextlib import suppress
+
+import aiohttp
+
+from izuma_systest_lib.cloud.event_store import ASYNC_RESPONSES
+from izuma_systest_lib.cloud.websocket_handler import WEBSOCKET_DRAIN_TIMEOUT, WEBSOCKET_READY_TIMEOUT, \
+    NotificationMatcher, NotificationRunner, WebSocketHandler
+from izuma_systest_lib.tools import build_random_string
+
+log = logging.getLogger(__name__)
+
+
+async def async_poll(check, timeout, delay=0.1, max_delay=1.0):
+    """
+    Awaits check() with exponential backoff until it returns a true value or the timeout passes
+    :param check: Coroutine function returning the waited result or false value
+    :param timeout: Seconds to poll
+    :param delay: First delay in seconds, doubled after each call
+    :param max_delay: Maximum delay in seconds
+    :return: Result of the last check()
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = await check()
+        remaining = deadline - time.monotonic()
+        if result or remaining <= 0:
+            return result
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+class AsyncWebSocketRunner(NotificationRunner):
+    """
+    WebSocket runner where connecting, receiving, parsing and storing the messages run as one task in the event
+    loop, so a channel needs no threads. Lost connection is reconnected after a jittered exponential backoff,
+    unauthorized connection stops the runner. Use with 'async with' statement or call open() and close():
+
+        async with AsyncWebSocketRunner(url, api_key) as runner:
+            handler = AsyncWebSocketHandler(runner)
+            await handler.wait_for_registration(device_id)
+
+    :param api: string URL for WebSocket connection endpoint
+    :param api_key: string
+    :param retention: RetentionPolicy of the stored events, defaults to RetentionPolicy.from_env()
+    :param session: aiohttp.ClientSession, by default the runner opens own session
+    :param backoff: Reconnect delay base in seconds, doubled on every failed attempt
+    :param max_backoff: Maximum reconnect delay in seconds
+    :param heartbeat: Seconds between WebSocket pings, None to switch off
+    """
+
+    def __init__(self, api, api_key, retention=None, session=None, backoff=1.0, max_backoff=30.0, heartbeat=30.0):
+        super().__init__(api, api_key, retention=retention)
+        self.session = session
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.heartbeat = heartbeat
+        self.ws = None
+        self.ret_code = []
+        self.connects = 0
+        self.connected = None
+        self._own_session = session is None
+        self._task = None
+        self._closing = False
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def open(self):
+        """
+        Starts the runner task in the running event loop
+        """
+        if self.running:
+            log.warning('WebSocket runner is already running!')
+            return
+        log.info('Starting WebSocket runner')
+        self._closing = False
+        self.connected = asyncio.Event()
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        self._task = asyncio.get_running_loop().create_task(self._run(),
+                                                            name='websocket_{}'.format(build_random_string(3)))
+
+    async def wait_disconnected(self, timeout=30):
+        """
+        Waits until the runner task has stopped
+        :param timeout: Seconds to wait
+        :return: True / False
+        """
+        if self._task is None:
+            return True
+        done, _ = await asyncio.wait({self._task}, timeout=timeout)
+        return bool(done)
+
+    async def wait_connected(self, timeout=30):
+        """
+        Waits until the WebSocket is connected
+        :param timeout: Seconds to wait
+        :return: True / False
+        """
+        if self.connected is None:
+            return False
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def _reconnect_delay(self, attempt):
+        """
+        Equal jitter backoff, half of the exponential delay is random so channels don't reconnect in sync
+        :param attempt: Count of failed connects in row, from 0
+        :return: Seconds to sleep
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _run(self):
+        """
+        Runner task, connects and receives until closed
+        """
+        attempt = 0
+        while not self._closing:
+            try:
+                log.debug('Connecting WebSocket')
+                async with self.session.ws_connect(self._api_url, protocols=('wss', 'pelion_{}'.format(self._api_key)),
+                                                   heartbeat=self.heartbeat) as ws:
+                    self.ws = ws
+                    self.connects += 1
+                    attempt = 0
+                    self.connected.set()
+                    log.info('WebSocket opened to {}'.format(self._api_url))
+                    await self._receive(ws)
+                self.ret_code.append(ws.close_code)
+                if self._closing:
+                    log.info('WebSocket closed with code {}'.format(ws.close_code))
+                else:
+                    log.error('WebSocket closed with code {}, reconnecting'.format(ws.close_code))
+            except aiohttp.WSServerHandshakeError as e:
+                if e.status == 401:
+                    log.error('Failed to connect WebSocket! {}'.format(e))
+                    break
+                log.warning('WebSocket failed, retrying! {}'.format(e))
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                log.warning('WebSocket failed, retrying! {}'.format(e))
+            finally:
+                self.ws = None
+                self.connected.clear()
+            if self._closing:
+                break
+            delay = self._reconnect_delay(attempt)
+            attempt += 1
+            log.debug('Reconnecting WebSocket in {:.2f} s'.format(delay))
+            await asyncio.sleep(delay)
+        log.info('WebSocket runner was stopped.')
+
+    async def _receive(self, ws):
+        """
+        Parses and stores the messages until the connection closes
+        :param ws: aiohttp.ClientWebSocketResponse
+        """
+        async for message in ws:
+            if message.type == aiohttp.WSMsgType.TEXT:
+                try:
+                    data = json.loads(message.data)
+                except ValueError as e:
+                    log.warning('Ignoring invalid WebSocket message {} - {}'.format(message.data[:100], e))
+                    continue
+                self._handle_message(data)
+            elif message.type == aiohttp.WSMsgType.ERROR:
+                log.warning('WebSocket error {}'.format(ws.exception()))
+                break
+
+    async def close(self):
+        """
+        Closes the connection, stops the runner task and closes own session
+        """
+        log.info('Closing WebSocket runner')
+        self._closing = True
+        if self.ws is not None:
+            await self.ws.close()
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+        log.info('WebSocket event store stats: {}'.format(self.events.stats()['total']))
+        self.events.close()
+
+
+class AsyncWebSocketHandler(WebSocketHandler):
+    """
+    WebSocketHandler of AsyncWebSocketRunner, the wait_for_* functions are coroutines
+    :param ws: AsyncWebSocketRunner
+    """
+
+    # pylint: disable=invalid-overridden-method
+
+    async def wait_for_multiple_notification(self, device_id, expected_notifications, timeout=30,
+                                             assert_errors=False):
+        """
+        Wait for given device id + resource path(s) + expected value(s) to appear in WebSocket
+
+        :param device_id: string
+        :param expected_notifications: list of dicts of resource paths with expected values
+        :param timeout: Seconds to wait
+        :param assert_errors: boolean for user if to fail test case in case of expected notifications not received
+        :return: False / list of received notifications or fail the test case if confirm_resp=True
+        """
+        self.ws.watch(device_id=device_id)
+        matcher = NotificationMatcher(self.ws.events['notifications'], device_id, expected_notifications)
+        item_list = await self.ws.events.async_wait('notifications', device_id, matcher.update, timeout)
+        if item_list:
+            return item_list
+        log.debug('Expected {}, found only {}!'.format(expected_notifications, matcher.matched))
+        if assert_errors:
+            assert False, 'Failed to receive all expected notifications from device on websocket channel by ' \
+                          'timeout:{} seconds'.format(timeout)
+        return False
+
+    async def wait_for_notification(self, device_id, resource_path, expected_value, timeout=30, assert_errors=False,
+                                    delay=1):
+        """
+        Wait for given device id + resource path + expected value to appear in WebSocket
+
+        :param device_id: string
+        :param resource_path: string
+        :param expected_value: string
+        :param timeout: Seconds to wait
+        :param assert_errors: boolean for user if to fail test case in case of expected notification not received
+        :param delay: Not used, the wait wakes up when a notification arrives
+        :return: dict or fail the test case if confirm_resp=True
+        """
+        del delay  # kept for compatibility
+        self.ws.watch(device_id=device_id)
+        expected_value = str(expected_value)
+
+        def check():
+            for item in self.ws.events['notifications'].find(device_id, resource_path):
+                if item.text == expected_value:
+                    return item
+            return None
+
+        item = await self.ws.events.async_wait('notifications', device_id, check, timeout, path=resource_path)
+        if item:
+            return item
+        if assert_errors:
+            assert False, 'Failed to receive notification from device on websocket channel by timeout: {}'.format(
+                timeout)
+        return False
+
+    async def wait_for_resource_notifications(self, device_id, resource_path, timeout=30, assert_errors=False,
+                                              delay=1):
+        """
+        Wait for any notification of given device id + resource path to appear in WebSocket
+
+        :param device_id: string
+        :param resource_path: string
+        :param timeout: Seconds to wait
+        :param assert_errors: boolean for user if to fail test case in case of expected notification not received
+        :param delay: Not used, the wait wakes up when a notification arrives
+        :return: dict or fail the test case if confirm_resp=True
+        """
+        del delay  # kept for compatibility
+        self.ws.watch(device_id=device_id)
+        notifications = self.ws.events['notifications']
+        item = await self.ws.events.async_wait('notifications', device_id,
+                                               lambda: notifications.first(device_id, resource_path),
+                                               timeout, path=resource_path)
+        if item:
+            return item
+        if assert_errors:
+            assert False, 'Failed to receive notification from device on websocket channel by timeout: {}'.format(
+                timeout)
+        return False
+
+    async def wait_for_async_response(self, async_response_id, timeout=30, assert_errors=False):
+        """
+        Wait for given async-response to appear in WebSocket data
+
+        :param async_response_id: string
+        :param timeout: Seconds to wait
+        :param assert_errors: boolean for user if to fail test case in case of expected response not received
+        :return: dict or fail the test case if confirm_resp=True
+        """
+        self.ws.watch(async_id=async_response_id)
+        async_response = await self.ws.events.waiters.async_wait((ASYNC_RESPONSES, async_response_id),
+                                                                 lambda: self.ws.async_responses.get(async_response_id),
+                                                                 timeout)
+        if async_response:
+            return async_response
+        if assert_errors:
+            assert False, 'Failed to receive async response from device with async_id:{} on websocket channel by ' \
+                          'timeout:{} seconds'.format(async_response_id, timeout)
+        return False
+
+    async def wait_for_registration(self, device_id, timeout=30):
+        """
+        Wait for given device id registration to appear in WebSocket
+
+        :param device_id: string
+        :param timeout: Seconds to wait
+        :return: False / dict
+        """
+        return await self.ws.events.async_wait('registrations', device_id, lambda: self.check_registration(device_id),
+                                               timeout)
+
+    async def wait_for_registration_updates(self, device_id, timeout=30):
+        """
+        Wait for given device id registration update notification to appear in WebSocket
+
+        :param device_id: string
+        :param timeout: Seconds to wait
+        :return: False / dict
+        """
+        return await self.ws.events.async_wait('reg-updates', device_id,
+                                               lambda: self.check_registration_updates(device_id), timeout)
+
+    async def wait_for_registration_expiration(self, device_id, timeout=30):
+        """
+        Wait for given device id registration expiration notification to appear in WebSocket
+
+        :param device_id: string
+        :param timeout: Seconds to wait
+        :return: False / dict
+        """
+        return await self.ws.events.async_wait('registrations-expired', device_id,
+                                               lambda: self.check_registration_expiration(device_id), timeout)
+
+    async def wait_for_deregistration(self, device_id, timeout=30):
+        """
+        Wait for given device id de-registration to appear in WebSocket
+
+        :param device_id: string
+        :param timeout: Seconds to wait
+        :return: False / dict
+        """
+        return await self.ws.events.async_wait('de-registrations', device_id,
+                                               lambda: self.check_deregistration(device_id), timeout)
+
+
+class AsyncWebSocketNotificationChannel:
+    """
+    WebSocket notification channel on AsyncIzumaCloud, registers the channel and runs AsyncWebSocketRunner:
+
+        async with AsyncWebSocketNotificationChannel(cloud, api_key) as channel:
+            await channel.handler.wait_for_registration(device_id)
+
+    :param cloud_api: AsyncIzumaCloud
+    :param api_key: string
+    :param configuration: Channel configuration, e.g. {'serialization': {...}}
+    :param retention: RetentionPolicy of the stored events
+    """
+
+    def __init__(self, cloud_api, api_key, configuration=None, retention=None):
+        self.cloud_api = cloud_api
+        self.api_key = api_key
+        self.configuration = configuration
+        self.setup_time = None
+        self.teardown_time = None
+        # Get host part from api address
+        host = cloud_api.rest_api.api_gw.split('//')[1]
+        self.ws = AsyncWebSocketRunner('wss://{}/v2/notification/websocket-connect'.format(host), api_key,
+                                       retention=retention)
+        self.handler = AsyncWebSocketHandler(self.ws)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _channel_status(self):
+        """
+        :return: Status of the registered channel, e.g. 'connected' or 'disconnected', None if not found
+        """
+        r = await self.cloud_api.connect.get_websocket_channel(self.api_key)
+        if r.status_code != 200:
+            return None
+        return r.json().get('status') or 'registered'
+
+    async def _channel_connected(self):
+        return await self._channel_status() == 'connected'
+
+    async def _channel_drained(self):
+        return await self._channel_status() != 'connected'
+
+    async def open(self):
+        """
+        Registers the channel, waits until it's ready and connects. WEBSOCKET_READY_TIMEOUT is the worst case wait.
+        """
+        log.info('Register and open WebSocket notification channel')
+        time_start = time.monotonic()
+        deadline = time_start + WEBSOCKET_READY_TIMEOUT
+        await self.cloud_api.connect.register_websocket_channel(self.api_key, configuration=self.configuration,
+                                                                expected_status_code=[200, 201])
+        # IOTNS-205, connecting right after registering fails
+        if not await async_poll(self._channel_status, WEBSOCKET_READY_TIMEOUT):
+            log.warning('WebSocket channel was not ready in {} s, connecting anyway'.format(WEBSOCKET_READY_TIMEOUT))
+        log.info('Opening WebSocket runner')
+        await self.ws.open()
+        opened = await self.ws.wait_connected(max(0.0, deadline - time.monotonic())) and \
+            await async_poll(self._channel_connected, max(0.0, deadline - time.monotonic()))
+        if not opened:
+            log.warning('WebSocket channel was not connected in {} s'.format(WEBSOCKET_READY_TIMEOUT))
+        self.setup_time = time.monotonic() - time_start
+        log.info('WebSocket notification channel set up in {:.2f} s'.format(self.setup_time))
+
+    async def close(self):
+        """
+        Closes the runner, waits until the channel is disconnected and deletes it. WEBSOCKET_DRAIN_TIMEOUT is
+        the worst case wait.
+        """
+        time_start = time.monotonic()
+        try:
+            await self.ws.close()
+        except (aiohttp.ClientError, RuntimeError) as e:
+            log.warning('Websocket closing error: {}'.format(e))
+        if not await async_poll(self._channel_drained, WEBSOCKET_DRAIN_TIMEOUT):
+            log.warning('WebSocket channel was not disconnected in {} s'.format(WEBSOCKET_DRAIN_TIMEOUT))
+        log.info('Deleting WebSocket channel')
+        await self.cloud_api.connect.delete_websocket_channel(self.api_key, expected_status_code=204)
+        self.teardown_time = time.monotonic() - time_start
+        log.info('WebSocket notification channel closed in {:.2f} s'.format(self.teardown_time))
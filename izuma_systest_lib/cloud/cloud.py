@@ -30,7 +30,8 @@ from izuma_systest_lib.cloud.libraries.enrollment import EnrollmentAPI
 from izuma_systest_lib.cloud.libraries.fcu import FcuAPI
 from izuma_systest_lib.cloud.libraries.gateway_logs import GatewayLogsAPI
 from izuma_systest_lib.cloud.libraries.iam import IamAPI
-from izuma_systest_lib.cloud.libraries.rest_api.rest_api import RestAPI
+from izuma_systest_lib.cloud.libraries.rest_api.async_rest_api import AsyncRestAPI
+from izuma_systest_lib.cloud.libraries.rest_api.rest_api import RestAPI, create_session, use_shared_session
 from izuma_systest_lib.cloud.libraries.statistics import StatisticsAPI
 from izuma_systest_lib.cloud.libraries.update import UpdateAPI
 import logging
@@ -50,23 +51,28 @@ log = logging.getLogger(__name__)
 class IzumaCloud:
     """
     Izuma Cloud class to provide handles for all rest api libraries
+    All rest api clients use the same connection pool, call close() to release it.
+    IzumaCloud is thread-safe, one object (e.g. cloud_api fixture) can be used from many worker threads at once.
     :param cloud_config_data: Cloud config data object
     """
 
     def __init__(self, cloud_config_data):
+        # Rest clients share one pool, either process wide shared one or pool owned by this object
+        self._session = self._create_session(cloud_config_data)
+
         # Rest API client for the cloud's API subdomain
-        self._rest_api = RestAPI(cloud_config_data)
+        self._rest_api = self._create_rest_api(cloud_config_data, 'api_gw')
         self._rest_api_gateways = None
         self._rest_api_edge_k8s = None
 
         # Only initialize a rest client for these domains if the key is provided
         if 'gateways_url' in cloud_config_data:
             # Rest API client for the cloud's gateways subdomain
-            self._rest_api_gateways = RestAPI(cloud_config_data, 'gateways_url')
+            self._rest_api_gateways = self._create_rest_api(cloud_config_data, 'gateways_url')
 
         if 'edge_k8s_url' in cloud_config_data:
             # Rest API client for the cloud's edge-k8s subdomain
-            self._rest_api_edge_k8s = RestAPI(cloud_config_data, 'edge_k8s_url')
+            self._rest_api_edge_k8s = self._create_rest_api(cloud_config_data, 'edge_k8s_url')
 
         self._billing = BillingAPI(self.rest_api)
         self._connect = ConnectAPI(self.rest_api)
@@ -79,6 +85,33 @@ class IzumaCloud:
         self._config_management = EdgeConfigManagementAPI(self.rest_api)
         self._gateway_logs = GatewayLogsAPI(self.rest_api)
 
+    @staticmethod
+    def _create_session(cloud_config_data):
+        """
+        Creates the session shared by the rest api clients
+        :param cloud_config_data: Cloud config data object
+        :return: requests.Session or None when process wide shared session is used
+        """
+        if use_shared_session(cloud_config_data):
+            return None
+        return create_session(cloud_config_data)
+
+    def _create_rest_api(self, cloud_config_data, api_domain_key):
+        """
+        Creates rest api client for the domain
+        :param cloud_config_data: Cloud config data object
+        :param api_domain_key: Config key of the domain url
+        :return: RestAPI
+        """
+        return RestAPI(cloud_config_data, api_domain_key, session=self._session)
+
+    def close(self):
+        """
+        Closes the pooled connections of the rest api clients
+        """
+        if self._session is not None:
+            self._session.close()
+
     @property
     def rest_api(self):
         """
@@ -169,3 +202,40 @@ class IzumaCloud:
         Returns gateway logs API class
         """
         return self._gateway_logs
+
+
+class AsyncIzumaCloud(IzumaCloud):
+    """
+    Izuma Cloud class where all rest api libraries run on asyncio, using AsyncRestAPI clients.
+    Library functions returning the rest response return awaitables, so whole test flow can run in one event loop:
+
+        async with AsyncIzumaCloud(tc_config_data) as cloud:
+            responses = await asyncio.gather(*[cloud.device_directory.get_device(device_id, expected_status_code=200)
+                                               for device_id in device_ids])
+
+    Helpers that process the response further, e.g. UpdateAPI.get_firmware_images_count(),
+    IamAPI.get_or_create_application() and ConnectAPI.async_request(), need the IzumaCloud class.
+    :param cloud_config_data: Cloud config data object
+    """
+
+    @staticmethod
+    def _create_session(cloud_config_data):
+        # Each AsyncRestAPI opens its aiohttp session in the running event loop
+        return None
+
+    def _create_rest_api(self, cloud_config_data, api_domain_key):
+        return AsyncRestAPI(cloud_config_data, api_domain_key)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):  # pylint: disable=invalid-overridden-method
+        """
+        Closes the aiohttp sessions of the rest api clients
+        """
+        for rest_api in (self._rest_api, self._rest_api_gateways, self._rest_api_edge_k8s):
+            if rest_api is not None:
+                await rest_api.close()
@@ -21,22 +21,108 @@
 Connect handler related helper functions
 """
 
-import base64
 import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from time import sleep
 
 import izuma_systest_lib.tools as utils
+from izuma_systest_lib.cloud.device_requests import BulkDeviceRequests, FleetRead
 
 log = logging.getLogger(__name__)
 
 
+def wait_for_device_response(channel_type, async_id, timeout=30, future=None):
+    """
+    Wait for the async response of a device request, asserts if not received
+    :param channel_type: websocket or callback
+    :param async_id: async id of the request
+    :param timeout: timeout for the async wait
+    :param future: future returned by expect_async_response() before sending the request, registered here if None
+    :return: async response
+    """
+    if future is None:
+        future = channel_type.expect_async_response(async_id, timeout)
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        # Drops the in-flight entry, a late response is still stored on the channel
+        future.cancel()
+        assert False, 'Failed to receive async response from device with async_id:{} on websocket channel by ' \
+                      'timeout:{} seconds'.format(async_id, timeout)
+
+
+def send_device_request(cloud_api, channel_type, ep_id, apikey, payload, async_id=None, timeout=30,
+                        expiry_seconds=None):
+    """
+    Send a device request without waiting. The async id is registered before sending, so any number of requests
+    can be outstanding and the responses are delivered to the futures as they arrive.
+    :param cloud_api:
+    :param channel_type: websocket or callback
+    :param ep_id: device id
+    :param apikey: api key fixture.
+    :param payload: The request we want to send to device for example: {"method": "GET", "uri": "/1000/0/1"}
+    :param async_id: Use provided async id with request or allocate a unique one for the request
+    :param timeout: seconds until the future fails with TimeoutError
+    :param expiry_seconds: The time period during which the delivery is attempted, in seconds.
+    :return: (async id, concurrent.futures.Future of the async response)
+    """
+    if async_id is None:
+        async_id = utils.next_async_id()
+    elif channel_type.get_async_response(async_id) is not None:
+        log.warning('Async-id {} is already used on the channel, responses can be mixed up'.format(async_id))
+    future = channel_type.expect_async_response(async_id, timeout)
+    try:
+        cloud_api.connect.send_async_request_to_device(ep_id, payload, async_id=async_id,
+                                                       expiry_seconds=expiry_seconds, expected_status_code=202,
+                                                       api_key=apikey)
+    except BaseException:
+        future.cancel()
+        raise
+    return async_id, future
+
+
+def send_bulk_device_requests(cloud_api, channel_type, device_requests, apikey=None, max_concurrency=16, timeout=60):
+    """
+    Send device requests to many devices and resources with bounded concurrency and collect the async responses.
+    Failures are reported in the result instead of asserting.
+    :param cloud_api:
+    :param channel_type: websocket or callback
+    :param device_requests: iterable of (device_id, method, uri[, payload]) tuples
+    :param apikey: api key, defaults to the channel's key
+    :param max_concurrency: maximum concurrent requests to the cloud
+    :param timeout: timeout for each async wait
+    :return: BulkRequestResult
+    """
+    return BulkDeviceRequests(cloud_api, channel_type, max_concurrency=max_concurrency, timeout=timeout,
+                              api_key=apikey).run(device_requests)
+
+
+def read_fleet_resource(cloud_api, channel_type, resource_path, device_filter='state=registered', apikey=None,
+                        window=64, timeout=30, max_devices=None):
+    """
+    Read a resource of all devices matching the filter. Devices are listed page by page while the requests are
+    in flight, failures are reported in the result instead of asserting.
+    :param cloud_api:
+    :param channel_type: websocket or callback
+    :param resource_path: resource path, e.g. /3/0/13
+    :param device_filter: device filter string, device query object or query parameters dict
+    :param apikey: api key, defaults to the channel's key
+    :param window: maximum device requests in flight
+    :param timeout: timeout for each async wait
+    :param max_devices: maximum devices read, None for all matching
+    :return: BulkRequestResult, payloads() gives {device_id: payload}
+    """
+    return FleetRead(cloud_api, channel_type, window=window, timeout=timeout,
+                     api_key=apikey).run(resource_path, device_filter, max_devices=max_devices)
+
+
 def send_async_device_and_wait_for_response(cloud_api, channel_type, ep_id, apikey, payload, async_id=None,
                                             timeout=30, expiry_seconds=None):
     """
     Send a get rest request to specific resource and wait for the async response from device
     :param payload: The request we want to send to device for example: {"method": "GET", "uri": "/1000/0/1"}
     :param expiry_seconds: The time period during which the delivery is attempted, in seconds.
-    :param async_id: Use provided async id with request or generate a random one for the request
+    :param async_id: Use provided async id with request or allocate a unique one for the request
     :param cloud_api:
     :param channel_type: websocket or callback
     :param ep_id: device id
@@ -45,20 +131,13 @@ def send_async_device_and_wait_for_response(cloud_api, channel_type, ep_id, apik
     :return: dict / False (if received from cloud)
     """
 
-    if async_id is None:
-        async_id = utils.build_random_string(30)
-    cloud_api.connect.send_async_request_to_device(ep_id, payload, async_id=async_id, expiry_seconds=expiry_seconds,
-                                                   expected_status_code=202,
-                                                   api_key=apikey)
-    async_response = channel_type.wait_for_async_response(async_response_id=async_id,
-                                                          timeout=timeout,
-                                                          assert_errors=True)
+    async_id, future = send_device_request(cloud_api, channel_type, ep_id, apikey, payload, async_id=async_id,
+                                           timeout=timeout, expiry_seconds=expiry_seconds)
+    async_response = wait_for_device_response(channel_type, async_id, timeout, future)
 
     log.info('get async response {}'.format(async_response))
-    # check if we get async response and it contains payload
+    # check if we get async response and it contains payload, the response record decodes it to 'decoded_payload'
     if async_response and 'payload' in async_response:
-        # decode original payload and append in received async response
-        async_response['decoded_payload'] = base64.b64decode(async_response['payload']).decode('utf-8')
         return async_response
     return False
 
@@ -72,7 +151,7 @@ def send_get_and_wait_for_response(cloud_api, channel_type, ep_id, apikey, resou
     :param apikey:
     :param resource_path: path of the resource to device
     :param timeout: timeout for the async wait
-    :return: dict / False (if received from wait_for_async_response)
+    :return: dict, asserts if not received in time
     """
     # send a get resource request to device
     response = cloud_api.connect.get_device_resources(device_id=ep_id, resource_path=resource_path,
@@ -80,13 +159,9 @@ def send_get_and_wait_for_response(cloud_api, channel_type, ep_id, apikey, resou
                                                       api_key=apikey)
     async_id = response.json()['async-response-id']
     # wait for async response
-    async_response = channel_type.wait_for_async_response(async_response_id=async_id, timeout=timeout,
-                                                          assert_errors=True)
+    async_response = wait_for_device_response(channel_type, async_id, timeout)
     log.info('get async response {}'.format(async_response))
-    # check if we get async response and it contains payload
-    if async_response and 'payload' in async_response:
-        # decode original payload and append in received async response
-        async_response['decoded_payload'] = base64.b64decode(async_response['payload']).decode('utf-8')
+    # async response record decodes the payload to 'decoded_payload' when it is read
     return async_response
 
 
@@ -109,8 +184,7 @@ def send_put_and_wait_for_response(cloud_api, channel_type, ep_id, apikey, resou
     log.info('put initial response {}'.format(response))
     async_id = response.json()['async-response-id']
     # wait for async response
-    async_response = channel_type.wait_for_async_response(async_response_id=async_id, timeout=timeout,
-                                                          assert_errors=True)
+    async_response = wait_for_device_response(channel_type, async_id, timeout)
     log.info('put async response {}'.format(async_response))
     return async_response
 
@@ -136,8 +210,7 @@ def send_post_and_wait_for_response(cloud_api, channel_type, ep_id, apikey, reso
     log.info('post initial response {}'.format(response))
     async_id = response.json()['async-response-id']
     # wait for async response
-    async_response = channel_type.wait_for_async_response(async_response_id=async_id, timeout=timeout,
-                                                          assert_errors=True)
+    async_response = wait_for_device_response(channel_type, async_id, timeout)
     log.info('post async response {}'.format(async_response))
     return async_response
 
@@ -160,8 +233,7 @@ def send_del_and_wait_for_response(cloud_api, channel_type, ep_id, apikey, resou
     log.info('delete initial response {}'.format(response))
     async_id = response.json()['async-response-id']
     # wait for async response
-    async_response = channel_type.wait_for_async_response(async_response_id=async_id, timeout=timeout,
-                                                          assert_errors=True)
+    async_response = wait_for_device_response(channel_type, async_id, timeout)
     log.info('delete async response {}'.format(async_response))
     return async_response
 
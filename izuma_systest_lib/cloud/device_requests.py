@@ -0,0 +1,382 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Bulk device requests over many devices and resources
+"""
+
+import logging
+import time
+from base64 import b64encode
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from izuma_systest_lib.tools import async_id_allocator
+
+log = logging.getLogger(__name__)
+
+OK = 'ok'
+DEVICE_ERROR = 'device_error'
+REJECTED = 'rejected'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+
+
+class DeviceRequestResult:
+    """
+    Result of one device request of BulkDeviceRequests
+    state is one of:
+    - 'ok': device responded with 2xx status
+    - 'device_error': device responded with other status or the response has an error
+    - 'rejected': cloud didn't accept the request, status_code has the POST response status
+    - 'error': sending the request failed, e.g. connection error
+    - 'timeout': no async-response in time
+    """
+
+    def __init__(self, device_id, method, uri, request_payload, async_id=None):
+        self.device_id = device_id
+        self.method = method
+        self.uri = uri
+        self.request_payload = request_payload
+        self.async_id = async_id
+        self.state = None
+        self.status_code = None
+        self.status = None
+        self.payload = None
+        self.latency = None
+        self.error = None
+        self.response = None
+        self.sent = None
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        return self.state == OK
+
+    def fail(self, state, error, status_code=None):
+        self.state = state
+        self.error = error
+        self.status_code = status_code
+
+    def resolve(self, response):
+        self.response = response
+        self.status = response.get('status')
+        self.error = response.get('error')
+        self.payload = response.get('decoded_payload') if 'payload' in response else None
+        self.latency = max(0.0, getattr(response, 'received', time.time()) - self.sent)
+        self.state = OK if isinstance(self.status, int) and 200 <= self.status < 300 and not self.error \
+            else DEVICE_ERROR
+
+    def to_dict(self):
+        return {'device_id': self.device_id, 'method': self.method, 'uri': self.uri, 'async_id': self.async_id,
+                'state': self.state, 'status_code': self.status_code, 'status': self.status,
+                'payload': self.payload, 'latency': self.latency, 'error': self.error}
+
+    def __repr__(self):
+        return '<DeviceRequestResult {} {} {} {} status {}>'.format(
+            self.method, self.device_id, self.uri, self.state, self.status)
+
+
+class BulkRequestResult:
+    """
+    Results of BulkDeviceRequests.run() in the order of the requests, of FleetRead.run() in completion order
+    """
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        return all(result.ok for result in self.results)
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    def payloads(self):
+        """
+        :return: {device_id: payload} of the succeeded requests, e.g. a fleet snapshot of one resource
+        """
+        return {result.device_id: result.payload for result in self.results if result.ok}
+
+    def counts(self):
+        """
+        :return: {state: count}
+        """
+        counts = {}
+        for result in self.results:
+            counts[result.state] = counts.get(result.state, 0) + 1
+        return counts
+
+    def latency(self, fraction):
+        """
+        :param fraction: Quantile 0..1
+        :return: Round-trip latency quantile of the answered requests in seconds, None if none answered
+        """
+        latencies = sorted(result.latency for result in self.results if result.latency is not None)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def summary(self):
+        return '{} device requests in {:.2f} s: {}, latency p50 {} p95 {}'.format(
+            len(self.results), self.elapsed, self.counts(), self.latency(0.5), self.latency(0.95))
+
+
+class BulkDeviceRequests:
+    """
+    Sends device requests to many devices and resources, e.g. reads the same LwM2M resource of hundreds of
+    gateways. The POSTs are sent with bounded concurrency, each async-id is registered to the channel before its
+    request, and responses are collected as they arrive. Failures don't assert but are reported in the results:
+
+        bulk = BulkDeviceRequests(cloud_api, websocket, max_concurrency=32)
+        result = bulk.run([(device_id, 'GET', '/3/0/13') for device_id in device_ids])
+        log.info(result.summary())
+        assert result.ok, [r.to_dict() for r in result.failed]
+
+    :param cloud_api: Cloud API object
+    :param channel: WebSocketHandler of the notification channel
+    :param max_concurrency: Maximum concurrent POST requests
+    :param timeout: Seconds to wait each async-response after its request was sent
+    :param expiry_seconds: Delivery expiry of the requests in the cloud
+    :param api_key: Authentication key, defaults to the channel's key
+    :param accept: The content type accepted from the device
+    :param content_type: Content type of the request payloads
+    """
+
+    def __init__(self, cloud_api, channel, max_concurrency=16, timeout=60, expiry_seconds=None, api_key=None,
+                 accept='text/plain', content_type='text/plain'):
+        self.cloud_api = cloud_api
+        self.channel = channel
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.expiry_seconds = expiry_seconds
+        self.api_key = api_key or channel.api_key
+        self.accept = accept
+        self.content_type = content_type
+
+    def _request_data(self, method, uri, payload):
+        request_data = {'method': method, 'uri': uri, 'accept': self.accept}
+        if payload is not None:
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            request_data['payload-b64'] = b64encode(payload).decode('utf-8')
+            request_data['content-type'] = self.content_type
+        return request_data
+
+    def _send(self, result):
+        """
+        Allocates and registers the async-id and sends the request. The id is allocated only now, as the
+        round-trip latency is measured from its time.
+        :param result: DeviceRequestResult of the request
+        :return: (result, future of the async-response or None if sending failed)
+        """
+        result.async_id = async_id_allocator.allocate()
+        future = self.channel.expect_async_response(result.async_id, self.timeout)
+        result.sent = time.time()
+        try:
+            r = self.cloud_api.connect.send_async_request_to_device(
+                result.device_id, self._request_data(result.method, result.uri, result.request_payload),
+                async_id=result.async_id, expiry_seconds=self.expiry_seconds, api_key=self.api_key)
+        except (requests.exceptions.RequestException, OSError) as e:
+            future.cancel()
+            result.fail(ERROR, str(e))
+            return result, None
+        if r.status_code != 202:
+            future.cancel()
+            result.fail(REJECTED, r.text, r.status_code)
+            return result, None
+        result.status_code = r.status_code
+        return result, future
+
+    @staticmethod
+    def _results(device_requests):
+        """
+        :param device_requests: Iterable of (device_id, method, uri[, payload]) tuples, consumed lazily
+        :return: Generator of DeviceRequestResult, async-id is allocated when the request is sent
+        """
+        for request in device_requests:
+            yield DeviceRequestResult(request[0], request[1], request[2], request[3] if len(request) > 3 else None)
+
+    def iterate(self, device_requests, window=None):
+        """
+        Sends the requests and yields the results as they complete. Requests still in flight when the generator
+        is closed early, e.g. with break, are abandoned and their async-ids unregistered.
+        :param device_requests: Iterable of (device_id, method, uri[, payload]) tuples
+        :param window: Maximum requests in flight, sent or waiting the response. The requests are then taken
+                       from device_requests only as earlier ones complete, so it can be a lazy generator.
+                       None sends all requests at once.
+        :return: Generator of DeviceRequestResult in completion order
+        """
+        return self._iterate(self._results(device_requests), window)
+
+    def _iterate(self, results, window=None):
+        results = iter(results)
+        posts = set()
+        waiting = {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='device_requests') as executor:
+            try:
+                while True:
+                    while window is None or len(posts) + len(waiting) < window:
+                        result = next(results, None)
+                        if result is None:
+                            window = 0
+                            break
+                        posts.add(executor.submit(self._send, result))
+                    if not posts and not waiting:
+                        break
+
+                    timeout = None
+                    if waiting:
+                        timeout = max(0.0, min(result.sent for result in waiting.values()) + self.timeout - time.time())
+                    done, _ = wait(posts | set(waiting), timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in posts:
+                            posts.remove(future)
+                            result, response_future = future.result()
+                            if response_future is None:
+                                yield result
+                            else:
+                                waiting[response_future] = result
+                        else:
+                            result = waiting.pop(future)
+                            if future.exception() is None:
+                                result.resolve(future.result())
+                            else:
+                                result.fail(TIMEOUT, str(future.exception()))
+                            yield result
+                    now = time.time()
+                    for future, result in list(waiting.items()):
+                        if now - result.sent >= self.timeout and not future.done():
+                            future.cancel()
+                            del waiting[future]
+                            result.fail(TIMEOUT, 'No async-response in {} s'.format(self.timeout))
+                            yield result
+            finally:
+                # Left early, unsent requests are dropped and the sent ones unregistered from the channel
+                abandoned = list(waiting)
+                for future in posts:
+                    if not future.cancel() and future.exception() is None:
+                        abandoned.append(future.result()[1])
+                for future in abandoned:
+                    if future is not None:
+                        future.cancel()
+
+    def run(self, device_requests):
+        """
+        Sends the requests and waits for all responses
+        :param device_requests: Iterable of (device_id, method, uri[, payload]) tuples
+        :return: BulkRequestResult
+        """
+        time_start = time.perf_counter()
+        results = list(self._results(device_requests))
+        for _ in self._iterate(results):
+            pass
+        result = BulkRequestResult(results, time.perf_counter() - time_start)
+        log.info(result.summary())
+        return result
+
+
+class FleetRead:
+    """
+    Reads a resource of every device matching a device filter, e.g. the firmware version of all registered
+    gateways. The devices are listed page by page while the requests of the earlier pages are in flight, and at
+    most window requests are in flight at a time. Each request waits its own timeout, so a snapshot of the fleet
+    takes about the time of the slowest devices instead of the sum of them:
+
+        fleet = FleetRead(cloud_api, websocket, window=64, timeout=30)
+        for result in fleet.iterate('/3/0/3', 'state=registered'):
+            log.info('{} {} {}'.format(result.device_id, result.state, result.payload))
+
+        snapshot = fleet.run('/3/0/13', 'state=registered')
+        assert snapshot.ok, [r.to_dict() for r in snapshot.failed]
+
+    :param cloud_api: Cloud API object
+    :param channel: WebSocketHandler of the notification channel
+    :param window: Maximum device requests in flight
+    :param timeout: Seconds to wait each async-response after its request was sent
+    :param max_concurrency: Maximum concurrent POST requests
+    :param page_size: Devices per GET /devices page
+    :param expiry_seconds: Delivery expiry of the requests in the cloud
+    :param api_key: Authentication key, defaults to the channel's key
+    :param accept: The content type accepted from the device
+    """
+
+    def __init__(self, cloud_api, channel, window=64, timeout=30, max_concurrency=16, page_size=100,
+                 expiry_seconds=None, api_key=None, accept='text/plain'):
+        self.cloud_api = cloud_api
+        self.window = window
+        self.page_size = page_size
+        self.requests = BulkDeviceRequests(cloud_api, channel, max_concurrency=max_concurrency, timeout=timeout,
+                                           expiry_seconds=expiry_seconds, api_key=api_key, accept=accept)
+
+    @staticmethod
+    def _query_params(device_filter):
+        """
+        :param device_filter: Filter string e.g. 'state=registered', device query object or query parameters dict
+        :return: GET /devices query parameters
+        """
+        if device_filter is None:
+            return {}
+        if isinstance(device_filter, str):
+            return {'filter': device_filter}
+        if 'query' in device_filter:
+            return {'filter': device_filter['query']}
+        return dict(device_filter)
+
+    def iterate(self, resource_path, device_filter=None, method='GET', max_devices=None):
+        """
+        Lists the devices and yields the results as they complete
+        :param resource_path: Resource path e.g. '/3/0/13'
+        :param device_filter: Filter string e.g. 'state=registered', device query object or query parameters dict
+        :param method: Request method
+        :param max_devices: Maximum devices read, None for all matching
+        :return: Generator of DeviceRequestResult in completion order
+        """
+        with self.cloud_api.device_directory.iterate_devices(self._query_params(device_filter),
+                                                             api_key=self.requests.api_key,
+                                                             page_size=self.page_size,
+                                                             max_items=max_devices) as devices:
+            device_requests = ((device['id'], method, resource_path) for device in devices)
+            yield from self.requests.iterate(device_requests, window=self.window)
+
+    def run(self, resource_path, device_filter=None, method='GET', max_devices=None):
+        """
+        Reads the resource of all matching devices
+        :param resource_path: Resource path e.g. '/3/0/13'
+        :param device_filter: Filter string e.g. 'state=registered', device query object or query parameters dict
+        :param method: Request method
+        :param max_devices: Maximum devices read, None for all matching
+        :return: BulkRequestResult in completion order
+        """
+        time_start = time.perf_counter()
+        results = list(self.iterate(resource_path, device_filter, method, max_devices))
+        result = BulkRequestResult(results, time.perf_counter() - time_start)
+        log.info('Fleet read {}: {}'.format(resource_path, result.summary()))
+        return result
@@ -0,0 +1,1052 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Indexed in-memory store of WebSocket notification channel events.
+"""
+
+import asyncio
+import base64
+import datetime
+import functools
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from izuma_systest_lib.cloud.libraries.rest_api.metrics import Histogram
+from izuma_systest_lib.tools import async_id_allocator
+
+log = logging.getLogger(__name__)
+
+EVENT_TYPES = ('registrations', 'notifications', 'reg-updates', 'de-registrations', 'registrations-expired')
+ASYNC_RESPONSES = 'async-responses'
+# Evicted slots are dropped from the front of the log when there are more of them than this
+COMPACT_THRESHOLD = 1024
+TEXT_CONTENT_TYPES = ('', 'text/plain')
+JSON_CONTENT_TYPES = ('application/json', 'application/senml+json')
+_MISSING = object()
+
+
+class Record:
+    """
+    Compact notification channel event. Works like the received event dict, e.g. record['path'] and
+    record.get('payload'), but the common fields are stored in slots and the others in a small dict.
+    Payload is decoded when first used and the results are kept:
+    - bytes: base64 decoded payload
+    - text: payload decoded to string, also available as record['decoded_payload']
+    - value: number for text/plain, parsed json for json content types, otherwise bytes
+    Arrival time is kept as epoch seconds in received, record['dt'] formats it to ISO 8601 UTC string.
+    :param content: Event dict
+    :param received: Epoch time of the arrival, defaults to now
+    """
+
+    __slots__ = ('ep', 'path', 'ct', 'payload', 'max_age', 'id', 'status', 'received', '_extra', '_bytes', '_text',
+                 '_value')
+    FIELDS = {'ep': 'ep', 'path': 'path', 'ct': 'ct', 'payload': 'payload', 'max-age': 'max_age', 'id': 'id',
+              'status': 'status'}
+    COMPUTED = ('dt', 'decoded_payload')
+
+    DT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+    def __init__(self, content, received=None):
+        self.ep = self.ct = self.id = _MISSING  # pylint: disable=invalid-name
+        self.path = self.payload = self.max_age = self.status = _MISSING
+        self._extra = None
+        self._bytes = None
+        self._text = None
+        self._value = _MISSING
+        self.received = time.time() if received is None else received
+        for key, value in content.items():
+            if key not in self.COMPUTED:
+                self[key] = value
+
+    @property
+    def bytes(self):
+        """
+        :return: Decoded payload bytes, None if the event has no payload
+        """
+        if self._bytes is None and self.payload is not _MISSING and self.payload is not None:
+            self._bytes = base64.b64decode(self.payload)
+        return self._bytes
+
+    @property
+    def text(self):
+        """
+        :return: Decoded payload string, None if the event has no payload
+        """
+        if self._text is None and self.bytes is not None:
+            self._text = self._bytes.decode('utf8', errors='replace')
+        return self._text
+
+    @property
+    def value(self):
+        """
+        :return: Payload parsed by the content type, None if the event has no payload
+        """
+        if self._value is _MISSING:
+            self._value = self._parse_value()
+        return self._value
+
+    def _parse_value(self):
+        if self.bytes is None:
+            return None
+        content_type = self.ct if isinstance(self.ct, str) else ''
+        content_type = content_type.split(';', maxsplit=1)[0].strip().lower()
+        if content_type in JSON_CONTENT_TYPES:
+            try:
+                return json.loads(self.text)
+            except ValueError:
+                return self.text
+        if content_type in TEXT_CONTENT_TYPES:
+            for convert in (int, float):
+                try:
+                    return convert(self.text)
+                except ValueError:
+                    pass
+            return self.text
+        return self._bytes
+
+    @property
+    def dt(self):  # pylint: disable=invalid-name
+        return datetime.datetime.fromtimestamp(self.received, datetime.timezone.utc).strftime(self.DT_FORMAT)
+
+    @classmethod
+    def from_dict(cls, content):
+        """
+        Record from the to_dict() format, e.g. a spilled event
+        :param content: Event dict with 'dt'
+        :return: Record
+        """
+        received = None
+        if 'dt' in content:
+            received = datetime.datetime.strptime(content['dt'], cls.DT_FORMAT).replace(
+                tzinfo=datetime.timezone.utc).timestamp()
+        return cls(content, received)
+
+    def size(self):
+        """
+        :return: Estimated memory use in bytes, decoded payloads included
+        """
+        size = sys.getsizeof(self) + sum(sys.getsizeof(getattr(self, attribute)) for attribute in self.FIELDS.values())
+        if self._extra is not None:
+            size += sys.getsizeof(self._extra) + sum(sys.getsizeof(value) for value in self._extra.values())
+        if self._bytes is not None:
+            size += sys.getsizeof(self._bytes) + sys.getsizeof(self._text)
+        return size
+
+    def __getitem__(self, key):
+        attribute = self.FIELDS.get(key)
+        if attribute is not None:
+            value = getattr(self, attribute)
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        elif key == 'dt':
+            return self.dt
+        elif key == 'decoded_payload' and self.text is not None:
+            return self.text
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        attribute = self.FIELDS.get(key)
+        if attribute is not None:
+            setattr(self, attribute, value)
+            if key == 'payload':
+                self._bytes = self._text = None
+                self._value = _MISSING
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def keys(self):
+        keys = [key for key, attribute in self.FIELDS.items() if getattr(self, attribute) is not _MISSING]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        keys.append('dt')
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """
+        :return: Event as dict, in the format the events were stored before
+        """
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def _to_json(value):
+    return value.to_dict() if isinstance(value, Record) else str(value)
+
+
+def _env_number(name, default=None, convert=int):
+    value = os.getenv(name, default='')
+    if value.strip() == '':
+        return default
+    value = convert(value)
+    return value if value > 0 else None
+
+
+class RetentionPolicy:
+    """
+    Limits of the stored WebSocket events. Oldest events are evicted when a limit is exceeded, and written to
+    the spill file if spill_path is given. None means no limit.
+    :param max_events: Maximum stored events of one notification type, also the maximum stored async-responses
+    :param max_age: Maximum age of stored events in seconds
+    :param max_per_endpoint: Maximum stored events of one endpoint in one notification type
+    :param spill_path: Directory for the compressed file of the evicted events
+    """
+
+    def __init__(self, max_events=None, max_age=None, max_per_endpoint=None, spill_path=None):
+        self.max_events = max_events
+        self.max_age = max_age
+        self.max_per_endpoint = max_per_endpoint
+        self.spill_path = spill_path
+
+    @classmethod
+    def from_env(cls):
+        """
+        Policy from WEBSOCKET_MAX_EVENTS (default 100000), WEBSOCKET_MAX_EVENT_AGE, WEBSOCKET_MAX_EVENTS_PER_ENDPOINT
+        and WEBSOCKET_SPILL_PATH environment variables, 0 switches a limit off
+        :return: RetentionPolicy
+        """
+        return cls(_env_number('WEBSOCKET_MAX_EVENTS', 100000), _env_number('WEBSOCKET_MAX_EVENT_AGE', convert=float),
+                   _env_number('WEBSOCKET_MAX_EVENTS_PER_ENDPOINT'), os.getenv('WEBSOCKET_SPILL_PATH') or None)
+
+    def __repr__(self):
+        return '<RetentionPolicy max_events={} max_age={} max_per_endpoint={} spill_path={}>'.format(
+            self.max_events, self.max_age, self.max_per_endpoint, self.spill_path)
+
+
+def _event_size(event):
+    """
+    :param event: Record or event dict
+    :return: Estimated memory use of the event in bytes
+    """
+    if isinstance(event, Record):
+        return event.size()
+    return sys.getsizeof(event) + sum(sys.getsizeof(value) for value in event.values())
+
+
+class SpillFile:
+    """
+    Append-only gzip compressed json lines file of the evicted events. Every line has the notification type,
+    sequence number and the event. The file can be queried while it is written.
+    :param path: File path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.written = 0
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'at', compresslevel=1, encoding='utf-8')
+
+    def write(self, notification_type, seq, event):
+        """
+        Appends evicted event
+        :param notification_type: Notification type
+        :param seq: Sequence number of the event in its log
+        :param event: Event
+        """
+        line = json.dumps({'type': notification_type, 'seq': seq, 'event': event}, default=_to_json)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self.written += 1
+
+    def read(self, notification_type=None, endpoint=None, path=None):
+        """
+        Reads the spilled events
+        :param notification_type: Only events of the notification type
+        :param endpoint: Only events of the endpoint
+        :param path: Only events of the resource path
+        :return: Generator of the spilled events as Records in eviction order
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    item = json.loads(line)
+                    event = item['event']
+                    if notification_type is not None and item['type'] != notification_type:
+                        continue
+                    if endpoint is not None and (not isinstance(event, dict) or event.get('ep') != endpoint):
+                        continue
+                    if path is not None and (not isinstance(event, dict) or event.get('path') != path):
+                        continue
+                    yield Record.from_dict(event) if isinstance(event, dict) else event
+            except EOFError:
+                # Member being written has no end marker yet
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _LoopEvent:
+    """
+    asyncio.Event of the running loop which can be set from any thread
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self._thread = threading.get_ident()
+
+    def set(self):
+        if threading.get_ident() == self._thread:
+            self.event.set()
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.event.set)
+        except RuntimeError:
+            # Loop is closed, nobody waits anymore
+            pass
+
+
+class Waiters:
+    """
+    Threads and coroutines waiting for events, keyed by what they wait for, e.g. ('notifications', endpoint, path)
+    or ('async-responses', async id). Arriving event wakes only the waiters of its keys.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+
+    def notify(self, *keys):
+        """
+        Wakes the waiters of the keys
+        :param keys: Keys of the arrived event
+        """
+        if not self._waiters:
+            return
+        with self._lock:
+            events = [event for key in keys for event in self._waiters.get(key, ())]
+        for event in events:
+            event.set()
+
+    def wait(self, key, check, timeout):
+        """
+        Calls check() now and every time an event of the key arrives, until it returns a true value or
+        the deadline passes
+        :param key: Waited key
+        :param check: Function returning the waited result or false value
+        :param timeout: Seconds from now to the deadline
+        :return: Result of the last check()
+        """
+        deadline = time.monotonic() + timeout
+        event = self._add(key, threading.Event())
+        try:
+            while True:
+                result = check()
+                remaining = deadline - time.monotonic()
+                if result or remaining <= 0:
+                    return result
+                event.wait(remaining)
+                event.clear()
+        finally:
+            self._remove(key, event)
+
+    async def async_wait(self, key, check, timeout):
+        """
+        Coroutine version of wait(), the events may be notified from the event loop or from other threads
+        :param key: Waited key
+        :param check: Function returning the waited result or false value
+        :param timeout: Seconds from now to the deadline
+        :return: Result of the last check()
+        """
+        deadline = time.monotonic() + timeout
+        waiter = self._add(key, _LoopEvent())
+        try:
+            while True:
+                result = check()
+                remaining = deadline - time.monotonic()
+                if result or remaining <= 0:
+                    return result
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.event.clear()
+        finally:
+            self._remove(key, waiter)
+
+    def _add(self, key, event):
+        with self._lock:
+            self._waiters.setdefault(key, []).append(event)
+        return event
+
+    def _remove(self, key, event):
+        with self._lock:
+            waiters = self._waiters[key]
+            waiters.remove(event)
+            if not waiters:
+                del self._waiters[key]
+
+
+class EventLog:
+    """
+    Events of one notification type in arrival order. Works like a read-only list for the old users of
+    WebSocketRunner.events, and has indexes for the queries:
+    - by endpoint and by (endpoint, resource path): sequence numbers of the events in arrival order
+    - by arrival time: bisect on the monotonic arrival times
+
+    Every event gets a running sequence number. Cursor of a reader is the sequence number of the next unread
+    event, events after it are read with after().
+    Appending wakes the waiters of (type, endpoint) and (type, endpoint, path).
+
+    Retention policy limits are enforced on append. Evicted event leaves an empty slot, and the log is compacted
+    when most of the slots are empty, so eviction is amortized O(1) and the log size stays bounded also when
+    max_per_endpoint evicts from the middle. Evicted events are written to the spill file and can be read with
+    spilled().
+    """
+
+    def __init__(self, notification_type, waiters=None, retention=None, spill=None):
+        self.notification_type = notification_type
+        self.waiters = waiters if waiters is not None else Waiters()
+        self.retention = retention or RetentionPolicy()
+        self.spill = spill
+        self._lock = threading.RLock()
+        self._events = []
+        self._times = []
+        self._slot_seqs = []
+        self._next_seq = 0
+        self._head = 0
+        self._live = 0
+        self._bytes = 0
+        self._evicted = 0
+        self._by_endpoint = {}
+        self._by_path = {}
+
+    def append(self, event):
+        """
+        Stores the event, indexes it and evicts old events exceeding the retention limits
+        :param event: Event dict with 'ep' and, for notifications, 'path'
+        :return: Sequence number of the event
+        """
+        now = time.monotonic()
+        endpoint = event.get('ep')
+        path = event.get('path')
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._events.append(event)
+            self._times.append(now)
+            self._slot_seqs.append(seq)
+            self._live += 1
+            self._bytes += _event_size(event)
+            self._by_endpoint.setdefault(endpoint, deque()).append(seq)
+            if path is not None:
+                self._by_path.setdefault((endpoint, path), deque()).append(seq)
+            evicted = self._enforce(now, endpoint)
+        if evicted and self.spill is not None:
+            for evicted_seq, evicted_event in evicted:
+                self.spill.write(self.notification_type, evicted_seq, evicted_event)
+        self.waiters.notify((self.notification_type, endpoint), (self.notification_type, endpoint, path))
+        return seq
+
+    def _enforce(self, now, endpoint):
+        """
+        Evicts the oldest events exceeding the retention limits
+        :param now: Monotonic time
+        :param endpoint: Endpoint of the appended event
+        :return: List of (seq, event) evicted
+        """
+        retention = self.retention
+        evicted = []
+        if retention.max_per_endpoint is not None:
+            seqs = self._by_endpoint[endpoint]
+            while len(seqs) > retention.max_per_endpoint:
+                evicted.append(self._evict(self._slot(seqs[0])))
+        if retention.max_events is not None:
+            while self._live > retention.max_events:
+                evicted.append(self._evict(self._head))
+        if retention.max_age is not None:
+            cutoff = now - retention.max_age
+            while self._live and self._times[self._head] < cutoff:
+                evicted.append(self._evict(self._head))
+        empty = len(self._events) - self._live
+        if empty > COMPACT_THRESHOLD and empty * 2 > len(self._events):
+            self._compact()
+        return evicted
+
+    def _compact(self):
+        """
+        Drops the empty slots, sequence numbers of the events stay
+        """
+        slots = [index for index in range(self._head, len(self._events)) if self._events[index] is not None]
+        self._events = [self._events[index] for index in slots]
+        self._times = [self._times[index] for index in slots]
+        self._slot_seqs = [self._slot_seqs[index] for index in slots]
+        self._head = 0
+
+    def _slot(self, seq):
+        """
+        :param seq: Sequence number
+        :return: Index of the first slot with sequence number >= seq
+        """
+        return bisect_left(self._slot_seqs, seq)
+
+    def _evict(self, index):
+        """
+        Removes the event from the log and indexes. Evicted event is always the oldest one of its endpoint
+        and path, so it is first in their indexes.
+        :param index: Slot index of the event
+        :return: (seq, event)
+        """
+        seq = self._slot_seqs[index]
+        event = self._events[index]
+        self._events[index] = None
+        self._live -= 1
+        self._bytes -= _event_size(event)
+        self._evicted += 1
+        endpoint = event.get('ep')
+        self._pop_index(self._by_endpoint, endpoint, seq)
+        path = event.get('path')
+        if path is not None:
+            self._pop_index(self._by_path, (endpoint, path), seq)
+        while self._head < len(self._events) and self._events[self._head] is None:
+            self._head += 1
+        return seq, event
+
+    @staticmethod
+    def _pop_index(index, key, seq):
+        seqs = index[key]
+        if seqs[0] == seq:
+            seqs.popleft()
+        else:
+            seqs.remove(seq)
+        if not seqs:
+            del index[key]
+
+    @property
+    def next_seq(self):
+        """
+        :return: Sequence number the next event gets, i.e. cursor at the end
+        """
+        return self._next_seq
+
+    def _live_events(self, index=0):
+        """
+        :param index: Slot index to start from
+        :return: Stored events from the slot on
+        """
+        return [event for event in self._events[max(index, self._head):] if event is not None]
+
+    def __len__(self):
+        return self._live
+
+    def __bool__(self):
+        return self._live > 0
+
+    def __iter__(self):
+        return self.iter_after(0)
+
+    def iter_after(self, seq):
+        """
+        Iterates the stored events from the cursor on without copying the log. Events appended during the iteration
+        are left out, evicted ones are skipped until the log is compacted.
+        :param seq: Sequence number of the first wanted event
+        :return: Generator of the events
+        """
+        with self._lock:
+            events = self._events
+            start, stop = max(self._slot(seq), self._head), len(events)
+        for index in range(start, stop):
+            event = events[index]
+            if event is not None:
+                yield event
+
+    def __getitem__(self, index):
+        with self._lock:
+            if isinstance(index, slice):
+                return self._live_events()[index]
+            position = index + self._live if index < 0 else index
+            if not 0 <= position < self._live:
+                raise IndexError('EventLog index {} out of range'.format(index))
+            if self._live == len(self._events) - self._head:
+                return self._events[self._head + position]
+            # Skip the empty slots, walking from the nearer end
+            if position < self._live // 2:
+                slots, skip = range(self._head, len(self._events)), position
+            else:
+                slots, skip = range(len(self._events) - 1, self._head - 1, -1), self._live - 1 - position
+            for slot in slots:
+                if self._events[slot] is not None:
+                    if not skip:
+                        return self._events[slot]
+                    skip -= 1
+            raise IndexError('EventLog index {} out of range'.format(index))
+
+    def __repr__(self):
+        return '<EventLog {} with {} events>'.format(self.notification_type, self._live)
+
+    def _seqs(self, endpoint, path=None):
+        if path is None:
+            return self._by_endpoint.get(endpoint, ())
+        return self._by_path.get((endpoint, path), ())
+
+    @staticmethod
+    def _count_after(seqs, after):
+        """
+        :param seqs: Sequence numbers in ascending order
+        :param after: Count only sequence numbers >= after, None for all
+        :return: Count of the sequence numbers, counted from the end
+        """
+        if after is None:
+            return len(seqs)
+        count = 0
+        for seq in reversed(seqs):
+            if seq < after:
+                break
+            count += 1
+        return count
+
+    def find(self, endpoint, path=None, after=None):
+        """
+        Events of the endpoint or the endpoint's resource path
+        :param endpoint: Endpoint name, i.e. device id
+        :param path: Resource path
+        :param after: Only events with sequence number >= after
+        :return: List of the events in arrival order
+        """
+        with self._lock:
+            seqs = self._seqs(endpoint, path)
+            if after is None:
+                return [self._events[self._slot(seq)] for seq in seqs]
+            # Cursor readers want the newest events, walk from the end
+            events = []
+            for seq in reversed(seqs):
+                if seq < after:
+                    break
+                events.append(self._events[self._slot(seq)])
+            events.reverse()
+            return events
+
+    def read(self, endpoint, cursor, path=None):
+        """
+        Events of the endpoint (and path) from the cursor on, for incremental readers
+        :param endpoint: Endpoint name
+        :param cursor: Sequence number of the first unread event, 0 to read all
+        :param path: Resource path
+        :return: (list of events, cursor after them)
+        """
+        with self._lock:
+            return self.find(endpoint, path, after=cursor), self.next_seq
+
+    def first(self, endpoint, path=None, after=None):
+        """
+        :param endpoint: Endpoint name
+        :param path: Resource path
+        :param after: Only events with sequence number >= after
+        :return: First stored event of the endpoint (and path) or None
+        """
+        with self._lock:
+            seqs = self._seqs(endpoint, path)
+            count = self._count_after(seqs, after)
+            return self._events[self._slot(seqs[len(seqs) - count])] if count else None
+
+    def last(self, endpoint, path=None, after=None):
+        """
+        :param endpoint: Endpoint name
+        :param path: Resource path
+        :param after: Only events with sequence number >= after
+        :return: Latest event of the endpoint (and path) or None
+        """
+        with self._lock:
+            seqs = self._seqs(endpoint, path)
+            if not seqs or (after is not None and seqs[-1] < after):
+                return None
+            return self._events[self._slot(seqs[-1])]
+
+    def count(self, endpoint, path=None, after=None):
+        """
+        :param endpoint: Endpoint name
+        :param path: Resource path
+        :param after: Only events with sequence number >= after
+        :return: Count of the endpoint's (and path's) stored events
+        """
+        with self._lock:
+            return self._count_after(self._seqs(endpoint, path), after)
+
+    def endpoints(self):
+        """
+        :return: Endpoint names having stored events
+        """
+        return list(self._by_endpoint)
+
+    def after(self, seq):
+        """
+        Stored events from the cursor on, events evicted meanwhile are skipped
+        :param seq: Sequence number of the first wanted event
+        :return: (list of events, cursor after them)
+        """
+        with self._lock:
+            return self._live_events(self._slot(seq)), self.next_seq
+
+    def since(self, arrival_time):
+        """
+        Stored events arrived at or after the time
+        :param arrival_time: time.monotonic() timestamp
+        :return: List of events
+        """
+        with self._lock:
+            return self._live_events(bisect_left(self._times, arrival_time, self._head))
+
+    def spilled(self, endpoint=None, path=None):
+        """
+        Reads the evicted events from the spill file
+        :param endpoint: Only events of the endpoint
+        :param path: Only events of the resource path
+        :return: Generator of the evicted events, empty if spilling is off
+        """
+        if self.spill is None:
+            return iter(())
+        return self.spill.read(self.notification_type, endpoint, path)
+
+    def stats(self):
+        """
+        :return: Dict of stored, appended and evicted counts and estimated memory use
+        """
+        with self._lock:
+            return {'events': self._live,
+                    'appended': self.next_seq,
+                    'evicted': self._evicted,
+                    'endpoints': len(self._by_endpoint),
+                    'slots': len(self._events),
+                    'bytes': self._bytes}
+
+    def clear(self):
+        """
+        Drops the events, sequence numbers keep running
+        """
+        with self._lock:
+            self._events = []
+            self._times = []
+            self._slot_seqs = []
+            self._head = 0
+            self._live = 0
+            self._bytes = 0
+            self._by_endpoint = {}
+            self._by_path = {}
+
+
+class ResponseStore(dict):
+    """
+    Async-responses by async-id. The oldest responses are evicted, and spilled, when max_items is exceeded.
+    Response to an already stored async-id is counted as duplicate, it means the id was reused and the responses
+    may be mixed up. Round-trip latency of the ids from the allocator is observed to latency histogram.
+    :param max_items: Maximum stored responses, None for no limit
+    :param spill: SpillFile or None
+    :param allocator: AsyncIdAllocator whose ids have the send time
+    """
+
+    def __init__(self, max_items=None, spill=None, allocator=async_id_allocator):
+        super().__init__()
+        self.max_items = max_items
+        self.spill = spill
+        self.allocator = allocator
+        self.evicted = 0
+        self.duplicates = 0
+        self.latency = Histogram()
+        self._lock = threading.Lock()
+
+    def __setitem__(self, async_id, response):
+        evicted = None
+        sent = self.allocator.sent_at(async_id) if self.allocator is not None else None
+        with self._lock:
+            if async_id in self:
+                self.duplicates += 1
+                log.warning('Duplicate async-response for async-id {}'.format(async_id))
+            elif sent is not None:
+                self.latency.observe(max(0.0, getattr(response, 'received', time.time()) - sent))
+            if self.max_items is not None and async_id not in self and len(self) >= self.max_items:
+                oldest = next(iter(self))
+                evicted = (oldest, super().pop(oldest))
+                self.evicted += 1
+            super().__setitem__(async_id, response)
+        if evicted is not None and self.spill is not None:
+            self.spill.write(ASYNC_RESPONSES, evicted[0], evicted[1])
+
+    def spilled(self):
+        """
+        :return: Generator of the evicted async-responses, empty if spilling is off
+        """
+        if self.spill is None:
+            return iter(())
+        return self.spill.read(ASYNC_RESPONSES)
+
+    def stats(self):
+        """
+        :return: Dict of stored, evicted and duplicate counts, estimated memory use and round-trip latency
+        """
+        with self._lock:
+            return {'events': len(self), 'evicted': self.evicted, 'duplicates': self.duplicates,
+                    'bytes': sum(_event_size(response) for response in self.values()),
+                    'latency': {'count': self.latency.count,
+                                'p50': self.latency.quantile(0.5),
+                                'p95': self.latency.quantile(0.95),
+                                'max': self.latency.max}}
+
+
+class InFlightRequests:
+    """
+    Device requests waiting for their async-response, keyed by async-id. Register the async-id before sending
+    the request, the returned future is resolved with the response record as soon as it arrives:
+
+        future = in_flight.register(async_id, timeout=30)
+        cloud_api.connect.send_async_request_to_device(device_id, payload, async_id=async_id)
+        response = future.result(timeout=30)
+
+    Any number of requests can be waited at once with concurrent.futures.wait(), and coroutines can await
+    asyncio.wrap_future(future). Entries not resolved by their deadline are dropped and their futures fail with
+    concurrent.futures.TimeoutError, expiry runs whenever a request is registered or a response resolved.
+    A waiter giving up should cancel its future, cancelled futures are dropped right away.
+    :param responses: ResponseStore, response which arrived before registering resolves the future immediately
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.resolved = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._deadlines = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._futures)
+
+    def __contains__(self, async_id):
+        return async_id in self._futures
+
+    def register(self, async_id, timeout=30):
+        """
+        :param async_id: Async-id of the request
+        :param timeout: Seconds until the entry expires
+        :return: concurrent.futures.Future of the response, the same future if the async-id is already waited
+        """
+        self.expire()
+        with self._lock:
+            future = self._futures.get(async_id)
+            if future is None or future.done():
+                future = Future()
+                future.add_done_callback(functools.partial(self._discard, async_id))
+                self._futures[async_id] = future
+            heapq.heappush(self._deadlines, (time.monotonic() + timeout, next(self._counter), async_id, future))
+        response = self.responses.get(async_id)
+        if response is not None:
+            self.resolve(async_id, response)
+        return future
+
+    def resolve(self, async_id, response):
+        """
+        Resolves the future of the async-id
+        :param async_id: Async-id of the response
+        :param response: Async-response
+        :return: True if a request was waiting for the response
+        """
+        if not self._futures:
+            return False
+        self.expire()
+        with self._lock:
+            future = self._futures.pop(async_id, None)
+        if future is None or future.done():
+            return False
+        future.set_result(response)
+        self.resolved += 1
+        return True
+
+    def expire(self):
+        """
+        Drops the entries past their deadline, their futures fail with concurrent.futures.TimeoutError
+        :return: Count of expired entries
+        """
+        now = time.monotonic()
+        if not self._deadlines or self._deadlines[0][0] > now:
+            return 0
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, _, async_id, future = heapq.heappop(self._deadlines)
+                if self._futures.get(async_id) is future:
+                    del self._futures[async_id]
+                    expired.append((async_id, future))
+        for async_id, future in expired:
+            if not future.done():
+                future.set_exception(FutureTimeoutError('No async-response for async-id {}'.format(async_id)))
+                self.expired += 1
+        return len(expired)
+
+    def _discard(self, async_id, future):
+        """
+        Done callback of the futures, drops the entry of a cancelled future
+        """
+        if future.cancelled():
+            with self._lock:
+                if self._futures.get(async_id) is future:
+                    del self._futures[async_id]
+
+    def stats(self):
+        """
+        :return: Dict of waiting, resolved and expired counts
+        """
+        self.expire()
+        return {'in_flight': len(self._futures), 'resolved': self.resolved, 'expired': self.expired}
+
+
+class EventStore(dict):
+    """
+    Notification type -> EventLog. Log of an unknown notification type is created when first used.
+    All logs share the waiters, retention policy and spill file, async-responses are kept in async_responses and
+    requests waiting for them in in_flight.
+    :param retention: RetentionPolicy, defaults to RetentionPolicy.from_env()
+    :param notification_types: Notification types having a log from the start
+    """
+
+    def __init__(self, retention=None, notification_types=EVENT_TYPES):
+        self.waiters = Waiters()
+        self.retention = retention if retention is not None else RetentionPolicy.from_env()
+        self.spill = None
+        if self.retention.spill_path:
+            os.makedirs(self.retention.spill_path, exist_ok=True)
+            self.spill = SpillFile(os.path.join(self.retention.spill_path, 'websocket_events_{}_{}.jsonl.gz'.format(
+                os.getpid(), uuid.uuid4().hex[:8])))
+            log.info('Spilling evicted WebSocket events to {}'.format(self.spill.path))
+        self.async_responses = ResponseStore(self.retention.max_events, self.spill)
+        self.in_flight = InFlightRequests(self.async_responses)
+        super().__init__((notification_type, self._new_log(notification_type))
+                         for notification_type in notification_types)
+        self._lock = threading.Lock()
+
+    def _new_log(self, notification_type):
+        return EventLog(notification_type, self.waiters, self.retention, self.spill)
+
+    def __missing__(self, notification_type):
+        with self._lock:
+            if notification_type not in self:
+                log.debug('New notification type {}'.format(notification_type))
+                super().__setitem__(notification_type, self._new_log(notification_type))
+            return super().__getitem__(notification_type)
+
+    def add(self, notification_type, event):
+        """
+        Stores the event to its type log
+        :param notification_type: Notification type, e.g. 'notifications'
+        :param event: Event dict
+        :return: Sequence number of the event in its log
+        """
+        return self[notification_type].append(event)
+
+    def wait(self, notification_type, endpoint, check, timeout, path=None):
+        """
+        Waits until check() returns a true value, it is called again when the endpoint (and path) gets an event
+        :param notification_type: Notification type
+        :param endpoint: Endpoint name
+        :param check: Function returning the waited result or false value
+        :param timeout: Seconds to wait
+        :param path: Resource path
+        :return: Result of the last check()
+        """
+        key = (notification_type, endpoint) if path is None else (notification_type, endpoint, path)
+        return self.waiters.wait(key, check, timeout)
+
+    async def async_wait(self, notification_type, endpoint, check, timeout, path=None):
+        """
+        Coroutine version of wait()
+        :param notification_type: Notification type
+        :param endpoint: Endpoint name
+        :param check: Function returning the waited result or false value
+        :param timeout: Seconds to wait
+        :param path: Resource path
+        :return: Result of the last check()
+        """
+        key = (notification_type, endpoint) if path is None else (notification_type, endpoint, path)
+        return await self.waiters.async_wait(key, check, timeout)
+
+    def stats(self):
+        """
+        Memory and eviction statistics
+        :return: {notification type: stats dict, 'async-responses': stats dict, 'total': totals, 'spilled': count}
+        """
+        stats = {notification_type: event_log.stats() for notification_type, event_log in list(self.items())}
+        stats[ASYNC_RESPONSES] = self.async_responses.stats()
+        stats['total'] = {key: sum(item[key] for item in stats.values()) for key in ('events', 'evicted', 'bytes')}
+        stats['spilled'] = self.spill.written if self.spill is not None else 0
+        return stats
+
+    def clear_events(self):
+        """
+        Drops the events of all types
+        """
+        for event_log in list(self.values()):
+            event_log.clear()
+
+    def close(self):
+        """
+        Closes the spill file, spilled events can still be read
+        """
+        if self.spill is not None:
+            self.spill.close()
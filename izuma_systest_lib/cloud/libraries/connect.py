@@ -299,7 +299,7 @@ class ConnectAPI:
         """
         api_url = '/{}/device-requests/{}'.format(self.api_version, device_id)
 
-        async_params = {'async-id': '{}-{}'.format(device_id, utils.build_random_string(6))}
+        async_params = {'async-id': utils.next_async_id()}
 
         # Set payload
         payload_b64 = b64encode(value.encode('utf-8')).decode('utf-8')
@@ -343,7 +343,7 @@ class ConnectAPI:
 
         :param device_id: Device ID as 01751b38556200000000000100108a2f
         :param resource: Resource path as /3201/0/5853
-        :param async_id: Async_ID string or None when random string will be used
+        :param async_id: Async_ID string or None when unique id is allocated
         :param method: GET/PUT/POST/DELETE, defaults to GET
         :param payload: Payload string
         :param accept: The content type that the requesting client will accept
@@ -367,6 +367,6 @@ class ConnectAPI:
         request_data = {'method': method, 'uri': resource, 'payload-b64': payload_b64, 'accept': accept,
                         'content-type': content_type}
         if async_id is None:
-            async_id = utils.build_random_string(5)
+            async_id = utils.next_async_id()
         self.send_async_request_to_device(device_id, request_data=request_data, async_id=async_id, api_key=api_key)
         return async_id
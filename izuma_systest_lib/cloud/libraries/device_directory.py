@@ -21,6 +21,8 @@
 This module is for cloud's Device Directory API functions
 """
 
+from izuma_systest_lib.cloud.libraries.pagination import PageIterator
+
 
 class DeviceDirectoryAPI:
     """
@@ -89,6 +91,16 @@ class DeviceDirectoryAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_devices(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all devices page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'filter': 'state=registered'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the devices of GET /devices pages
+        """
+        return PageIterator(self.get_devices, query_params, api_key=api_key, **page_options)
+
     def suspend_device(self, device_id, block, api_key=None, expected_status_code=None):
         """
         Suspend a device
@@ -146,6 +158,16 @@ class DeviceDirectoryAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_device_events(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all device events page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'filter': 'device_id=<id>'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the device events of GET /device-events pages
+        """
+        return PageIterator(self.get_device_events, query_params, api_key=api_key, **page_options)
+
     def create_device_query(self, device_query_data, api_key=None, expected_status_code=None):
         """
         Create a device query
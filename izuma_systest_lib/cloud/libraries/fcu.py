@@ -61,14 +61,19 @@ class FcuAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
-    def download_factory_tool(self, api_key=None, expected_status_code=None):
+    def download_factory_tool(self, api_key=None, expected_status_code=None, destination=None, **download_options):
         """
         Download factory tool
         :param api_key: Authentication key
         :param expected_status_code: Asserts the result in the function
-        :return: GET /downloads/fcu/factory_configurator_utility.zip
+        :param destination: File path or writable sink to stream the zip to, without it the zip is read in memory
+        :param download_options: RestAPI.download() options, e.g. progress, chunk_size, expected_checksum
+        :return: GET /downloads/fcu/factory_configurator_utility.zip response, or DownloadResult with destination
         """
         api_url = '/downloads/fcu/factory_configurator_utility.zip'
 
+        if destination is not None:
+            return self.cloud_api.download(api_url, destination, api_key, expected_status_code=expected_status_code,
+                                           **download_options)
         r = self.cloud_api.get(api_url, api_key, expected_status_code=expected_status_code)
         return r
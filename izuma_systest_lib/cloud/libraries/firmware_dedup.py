@@ -0,0 +1,276 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for reusing already uploaded firmware images and manifests
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+FIRMWARE_INDEX_PATH = os.getenv('FIRMWARE_INDEX_PATH', default='firmware_index.json')
+# Manifests have no checksum field, so the content hash is stored to their description
+MANIFEST_HASH_TAG = '[sha256:{}]'
+IMAGES = 'images'
+MANIFESTS = 'manifests'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """
+    :param path: File path
+    :return: sha256 hex digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FirmwareDedupCache:
+    """
+    Content addressed cache of uploaded firmware images and manifests. File is uploaded only if the account
+    doesn't have it yet, otherwise id of the existing one is reused.
+
+    Lookup order for a file's sha256:
+    1. Local index file, {api gw: {'images'/'manifests': {sha256: entry}}}. Indexed id is checked to still exist
+       with the same content, stale entries are dropped.
+    2. The account: images by datafile_checksum, manifests by the hash tag in their description.
+    3. Upload, manifests get the hash tag appended to the description.
+
+    The index is shared by the test sessions, writes are merged with the file content under an exclusive lock of
+    the index lock file, so parallel sessions, e.g. pytest-xdist workers, don't lose each other's entries.
+    Where file locks aren't available (Windows) only the threads of one session are synchronized.
+    clean_stale() removes images and manifests not used for a while from the account and index in bulk.
+    Needs synchronous UpdateAPI, i.e. IzumaCloud.update.
+    :param update_api: UpdateAPI
+    :param index_path: Index file path, defaults to FIRMWARE_INDEX_PATH env variable or firmware_index.json
+    :param api_key: Authentication key
+    """
+
+    def __init__(self, update_api, index_path=None, api_key=None):
+        self.update_api = update_api
+        self.index_path = index_path or FIRMWARE_INDEX_PATH
+        self.api_key = api_key
+        self.namespace = update_api.cloud_api.api_gw
+        self.hits = 0
+        self.uploads = 0
+        self._lock = threading.Lock()
+        self._removed = {IMAGES: set(), MANIFESTS: set()}
+        self._entries = self._load().get(self.namespace, {})
+        for kind in (IMAGES, MANIFESTS):
+            self._entries.setdefault(kind, {})
+
+    def _load(self):
+        """
+        :return: Whole index file content
+        """
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.warning('Ignoring broken firmware index {} - {}'.format(self.index_path, e))
+            return {}
+
+    def _save(self):
+        """
+        Merges the changes to the index file, other sessions may have written it meanwhile
+        """
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        os.makedirs(directory, exist_ok=True)
+        with open('{}.lock'.format(self.index_path), 'a', encoding='utf-8') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._load()
+                section = index.setdefault(self.namespace, {})
+                for kind in (IMAGES, MANIFESTS):
+                    entries = section.setdefault(kind, {})
+                    for content_hash in self._removed[kind]:
+                        entries.pop(content_hash, None)
+                    entries.update(self._entries[kind])
+                temp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(index, f, indent=2, sort_keys=True)
+                os.replace(temp_path, self.index_path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _remember(self, kind, content_hash, item):
+        now = time.time()
+        with self._lock:
+            entry = self._entries[kind].get(content_hash)
+            if entry is None or entry['id'] != item['id']:
+                entry = {'id': item['id'], 'name': item.get('name'), 'created': now}
+            entry['last_used'] = now
+            self._entries[kind][content_hash] = entry
+            self._removed[kind].discard(content_hash)
+            self._save()
+
+    def _forget(self, kind, content_hash):
+        with self._lock:
+            self._entries[kind].pop(content_hash, None)
+            self._removed[kind].add(content_hash)
+            self._save()
+
+    @staticmethod
+    def _matches(kind, item, content_hash):
+        """
+        Checks that the cloud item has the content
+        :param kind: 'images' or 'manifests'
+        :param item: Image or manifest json
+        :param content_hash: sha256 hex digest
+        :return: True/False
+        """
+        if kind == IMAGES:
+            return item.get('datafile_checksum') == content_hash
+        return MANIFEST_HASH_TAG.format(content_hash) in (item.get('description') or '')
+
+    def _get(self, kind, item_id):
+        if kind == IMAGES:
+            return self.update_api.get_firmware_image(item_id, api_key=self.api_key)
+        return self.update_api.get_firmware_manifest(item_id, api_key=self.api_key)
+
+    def _delete(self, kind, item_id):
+        if kind == IMAGES:
+            return self.update_api.delete_firmware_image(item_id, api_key=self.api_key)
+        return self.update_api.delete_firmware_manifest(item_id, api_key=self.api_key)
+
+    def _indexed(self, kind, content_hash):
+        """
+        Finds the content from the index and checks it still exists in the account
+        :return: Image or manifest json or None
+        """
+        entry = self._entries[kind].get(content_hash)
+        if entry is None:
+            return None
+        r = self._get(kind, entry['id'])
+        if r.status_code == 200 and self._matches(kind, r.json(), content_hash):
+            return r.json()
+        log.info('Dropping stale firmware index entry {} {} - {}'.format(kind, entry['id'], r.status_code))
+        self._forget(kind, content_hash)
+        return None
+
+    def _search(self, kind, content_hash):
+        """
+        Finds the content from the account
+        :return: Image or manifest json or None
+        """
+        if kind == IMAGES:
+            items = self.update_api.iterate_firmware_images({'datafile_checksum__eq': content_hash},
+                                                            api_key=self.api_key)
+        else:
+            items = self.update_api.iterate_firmware_manifests(api_key=self.api_key)
+        with items:
+            for item in items:
+                if self._matches(kind, item, content_hash):
+                    return item
+        return None
+
+    def _find(self, kind, content_hash):
+        item = self._indexed(kind, content_hash) or self._search(kind, content_hash)
+        if item is not None:
+            self.hits += 1
+            log.info('Reusing firmware {} {} for content {}'.format(kind[:-1], item['id'], content_hash))
+            self._remember(kind, content_hash, item)
+        return item
+
+    def firmware_image(self, firmware_binary_path, firmware_data=None):
+        """
+        Finds or uploads the firmware image
+        :param firmware_binary_path: Path to firmware binary
+        :param firmware_data: Firmware form fields used on upload, e.g. name and description
+        :return: Firmware image json
+        """
+        content_hash = file_sha256(firmware_binary_path)
+        item = self._find(IMAGES, content_hash)
+        if item is None:
+            item = self.update_api.upload_firmware_image(firmware_binary_path, firmware_data, api_key=self.api_key,
+                                                         expected_status_code=201).json()
+            self.uploads += 1
+            self._remember(IMAGES, content_hash, item)
+        return item
+
+    def firmware_manifest(self, manifest_file_path, manifest_data=None):
+        """
+        Finds or uploads the firmware manifest
+        :param manifest_file_path: Manifest file to post
+        :param manifest_data: Manifest form fields used on upload, e.g. name and description
+        :return: Firmware manifest json
+        """
+        content_hash = file_sha256(manifest_file_path)
+        item = self._find(MANIFESTS, content_hash)
+        if item is None:
+            manifest_data = dict(manifest_data or {})
+            tag = MANIFEST_HASH_TAG.format(content_hash)
+            manifest_data['description'] = ' '.join(filter(None, [manifest_data.get('description'), tag]))
+            item = self.update_api.upload_firmware_manifest(manifest_file_path, manifest_data, api_key=self.api_key,
+                                                            expected_status_code=201).json()
+            self.uploads += 1
+            self._remember(MANIFESTS, content_hash, item)
+        return item
+
+    def clean_stale(self, max_age=7 * 24 * 3600, max_workers=8):
+        """
+        Deletes the indexed images and manifests not used within max_age from the account and the index.
+        Manifests are deleted before the images. Items still in use, e.g. by a campaign, are kept.
+        :param max_age: Seconds since last use
+        :param max_workers: Concurrent delete requests
+        :return: {'images': [deleted ids], 'manifests': [deleted ids]}
+        """
+        cutoff = time.time() - max_age
+        deleted = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='firmware_janitor') as executor:
+            for kind in (MANIFESTS, IMAGES):
+                stale = [(content_hash, entry['id']) for content_hash, entry in list(self._entries[kind].items())
+                         if entry.get('last_used', 0) < cutoff]
+                responses = executor.map(lambda item, kind=kind: self._delete(kind, item[1]), stale)
+                deleted[kind] = []
+                for (content_hash, item_id), r in zip(stale, responses):
+                    if r.status_code in (204, 404):
+                        deleted[kind].append(item_id)
+                        self._forget(kind, content_hash)
+                    else:
+                        log.warning('Keeping firmware {} {} - delete response {}'.format(kind[:-1], item_id,
+                                                                                         r.status_code))
+        log.info('Firmware janitor deleted {} manifests and {} images'.format(
+            len(deleted[MANIFESTS]), len(deleted[IMAGES])))
+        return deleted
+
+    def stats(self):
+        """
+        :return: Dict of reused and uploaded counts and index sizes
+        """
+        return {'hits': self.hits, 'uploads': self.uploads,
+                'images': len(self._entries[IMAGES]), 'manifests': len(self._entries[MANIFESTS])}
@@ -0,0 +1,259 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for chunked firmware image uploads with the cloud's upload jobs API
+"""
+
+import logging
+import mmap
+import os
+import time
+from base64 import b64encode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+
+import requests
+
+log = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def _content_md5(view):
+    """
+    :param view: Memoryview of the chunk, released when hashed
+    :return: Base64 encoded MD5 digest for Content-MD5 header
+    """
+    with view:
+        return b64encode(md5(view).digest()).decode('utf-8')
+
+
+class ChunkedUploadResult:
+    """
+    Result of ChunkedFirmwareUpload.upload()
+    """
+
+    def __init__(self, path, job_id, size, resumed_from, chunks, retries, elapsed, job=None):
+        """
+        :param path: Uploaded file
+        :param job_id: Upload job id
+        :param size: File size
+        :param resumed_from: Offset where the upload continued from, 0 for new job
+        :param chunks: Count of chunks sent by this upload
+        :param retries: Count of failed chunk requests
+        :param elapsed: Upload time in seconds
+        :param job: Upload job json after the upload
+        """
+        self.path = path
+        self.job_id = job_id
+        self.size = size
+        self.resumed_from = resumed_from
+        self.chunks = chunks
+        self.retries = retries
+        self.elapsed = elapsed
+        self.job = job or {}
+
+    @property
+    def firmware_image_id(self):
+        return self.job.get('firmware_image_id') or None
+
+    @property
+    def uploaded(self):
+        """
+        :return: Bytes sent by this upload
+        """
+        return self.size - self.resumed_from
+
+    @property
+    def throughput(self):
+        """
+        :return: Sent bytes per second
+        """
+        return self.uploaded / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return '<ChunkedUploadResult job {} {} bytes in {} chunks, {:.2f} MiB/s>'.format(
+            self.job_id, self.size, self.chunks, self.throughput / (1024 * 1024))
+
+
+class ChunkedFirmwareUpload:
+    """
+    Uploads firmware images in chunks with the upload jobs API: create job, append chunks, finish with
+    an empty chunk.
+
+    The image is memory mapped and each chunk is a memoryview slice sent as is, so chunks aren't copied.
+    The cloud appends the chunks of one job in order, so they are sent one by one, but Content-MD5 of the next
+    chunks is computed in worker threads while the current chunk is being sent. Several images are uploaded in
+    parallel jobs with upload_many().
+    Failed chunk is resent after checking from the chunks metadata how much the cloud has, and an interrupted
+    upload is continued by passing its job_id to upload(). Already uploaded chunks are checked against
+    the local file.
+
+    Needs synchronous UpdateAPI, i.e. IzumaCloud.update.
+    :param update_api: UpdateAPI
+    :param chunk_size: Chunk size in bytes
+    :param digest_workers: How many chunks ahead Content-MD5 is computed
+    :param max_retries: Resend count of one failed chunk
+    :param progress: Callback progress(uploaded bytes, total bytes) called after each chunk
+    :param api_key: Authentication key
+    """
+
+    def __init__(self, update_api, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, digest_workers=2, max_retries=3,
+                 progress=None, api_key=None):
+        self.update_api = update_api
+        self.chunk_size = chunk_size
+        self.digest_workers = max(1, digest_workers)
+        self.max_retries = max_retries
+        self.progress = progress
+        self.api_key = api_key
+
+    def upload(self, firmware_binary_path, upload_job_data=None, job_id=None):
+        """
+        Uploads one image
+        :param firmware_binary_path: Path to firmware binary
+        :param upload_job_data: Payload of the created job, e.g. {'name': 'edge-os', 'description': '...'}
+        :param job_id: Id of an existing upload job to continue
+        :return: ChunkedUploadResult
+        """
+        size = os.path.getsize(firmware_binary_path)
+        if size == 0:
+            raise ValueError('Firmware image {} is empty'.format(firmware_binary_path))
+
+        resume = job_id is not None
+        if not resume:
+            if upload_job_data is None:
+                upload_job_data = {'name': os.path.basename(firmware_binary_path)}
+            job_id = self.update_api.create_firmware_upload_job(upload_job_data, api_key=self.api_key,
+                                                                expected_status_code=201).json()['id']
+            log.info('Created upload job {} for {} ({} bytes)'.format(job_id, firmware_binary_path, size))
+
+        time_start = time.perf_counter()
+        with open(firmware_binary_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image, \
+                ThreadPoolExecutor(max_workers=self.digest_workers, thread_name_prefix='chunk_md5') as executor:
+            view = memoryview(image)
+            try:
+                offset = resumed_from = self._uploaded_offset(job_id, view) if resume else 0
+                if resumed_from:
+                    log.info('Continuing upload job {} from {} of {} bytes'.format(job_id, resumed_from, size))
+                chunks, retries = self._send_chunks(job_id, view, offset, executor)
+            finally:
+                view.release()
+
+        self.update_api.upload_firmware_chunk(job_id, b'', api_key=self.api_key, expected_status_code=201)
+        elapsed = time.perf_counter() - time_start
+        job = self.update_api.get_firmware_upload_job(job_id, api_key=self.api_key, expected_status_code=200).json()
+
+        result = ChunkedUploadResult(firmware_binary_path, job_id, size, resumed_from, chunks, retries, elapsed, job)
+        log.info('Uploaded {} bytes of {} in {} chunks in {:.2f} s - {:.2f} MiB/s, {} retries'.format(
+            result.uploaded, firmware_binary_path, chunks, elapsed, result.throughput / (1024 * 1024), retries))
+        return result
+
+    def upload_many(self, firmware_binary_paths, upload_job_data=None, max_workers=4):
+        """
+        Uploads several images in parallel jobs
+        :param firmware_binary_paths: Paths to firmware binaries
+        :param upload_job_data: {path: upload job payload}, job name defaults to the file name
+        :param max_workers: Count of concurrent uploads
+        :return: List of ChunkedUploadResult in the order of the paths
+        """
+        upload_job_data = upload_job_data or {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chunked_upload') as executor:
+            futures = [executor.submit(self.upload, path, upload_job_data.get(path)) for path in firmware_binary_paths]
+            return [future.result() for future in futures]
+
+    def _send_chunks(self, job_id, view, offset, executor):
+        """
+        Sends the chunks from offset to the end, Content-MD5 of the next chunks is computed in background
+        :param job_id: Upload job id
+        :param view: Memoryview of the whole image
+        :param offset: Start offset
+        :param executor: Executor for the digests
+        :return: (sent chunks, retries)
+        """
+        size = len(view)
+        chunks = retries = attempt = 0
+        digests = deque()
+        next_offset = offset
+        while offset < size:
+            # Keep digest_workers chunks hashed ahead of the one being sent
+            while next_offset < size and len(digests) <= self.digest_workers:
+                end = min(next_offset + self.chunk_size, size)
+                digests.append((next_offset, end, executor.submit(_content_md5, view[next_offset:end])))
+                next_offset = end
+
+            chunk_offset, end, digest = digests[0]
+            with view[chunk_offset:end] as chunk:
+                try:
+                    r = self.update_api.upload_firmware_chunk(job_id, chunk, api_key=self.api_key,
+                                                              content_md5=digest.result())
+                    error = None if r.status_code == 201 else 'status code {}'.format(r.status_code)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = str(e)
+
+            if error is None:
+                digests.popleft()
+                offset = end
+                chunks += 1
+                attempt = 0
+                if self.progress is not None:
+                    self.progress(offset, size)
+                continue
+
+            retries += 1
+            attempt += 1
+            assert attempt <= self.max_retries, 'Chunk {}-{} of upload job {} failed {} times - {}'.format(
+                chunk_offset, end, job_id, attempt, error)
+            log.warning('Chunk {}-{} of upload job {} failed - {}, resending ({}/{})'.format(
+                chunk_offset, end, job_id, error, attempt, self.max_retries))
+            time.sleep(2 ** (attempt - 1))
+            # The chunk may have been stored even if the response was lost
+            uploaded = self._uploaded_offset(job_id, view)
+            if uploaded != offset:
+                if uploaded > offset:
+                    attempt = 0
+                digests.clear()
+                offset = next_offset = uploaded
+        return chunks, retries
+
+    def _uploaded_offset(self, job_id, view):
+        """
+        Reads the uploaded chunks of the job and checks them against the local image
+        :param job_id: Upload job id
+        :param view: Memoryview of the whole image
+        :return: Bytes the cloud has
+        """
+        offset = 0
+        chunks = sorted(self.update_api.iterate_firmware_upload_job_chunks(job_id, api_key=self.api_key,
+                                                                           prefetch=False),
+                        key=lambda chunk: chunk['id'])
+        for chunk in chunks:
+            length = int(chunk.get('length', 0))
+            end = offset + length
+            assert end <= len(view), 'Upload job {} has {} bytes, more than the {} bytes image'.format(
+                job_id, end, len(view))
+            stored_hash = chunk.get('hash')
+            if stored_hash and length:
+                with view[offset:end] as data:
+                    digest = md5(data)
+                assert stored_hash in (digest.hexdigest(), b64encode(digest.digest()).decode('utf-8')), \
+                    'Chunk {} of upload job {} doesn\'t match to the image at {}-{}'.format(
+                        chunk['id'], job_id, offset, end)
+            offset = end
+        return offset
@@ -21,6 +21,8 @@
 This module is for cloud's gateway logs API functions
 """
 
+from izuma_systest_lib.cloud.libraries.pagination import PageIterator
+
 
 class GatewayLogsAPI:
     """
@@ -58,6 +60,16 @@ class GatewayLogsAPI:
         resp = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return resp
 
+    def iterate_device_logs(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all device logs page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'device_id__eq': '<id>'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the device logs of GET /v3/device-logs pages
+        """
+        return PageIterator(self.get_all_device_logs_with_filter, query_params, api_key=api_key, **page_options)
+
     def get_all_device_logs_with_device_log_id(self, log_id, api_key=None, expected_status_code=None):
         """
         Get all devices logs
@@ -26,6 +26,7 @@ import logging
 import os
 
 import izuma_systest_lib.tools as utils
+from izuma_systest_lib.cloud.libraries.pagination import PageIterator
 
 log = logging.getLogger(__name__)
 
@@ -349,6 +350,16 @@ class IamAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_users(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all users page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'status__eq': 'ACTIVE'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the users of GET /users pages
+        """
+        return PageIterator(self.get_users, query_params, api_key=api_key, **page_options)
+
     def update_user(self, user_id, new_user_data, root_user=False, api_key=None, expected_status_code=None):
         """
         Update the user info
@@ -428,6 +439,16 @@ class IamAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_api_keys(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all API keys page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'order': 'ASC'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the API keys of GET /api-keys pages
+        """
+        return PageIterator(self.get_api_keys, query_params, api_key=api_key, **page_options)
+
     def update_api_key(self, api_key_id, api_key_data, api_key=None, expected_status_code=None):
         """
         Update api key details
@@ -0,0 +1,162 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for iterating cursor paginated list endpoints of the cloud
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+
+
+class PageIterator:
+    """
+    Iterates all items of a cursor paginated list endpoint, e.g. GET /v3/devices.
+    Pages are requested lazily by following 'has_more' and the 'after' cursor (id of the last item). While the
+    items of one page are consumed, next page is already requested in background thread, so only two pages are
+    kept in memory at a time.
+
+    Example:
+        for device in cloud_api.device_directory.iterate_devices({'filter': 'state=registered'}, max_items=5000):
+            ...
+
+        with PageIterator(cloud_api.iam.get_users, page_size=50, max_pages=2) as users:
+            names = [user['username'] for user in users]
+
+    Iterating can be stopped at any time with break or close(), request running in background is then abandoned.
+    :param list_function: Library function for one page, called as list_function(query_params=..., **kwargs)
+    :param query_params: Query params of the list request, e.g. {'filter': 'state=registered'}
+    :param page_size: Items per page, defaults to 'limit' in query params or DEFAULT_PAGE_SIZE
+    :param max_items: Stop after this many items
+    :param max_pages: Stop after this many pages
+    :param prefetch: Request next page in background while the current one is consumed
+    :param kwargs: Other arguments for the list function, e.g. api_key
+    """
+
+    def __init__(self, list_function, query_params=None, page_size=None, max_items=None, max_pages=None,
+                 prefetch=True, **kwargs):
+        self._list_function = list_function
+        self._query_params = dict(query_params or {})
+        self._page_size = int(page_size or self._query_params.get('limit', DEFAULT_PAGE_SIZE))
+        self._max_items = max_items
+        self._max_pages = max_pages
+        self._kwargs = kwargs
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='page_prefetch') if prefetch else None
+        self._pending = None
+        self._closed = False
+        self.items_read = 0
+        self.pages_read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        for page in self.pages():
+            for item in page:
+                yield item
+                self.items_read += 1
+                if self._max_items is not None and self.items_read >= self._max_items:
+                    self.close()
+                    return
+
+    def close(self):
+        """
+        Stops the iteration and abandons the page request running in background
+        """
+        self._closed = True
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _page_limit(self, items_requested):
+        """
+        Page size for the next request, smaller than page size when max_items is nearly reached
+        :param items_requested: Items requested so far
+        :return: Limit for the next request
+        """
+        if self._max_items is None:
+            return self._page_size
+        return max(1, min(self._page_size, self._max_items - items_requested))
+
+    def _fetch(self, after, limit):
+        """
+        Requests one page
+        :param after: Cursor, id of the last item of previous page or None for the first page
+        :param limit: Page size
+        :return: Response json
+        """
+        params = dict(self._query_params)
+        params['limit'] = limit
+        if after is not None:
+            params['after'] = after
+        log.debug('Requesting page {} with limit {} after "{}"'.format(self.pages_read + 1, limit, after))
+        return self._list_function(query_params=params, expected_status_code=200, **self._kwargs).json()
+
+    def _request_page(self, after, limit):
+        """
+        Starts the page request, in background thread if prefetch is on
+        :return: Future or response json
+        """
+        if self._executor is None:
+            return self._fetch(after, limit)
+        return self._executor.submit(self._fetch, after, limit)
+
+    def pages(self):
+        """
+        Iterates the pages
+        :return: Generator yielding the 'data' list of each page
+        """
+        try:
+            items_requested = 0
+            limit = self._page_limit(items_requested)
+            request = self._request_page(None, limit)
+            while not self._closed:
+                page = request.result() if self._executor is not None else request
+                self._pending = None
+                self.pages_read += 1
+                data = page.get('data', [])
+                items_requested += len(data)
+
+                has_more = page.get('has_more', False) and len(data) > 0
+                if self._max_pages is not None and self.pages_read >= self._max_pages:
+                    has_more = False
+                if self._max_items is not None and items_requested >= self._max_items:
+                    has_more = False
+
+                if has_more:
+                    limit = self._page_limit(items_requested)
+                    request = self._request_page(data[-1]['id'], limit)
+                    if self._executor is not None:
+                        self._pending = request
+
+                yield data
+
+                if not has_more:
+                    break
+        finally:
+            # Runs also when the caller breaks out of the loop and the generator is closed
+            self.close()
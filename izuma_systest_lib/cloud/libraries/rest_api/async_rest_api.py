@@ -0,0 +1,436 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2020-2021, Pelion and affiliates.
+# Copyright (c) 2022, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for asyncio RestAPI connection made with aiohttp library
+"""
+
+import asyncio
+import datetime
+import inspect
+import json
+import logging
+import os
+import ssl
+import time
+from urllib.parse import urlencode
+
+import aiohttp
+
+from izuma_systest_lib.cloud.libraries.rest_api.download import DEFAULT_CHUNK_SIZE, DownloadResult, DownloadTarget
+from izuma_systest_lib.cloud.libraries.rest_api.multipart import DEFAULT_UPLOAD_CHUNK_SIZE, MultipartUpload
+from izuma_systest_lib.cloud.libraries.rest_api.rest_api import REST_TIMEOUT, RestAPI
+from izuma_systest_lib.tools import assert_status, config_flag
+
+log = logging.getLogger(__name__)
+
+
+class RestRequest:
+    """
+    Sent request info of RestResponse
+    """
+
+    def __init__(self, method, url, headers, body):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+
+class RestResponse:
+    """
+    Fully read aiohttp response. Provides the same attributes as requests.Response so that
+    the logging, assert_status() and test cases work with both RestAPI and AsyncRestAPI responses.
+    """
+
+    def __init__(self, response, content, request_headers, request_body, elapsed):
+        """
+        :param response: aiohttp.ClientResponse
+        :param content: Read response body
+        :param request_headers: Sent request headers
+        :param request_body: Sent request body
+        :param elapsed: Time spent on request in seconds
+        """
+        self.status_code = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.encoding = response.charset or 'utf-8'
+        self.content = content
+        self.elapsed = datetime.timedelta(seconds=elapsed)
+        self.request = RestRequest(response.method, self.url, request_headers, request_body)
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self, **kwargs):
+        return json.loads(self.text, **kwargs)
+
+    def __repr__(self):
+        return '<Response [{}]>'.format(self.status_code)
+
+
+class AsyncRestAPI(RestAPI):
+    """
+    Asyncio Rest API connection class - uses aiohttp library
+    https://docs.aiohttp.org/en/stable/client.html
+
+    Has the same request functions, logging, cURL logging, expected_status_code assertion and client certificate
+    handling as RestAPI, but get/put/post/delete/patch/head/options, login and logout return awaitables:
+        r = await rest_api.get('/v3/devices/{}'.format(device_id), expected_status_code=200)
+
+    Library classes (ConnectAPI, DeviceDirectoryAPI, ...) work on top of it as they are, see AsyncIzumaCloud.
+    Connections are pooled by aiohttp connector, limit is set with rest_async_connection_limit config key.
+    Session is opened on first request inside the running event loop, close it with 'await close()'.
+    Traffic is not recorded to or replayed from rest_cassette.
+    Streaming download() and upload() return awaitables as well.
+    """
+
+    def _init_session(self, config, session):
+        """
+        Sets the aiohttp session used for requests
+        :param config: Config data
+        :param session: aiohttp.ClientSession given by the caller or None to create own one on first request
+        """
+        if self.cassette is not None:
+            log.warning('Cassette {} is not used by AsyncRestAPI, requests are sent to the cloud'.format(
+                self.cassette.path))
+        self._connection_limit = int(config.get('rest_async_connection_limit', 100))
+        self._keep_alive = config_flag(config, 'rest_keep_alive', True)
+        self._ssl_contexts = {}
+        self._session = session
+
+    def __enter__(self):
+        raise TypeError('Use "async with" with AsyncRestAPI')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):  # pylint: disable=invalid-overridden-method
+        """
+        Closes the aiohttp session if it was opened by this object
+        """
+        if self._owns_session and self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    @property
+    def session(self):
+        """
+        Returns aiohttp.ClientSession used for the requests, opens it when needed
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._connection_limit, force_close=not self._keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._owns_session = True
+        return self._session
+
+    def _ssl_context(self, certificate):
+        """
+        Creates SSL context for the client certificate
+        :param certificate: (certificate file, private key file) tuple or certificate file name
+        :return: SSL context or True for default verification
+        """
+        if not certificate:
+            return True
+        if certificate not in self._ssl_contexts:
+            context = ssl.create_default_context()
+            if isinstance(certificate, (tuple, list)):
+                context.load_cert_chain(certificate[0], certificate[1])
+            else:
+                context.load_cert_chain(certificate)
+            self._ssl_contexts[certificate] = context
+        return self._ssl_contexts[certificate]
+
+    @staticmethod
+    def _form_data(request_data, files):
+        """
+        Builds multipart form from the payload fields and files in requests library format
+        :param request_data: Payload fields as dict or json string
+        :param files: {field name: file object or (file name, file object[, content type])}
+        :return: aiohttp.FormData
+        """
+        form = aiohttp.FormData()
+        if isinstance(request_data, str):
+            request_data = json.loads(request_data)
+        for name, value in (request_data or {}).items():
+            form.add_field(name, str(value))
+        for name, value in files.items():
+            content_type = None
+            if isinstance(value, (tuple, list)):
+                filename, file_obj = value[0], value[1]
+                if len(value) > 2:
+                    content_type = value[2]
+            else:
+                file_obj = value
+                filename = os.path.basename(getattr(value, 'name', name))
+            form.add_field(name, file_obj, filename=filename, content_type=content_type)
+        return form
+
+    @staticmethod
+    async def _stream_data(stream, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE):
+        """
+        Reads a file like request body in chunks for aiohttp
+        :param stream: Object with read() method, e.g. MultipartUpload
+        :param chunk_size: Bytes read at a time
+        :return: Async generator of the body chunks
+        """
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            yield chunk
+
+    def _do_request(self, method, api_url, request_headers=None, certificate=None, request_data=None, files=None,
+                    timeout=REST_TIMEOUT, logged_payload=None, expected_status_code=None, **kwargs):
+        """
+        Function creating the actual rest request coroutine
+        :param method: Request method 'get/put/post/etc'
+        :param api_url: API url
+        :param request_headers: Request headers
+        :param timeout: Request timeout
+        :param certificate: Certificate
+        :param request_data: Request payload data
+        :param files: Files to send
+        :param expected_status_code: Expected response status code
+        :param kwargs: Other arguments used in the request. https://docs.aiohttp.org/en/stable/client_reference.html
+        :return: Awaitable request response
+        """
+        # Caller is taken now, the coroutine is run later
+        caller = inspect.currentframe().f_back.f_code.co_name.upper()
+        return self._request(caller, method, api_url, request_headers, certificate, request_data, files,
+                             timeout, logged_payload, expected_status_code, **kwargs)
+
+    async def _request(self, caller, method, api_url, request_headers, certificate, request_data, files, timeout,
+                       logged_payload, expected_status_code, **kwargs):
+        """
+        Coroutine making the actual rest request, see _do_request() for the parameters
+        :return: RestResponse
+        """
+        if not certificate:
+            certificate = self._client_certificate_and_key
+        cache_key, entry, fresh, request_headers = self._cache_lookup(method, api_url, request_headers, certificate,
+                                                                      **kwargs)
+        if fresh:
+            r = entry.response
+            self._log_cached_response(method, api_url, r)
+            if expected_status_code is not None:
+                assert_status(r, caller, expected_status_code, api_url)
+            return r
+
+        self._log_request(method, api_url, request_headers, request_data, logged_payload, **kwargs)
+        resendable = self._resendable(request_data, files)
+        request_body = request_data
+        if files is not None:
+            request_data = self._form_data(request_data, files)
+        elif not resendable:
+            request_data = self._stream_data(request_data)
+
+        try:
+            attempt = 0
+            while True:
+                if self.throttle is not None:
+                    await self.throttle.acquire_async(api_url)
+                time_start = time.perf_counter()
+
+                async with self.session.request(method.upper(), api_url, headers=request_headers, data=request_data,
+                                                ssl=self._ssl_context(certificate),
+                                                timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as resp:
+                    content = await resp.read()
+
+                time_end = time.perf_counter()
+
+                r = RestResponse(resp, content, request_headers, request_body, time_end - time_start)
+                self._write_log_response(method.upper(), api_url, r, time_end - time_start)
+                if self.throttle is None or not self.throttle.should_retry(method, api_url, r.status_code, r.headers,
+                                                                           attempt, resendable=resendable):
+                    break
+                attempt += 1
+            r = self._cache_response(cache_key, entry, r)
+            if expected_status_code is not None:
+                assert_status(r, caller, expected_status_code, api_url)
+            return r
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if self.metrics is not None:
+                self.metrics.record(method, api_url, 'error', time.perf_counter() - time_start)
+            log.error('aiohttp library raised exception for call {} {} - '
+                      'expected status code: {} - exception message: {}'.format(method.upper(), api_url,
+                                                                                expected_status_code, e))
+            raise
+
+    def download(self, api_url, destination, api_key=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None,
+                 checksum='sha256', expected_checksum=None, resume=True, max_resumes=3, expected_status_code=None,
+                 **kwargs):
+        """
+        Streaming GET writing the response body in chunks to a file or sink, see RestAPI.download() for the parameters
+        :return: Awaitable DownloadResult
+        """
+        caller = inspect.currentframe().f_back.f_code.co_name.upper()
+        return self._download(caller, api_url, destination, api_key, chunk_size, progress, checksum,
+                              expected_checksum, resume, max_resumes, expected_status_code, **kwargs)
+
+    async def _download(self, caller, api_url, destination, api_key, chunk_size, progress, checksum,
+                        expected_checksum, resume, max_resumes, expected_status_code, **kwargs):
+        """
+        Coroutine making the download, see download() for the parameters
+        :return: DownloadResult
+        """
+        url = '{}{}'.format(self.api_gw, api_url)
+        target = DownloadTarget(destination, checksum, resume)
+        # Large download may take longer than REST_TIMEOUT, only connecting and each read are limited
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=REST_TIMEOUT, sock_read=REST_TIMEOUT)
+        resumes = 0
+        attempt = 0
+        time_start = time.perf_counter()
+        try:
+            while True:
+                range_headers = {'Range': 'bytes={}-'.format(target.size)} if target.size else None
+                request_headers = self._request_headers(api_key, append_headers=range_headers)
+                self._log_request('get', url, request_headers, **kwargs)
+                try:
+                    if self.throttle is not None:
+                        await self.throttle.acquire_async(url)
+                    request_start = time.perf_counter()
+                    async with self.session.get(url, headers=request_headers,
+                                                ssl=self._ssl_context(self._client_certificate_and_key),
+                                                timeout=timeout, **kwargs) as resp:
+                        # Body of a successful response is streamed to the target, not kept in the response
+                        content = b'' if resp.status in (200, 206) else await resp.read()
+                        r = RestResponse(resp, content, request_headers, None, time.perf_counter() - request_start)
+                        self._write_log_response('GET', url, r, r.elapsed.total_seconds())
+                        if self.throttle is not None and self.throttle.should_retry('get', url, r.status_code,
+                                                                                    r.headers, attempt):
+                            attempt += 1
+                            continue
+                        if r.status_code == 416 and target.size:
+                            # Stored part doesn't fit to the current content, start over
+                            target.restart()
+                            continue
+                        if r.status_code not in (200, 206):
+                            break
+                        if r.status_code == 200 and target.size:
+                            target.restart()
+
+                        total = target.size + resp.content_length if resp.content_length is not None else None
+                        async for chunk in resp.content.iter_chunked(chunk_size):
+                            target.write(chunk)
+                            if progress is not None:
+                                progress(target.size, total)
+                        if total is not None and target.size < total:
+                            raise aiohttp.ClientPayloadError(
+                                'Connection closed at {} of {} bytes'.format(target.size, total))
+                        target.finish()
+                        break
+                except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if resumes >= max_resumes:
+                        log.error('aiohttp library raised exception for download GET {} - exception message: {}'.format(
+                            url, e))
+                        raise
+                    resumes += 1
+                    log.warning('Download of {} interrupted at {} bytes, resuming ({}/{}) - {}'.format(
+                        api_url, target.size, resumes, max_resumes, e))
+        finally:
+            target.close()
+
+        return self._finish_download(caller, api_url, DownloadResult(r, target, resumes,
+                                                                     time.perf_counter() - time_start),
+                                     checksum, expected_checksum, expected_status_code)
+
+    def upload(self, api_url, files, fields=None, api_key=None, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, progress=None,
+               checksum='sha256', checksum_field=None, expected_status_code=None, **kwargs):
+        """
+        Streaming multipart/form-data POST, see RestAPI.upload() for the parameters
+        :return: Awaitable request response
+        """
+        caller = inspect.currentframe().f_back.f_code.co_name.upper()
+        return self._upload(caller, api_url, files, fields, api_key, chunk_size, progress, checksum, checksum_field,
+                            expected_status_code, **kwargs)
+
+    async def _upload(self, caller, api_url, files, fields, api_key, chunk_size, progress, checksum, checksum_field,
+                      expected_status_code, **kwargs):
+        """
+        Coroutine making the upload, see upload() for the parameters
+        :return: RestResponse
+        """
+        url = '{}{}'.format(self.api_gw, api_url)
+        with MultipartUpload(files, fields, checksum, progress, chunk_size) as body:
+            # aiohttp sends the async generator body chunked unless the length is given
+            request_headers = self._request_headers(api_key, body.content_type,
+                                                    {'Content-Length': str(len(body))})
+            r = await self._request(caller, 'post', url, request_headers, None, body, None, REST_TIMEOUT,
+                                    'multipart upload of {} bytes'.format(len(body)), expected_status_code,
+                                    **kwargs)
+        return self._finish_upload(api_url, r, body, checksum_field)
+
+    def login(self, account, username, password, expected_status_code=None):
+        """
+        User login
+        :param account: Account id
+        :param username: User id
+        :param password: Password
+        :param expected_status_code: Asserts the result's status code
+        :return: Awaitable login response
+        """
+        log.info('Logging in user "{}" to account "{}"'.format(username, account))
+        payload = {'username': username, 'password': password, 'account': account}
+        return self._auth_request(inspect.currentframe().f_back.f_code.co_name, 'Login', '/auth/login',
+                                  None, payload, expected_status_code)
+
+    def logout(self, rt_token=None, expected_status_code=None):
+        """
+        User logout
+        :return: Awaitable logout response
+        """
+        headers = dict(self.headers)
+        if rt_token is not None:
+            headers['Authorization'] = rt_token
+        return self._auth_request(inspect.currentframe().f_back.f_code.co_name, 'Logout', '/auth/logout',
+                                  headers, None, expected_status_code)
+
+    async def _auth_request(self, caller, name, api_url, headers, payload, expected_status_code):
+        """
+        Coroutine making login and logout requests
+        :param caller: Calling function name for assertion message
+        :param name: Name for the response log
+        :param api_url: API url
+        :param headers: Request headers
+        :param payload: Form payload
+        :param expected_status_code: Asserts the result's status code
+        :return: RestResponse
+        """
+        url = '{}{}'.format(self.api_gw, api_url)
+
+        time_start = time.perf_counter()
+        async with self.session.post(url, headers=headers, data=payload,
+                                     timeout=aiohttp.ClientTimeout(total=REST_TIMEOUT)) as resp:
+            content = await resp.read()
+        time_end = time.perf_counter()
+
+        request_body = urlencode(payload) if payload else None
+        r = RestResponse(resp, content, headers, request_body, time_end - time_start)
+        self._write_log_response(name, api_url, r, time_end - time_start)
+        if expected_status_code is not None:
+            assert_status(r, caller, expected_status_code, api_url)
+
+        return r
@@ -0,0 +1,221 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for caching GET responses of read-mostly cloud endpoints
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from urllib.parse import urlencode, urlsplit
+
+from izuma_systest_lib.tools import config_flag
+
+log = logging.getLogger(__name__)
+
+# Endpoints whose content rarely changes during a test session, path pattern: time to live in seconds
+DEFAULT_CACHE_TTLS = {'/v3/policy-groups': 300,
+                      '/v3/applications': 300,
+                      '/v3/server-credentials*': 300,
+                      '/v3/service-packages': 300,
+                      '/downloads/fcu/info': 300,
+                      '/v3/device-block-categories': 300}
+
+MUTATING_METHODS = ('put', 'post', 'delete', 'patch')
+
+
+class CacheEntry:
+    """
+    Cached response with its validator and expiry time
+    """
+
+    def __init__(self, path, response, ttl):
+        self.path = path
+        self.response = response
+        self.etag = response.headers.get('ETag')
+        self.ttl = ttl
+        self.expires = time.monotonic() + ttl
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires
+
+
+class ResponseCache:
+    """
+    LRU cache for GET responses with per-endpoint time to live.
+
+    Only endpoints matching a TTL pattern are cached, patterns are fnmatch style and matched against the url path,
+    e.g. '/v3/policy-groups' or '/v3/server-credentials*'. Responses are cached separately for each authorization
+    header and query params. Stale entry having ETag is revalidated with If-None-Match and kept when the cloud
+    answers 304. PUT, POST, DELETE and PATCH invalidate the cached responses of the same path, its parents and
+    its children, e.g. DELETE /v3/applications/{id} drops the cached /v3/applications list.
+
+    Cache is switched on with config key rest_cache, tuned with rest_cache_ttls and rest_cache_max_entries.
+    stats() gives the hit, miss, revalidation, eviction and invalidation counters.
+    :param ttls: {path pattern: time to live in seconds}, defaults to DEFAULT_CACHE_TTLS
+    :param max_entries: Maximum count of cached responses, least recently used are evicted first
+    """
+
+    def __init__(self, ttls=None, max_entries=256):
+        self.ttls = dict(DEFAULT_CACHE_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'evictions': 0, 'invalidations': 0}
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates the cache if it is switched on in config
+        :param config: Config data, see rest_cache, rest_cache_ttls and rest_cache_max_entries keys
+        :return: ResponseCache or None
+        """
+        if not config_flag(config, 'rest_cache'):
+            return None
+        return cls(config.get('rest_cache_ttls'), int(config.get('rest_cache_max_entries', 256)))
+
+    def ttl(self, path):
+        """
+        Finds time to live for the path
+        :param path: Url path
+        :return: Seconds or None when the path is not cached
+        """
+        for pattern, ttl in self.ttls.items():
+            if fnmatchcase(path, pattern):
+                return ttl
+        return None
+
+    def key(self, url, headers, certificate=None, **kwargs):
+        """
+        Creates cache key for a GET request
+        :param url: Request url
+        :param headers: Request headers
+        :param certificate: Client certificate
+        :param kwargs: Other request arguments, only 'params' is allowed for cached requests
+        :return: Key tuple or None when the request is not cached
+        """
+        if set(kwargs) - {'params'}:
+            return None
+        path = urlsplit(url).path
+        if not self.ttl(path):
+            return None
+        params = kwargs.get('params')
+        if isinstance(params, dict):
+            params = urlencode(sorted(params.items()))
+        return url, params, headers.get('Authorization'), certificate
+
+    def lookup(self, key):
+        """
+        Finds cached entry, fresh entry is counted as a hit
+        :param key: Cache key
+        :return: (CacheEntry, fresh) tuple, (None, False) when there is nothing to use or revalidate
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None, False
+            self._entries.move_to_end(key)
+            fresh = entry.fresh
+            if fresh:
+                self._stats['hits'] += 1
+            elif entry.etag is None:
+                del self._entries[key]
+                self._stats['misses'] += 1
+                return None, False
+            return entry, fresh
+
+    def store(self, key, response, stale_entry=None):
+        """
+        Caches successful response
+        :param key: Cache key
+        :param response: Response
+        :param stale_entry: Entry that was revalidated but has changed, counted as a miss
+        :return: Cached response
+        """
+        path = urlsplit(key[0]).path
+        with self._lock:
+            if stale_entry is not None:
+                self._stats['misses'] += 1
+            if response.status_code != 200:
+                self._entries.pop(key, None)
+                return response
+            self._entries[key] = CacheEntry(path, response, self.ttl(path))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return response
+
+    def revalidated(self, key, entry):
+        """
+        Extends the time to live of the entry after 304 Not Modified
+        :param key: Cache key
+        :param entry: Revalidated entry
+        :return: Cached response
+        """
+        with self._lock:
+            entry.expires = time.monotonic() + entry.ttl
+            self._entries[key] = entry
+            self._stats['revalidations'] += 1
+        return entry.response
+
+    def invalidate(self, url):
+        """
+        Drops the cached responses of the path, its parents and its children
+        :param url: Url of the modified resource
+        """
+        path = urlsplit(url).path.rstrip('/')
+        with self._lock:
+            dropped = [key for key, entry in self._entries.items() if _related(path, entry.path.rstrip('/'))]
+            for key in dropped:
+                del self._entries[key]
+            self._stats['invalidations'] += len(dropped)
+        if dropped:
+            log.debug('Invalidated {} cached responses of {}'.format(len(dropped), path))
+
+    def clear(self):
+        """
+        Drops all cached responses
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters
+        :return: Dict of hits, misses, revalidations, evictions, invalidations and current entry count
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+def _related(path, other):
+    """
+    Checks if one of the paths is the other or its parent
+    :param path: Url path
+    :param other: Url path
+    :return: True/False
+    """
+    return path == other or other.startswith(path + '/') or path.startswith(other + '/')
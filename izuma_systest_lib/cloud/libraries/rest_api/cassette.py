@@ -0,0 +1,406 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for recording RestAPI traffic to a cassette and replaying it without the cloud
+"""
+
+import copy
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from os import getenv
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+log = logging.getLogger(__name__)
+
+REST_CASSETTE = getenv('REST_CASSETTE', default='')
+REST_CASSETTE_MODE = getenv('REST_CASSETTE_MODE', default='replay')
+
+INTERACTIONS_FILE = 'interactions.jsonl'
+BLOBS_DIR = 'blobs'
+
+# Query params having new random value on every run, their values are not matched
+VOLATILE_PARAMS = ('async-id',)
+TEXT_CONTENT_TYPES = ('json', 'text', 'xml', 'x-www-form-urlencoded', 'javascript')
+DROPPED_RESPONSE_HEADERS = ('set-cookie', 'content-encoding', 'transfer-encoding', 'connection')
+
+_REDACTIONS = ((re.compile(r'\b(ak|rt)_[0-9A-Za-z]{8,}'), r'\1_REDACTED'),
+               (re.compile(r'("(?:password|token|secret|access_token|refresh_token)"\s*:\s*")[^"]*"'), r'\1*"'),
+               (re.compile(r'\b(password=)[^&\s]*'), r'\1*'))
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+class CassetteError(requests.exceptions.ConnectionError):
+    """
+    Raised in replay mode when the cassette has no response for the request
+    """
+
+
+def redact(text):
+    """
+    Removes api keys, tokens and passwords from the text
+    :param text: Text to store
+    :return: Redacted text
+    """
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _request_key(url):
+    """
+    Splits url to matched parts
+    :param url: Request url
+    :return: (path, query without volatile param values, volatile async-id or None)
+    """
+    parts = urlsplit(url)
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    async_id = next((value for name, value in params if name == 'async-id'), None)
+    query = urlencode(sorted((name, '*' if name in VOLATILE_PARAMS else value) for name, value in params))
+    return parts.path, query, async_id
+
+
+class Cassette:
+    """
+    Recorded RestAPI traffic in a cassette directory:
+        interactions.jsonl  one json object per line - http request/response pairs and websocket async-responses
+        blobs/<sha256>      binary request and response bodies
+
+    Api keys, tokens and passwords are redacted and Authorization headers are never stored.
+    In replay mode the interactions are loaded in memory and indexed by method and path. Matching policies:
+        strict   query params and request body must match, every recorded response is served once in recorded order
+        lenient  method and path must match, the best matching unused response is served and the last one is
+                 repeated when all are used
+    Values of volatile query params (async-id) are never matched. Async-responses recorded for the async-id of
+    a request are pushed to the listening websocket runners with the async-id of the replayed request.
+    Bodies of streamed responses, e.g. firmware downloads, are not read when recording, so only their status and
+    headers are stored and they are replayed with an empty body.
+    :param path: Cassette directory
+    :param mode: 'record' or 'replay'
+    :param match: 'strict' or 'lenient'
+    """
+
+    def __init__(self, path, mode='replay', match='strict'):
+        if mode not in ('record', 'replay'):
+            raise ValueError('Unknown cassette mode "{}", use record or replay'.format(mode))
+        if match not in ('strict', 'lenient'):
+            raise ValueError('Unknown cassette match policy "{}", use strict or lenient'.format(match))
+        self.path = path
+        self.mode = mode
+        self.match = match
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._async_responses = {}
+        self._blobs = {}
+        self._listeners = []
+        self._file = None
+
+        if mode == 'record':
+            os.makedirs(os.path.join(path, BLOBS_DIR), exist_ok=True)
+            self._file = open(os.path.join(path, INTERACTIONS_FILE), 'w', encoding='utf-8')
+            log.info('Recording REST traffic to cassette {}'.format(path))
+        else:
+            self._load()
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    def close(self):
+        """
+        Closes the recorded interactions file
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _load(self):
+        """
+        Reads the interactions in memory
+        """
+        count = 0
+        with open(os.path.join(self.path, INTERACTIONS_FILE), encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if item['type'] == 'async-response':
+                    self._async_responses.setdefault(item['async_id'], []).append(item['content'])
+                    continue
+                item['used'] = False
+                self._interactions.setdefault((item['method'], item['path']), []).append(item)
+                count += 1
+        log.info('Replaying {} REST interactions from cassette {} with {} matching'.format(count, self.path,
+                                                                                           self.match))
+
+    def _write(self, item):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(item, separators=(',', ':')) + '\n')
+                self._file.flush()
+
+    def _store_body(self, body, content_type):
+        """
+        Converts body to stored form, binary bodies are written to blobs directory
+        :param body: Request or response body
+        :param content_type: Content type header
+        :return: {'text': redacted text}, {'blob': sha256, 'size': bytes} or None
+        """
+        if not body:
+            return None
+        if isinstance(body, str):
+            return {'text': redact(body)}
+        if not isinstance(body, bytes):
+            # Streamed or generated body can't be stored
+            return {'stream': True}
+        if any(text_type in (content_type or '') for text_type in TEXT_CONTENT_TYPES):
+            try:
+                return {'text': redact(body.decode('utf-8'))}
+            except UnicodeDecodeError:
+                pass
+        digest = hashlib.sha256(body).hexdigest()
+        blob_path = os.path.join(self.path, BLOBS_DIR, digest)
+        if not os.path.exists(blob_path):
+            with open(blob_path, 'wb') as f:
+                f.write(body)
+        return {'blob': digest, 'size': len(body)}
+
+    def _read_body(self, stored):
+        """
+        Converts stored body back to bytes
+        :param stored: Stored body
+        :return: Body bytes
+        """
+        if not stored:
+            return b''
+        if 'text' in stored:
+            return stored['text'].encode('utf-8')
+        if 'blob' in stored:
+            digest = stored['blob']
+            if digest not in self._blobs:
+                with open(os.path.join(self.path, BLOBS_DIR, digest), 'rb') as f:
+                    self._blobs[digest] = f.read()
+            return self._blobs[digest]
+        return b''
+
+    def _request_body(self, request):
+        """
+        Request body in the stored form, blobs are compared by hash without writing them
+        """
+        body = request.body
+        if isinstance(body, bytes) and not any(text_type in request.headers.get('Content-Type', '')
+                                               for text_type in TEXT_CONTENT_TYPES):
+            return {'blob': hashlib.sha256(body).hexdigest(), 'size': len(body)}
+        return self._store_body(body, request.headers.get('Content-Type', 'text'))
+
+    def record(self, request, response, stream=False):
+        """
+        Stores the request/response pair
+        :param request: requests.PreparedRequest
+        :param response: requests.Response
+        :param stream: Response body is streamed, it is not read and only the status and headers are stored
+        """
+        path, query, async_id = _request_key(request.url)
+        content_type = response.headers.get('Content-Type', '')
+        body = {'stream': True}
+        if not stream:
+            if async_id is None and 'json' in content_type and b'async-response-id' in response.content:
+                try:
+                    async_id = response.json().get('async-response-id')
+                except (ValueError, AttributeError):
+                    pass
+            body = self._store_body(response.content, content_type)
+        self._write({'type': 'http',
+                     'method': request.method,
+                     'path': path,
+                     'query': query,
+                     'async_id': async_id,
+                     'request_body': self._store_body(request.body, request.headers.get('Content-Type', 'text')),
+                     'status': response.status_code,
+                     'reason': response.reason,
+                     'headers': {name: value for name, value in response.headers.items()
+                                 if name.lower() not in DROPPED_RESPONSE_HEADERS},
+                     'body': body,
+                     'elapsed': response.elapsed.total_seconds()})
+
+    def record_async_response(self, content):
+        """
+        Stores async-response received from websocket
+        :param content: Async-response content
+        """
+        self._write({'type': 'async-response', 'async_id': content.get('id'), 'content': content})
+
+    def add_listener(self, message_queue):
+        """
+        Adds websocket message queue receiving the replayed async-responses
+        :param message_queue: Queue of websocket messages
+        """
+        with self._lock:
+            self._listeners.append(message_queue)
+
+    def remove_listener(self, message_queue):
+        with self._lock:
+            if message_queue in self._listeners:
+                self._listeners.remove(message_queue)
+
+    def _find(self, request):
+        """
+        Finds the recorded interaction for the request
+        :param request: requests.PreparedRequest
+        :return: Recorded interaction
+        """
+        path, query, _ = _request_key(request.url)
+        body = self._request_body(request)
+        candidates = self._interactions.get((request.method, path), [])
+        with self._lock:
+            unused = [item for item in candidates if not item['used']]
+            exact = [item for item in unused if item['query'] == query and item['request_body'] == body]
+            if self.match == 'strict':
+                found = exact[0] if exact else None
+            else:
+                same_query = [item for item in unused if item['query'] == query]
+                found = (exact or same_query or unused or [None])[0]
+                if found is None and candidates:
+                    found = next((item for item in reversed(candidates) if item['query'] == query), candidates[-1])
+            if found is not None:
+                found['used'] = True
+        if found is None:
+            raise CassetteError('No recorded response for {} {}{} in cassette {} with {} matching'.format(
+                request.method, path, '?' + query if query else '', self.path, self.match), request=request)
+        return found
+
+    def play(self, request):
+        """
+        Serves the recorded response and pushes the linked async-responses to websocket listeners
+        :param request: requests.PreparedRequest
+        :return: requests.Response
+        """
+        item = self._find(request)
+
+        r = requests.Response()
+        r.status_code = item['status']
+        r.reason = item['reason']
+        r.headers = CaseInsensitiveDict(item['headers'])
+        r._content = self._read_body(item['body'])  # pylint: disable=protected-access
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers) or 'utf-8'
+        r.url = request.url
+        r.request = request
+        r.elapsed = datetime.timedelta(seconds=item['elapsed'])
+        if 'Content-Length' in r.headers:
+            r.headers['Content-Length'] = str(len(r.content))
+
+        if item['async_id'] is not None:
+            self._push_async_responses(item['async_id'], _request_key(request.url)[2] or item['async_id'])
+        return r
+
+    def _push_async_responses(self, recorded_id, async_id):
+        """
+        Pushes recorded async-responses to websocket listeners with the async-id of the replayed request
+        :param recorded_id: Async-id in the recording
+        :param async_id: Async-id of the replayed request
+        """
+        contents = []
+        for content in self._async_responses.get(recorded_id, []):
+            content = copy.deepcopy(content)
+            content['id'] = async_id
+            contents.append(content)
+        if not contents:
+            return
+        with self._lock:
+            listeners = list(self._listeners)
+        for message_queue in listeners:
+            message_queue.put({'async-responses': contents})
+
+
+class CassetteAdapter(BaseAdapter):
+    """
+    Transport adapter recording the traffic of the wrapped adapter or replaying it from the cassette
+    """
+
+    def __init__(self, cassette, adapter=None):
+        """
+        :param cassette: Cassette
+        :param adapter: Real transport adapter used in record mode
+        """
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.cassette.replaying:
+            return self.cassette.play(request)
+        r = self.adapter.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+        self.cassette.record(request, r, stream=stream)
+        return r
+
+    def close(self):
+        if self.adapter is not None:
+            self.adapter.close()
+
+
+def open_cassette(path, mode='replay', match='strict'):
+    """
+    Returns process wide cassette for the path, so all RestAPI objects and websockets use the same one
+    :param path: Cassette directory
+    :param mode: 'record' or 'replay'
+    :param match: 'strict' or 'lenient'
+    :return: Cassette
+    """
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path, mode, match)
+        return _cassettes[path]
+
+
+def cassette_from_config(config):
+    """
+    Opens the cassette set in config or with REST_CASSETTE and REST_CASSETTE_MODE env variables
+    :param config: Config data, see rest_cassette, rest_cassette_mode and rest_cassette_match keys
+    :return: Cassette or None
+    """
+    path = config.get('rest_cassette', REST_CASSETTE)
+    if not path:
+        return None
+    return open_cassette(path, config.get('rest_cassette_mode', REST_CASSETTE_MODE),
+                         config.get('rest_cassette_match', 'strict'))
+
+
+def close_cassettes():
+    """
+    Closes all opened cassettes
+    """
+    with _cassettes_lock:
+        for cassette in _cassettes.values():
+            cassette.close()
+        _cassettes.clear()
@@ -0,0 +1,144 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for writing streamed downloads to a file or another sink
+"""
+
+import hashlib
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = '.part'
+
+
+class DownloadTarget:
+    """
+    Destination of a streamed download, computes the checksum of the written data.
+
+    File downloads are written to <destination>.part and renamed when complete. Existing .part file of an
+    interrupted download is continued, so its size is the Range start of the next request.
+    :param destination: File path or writable sink with write() method
+    :param checksum: hashlib algorithm name or None
+    :param resume: Continue existing .part file
+    """
+
+    def __init__(self, destination, checksum='sha256', resume=True):
+        self._checksum = checksum
+        self._hash = hashlib.new(checksum) if checksum else None
+        self.size = 0
+        if hasattr(destination, 'write'):
+            self.path = None
+            self.part_path = None
+            self._file = destination
+            self._owns_file = False
+            return
+
+        self.path = os.fspath(destination)
+        self.part_path = self.path + PART_SUFFIX
+        self._owns_file = True
+        if resume and os.path.exists(self.part_path):
+            with open(self.part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b''):
+                    self._update(chunk)
+            log.info('Continuing download to {} from {} bytes'.format(self.path, self.size))
+            self._file = open(self.part_path, 'ab')
+        else:
+            self._file = open(self.part_path, 'wb')
+
+    def _update(self, chunk):
+        if self._hash is not None:
+            self._hash.update(chunk)
+        self.size += len(chunk)
+
+    @property
+    def checksum(self):
+        return self._hash.hexdigest() if self._hash is not None else None
+
+    def write(self, chunk):
+        """
+        Writes one chunk
+        :param chunk: Bytes
+        """
+        self._file.write(chunk)
+        self._update(chunk)
+
+    def restart(self):
+        """
+        Drops the written data when the server sends the whole content again
+        """
+        log.debug('Restarting download from the beginning')
+        if not self._owns_file and not (hasattr(self._file, 'seek') and hasattr(self._file, 'truncate')):
+            raise IOError('Download sink can\'t be rewound, it has {} bytes already'.format(self.size))
+        self._file.seek(0)
+        self._file.truncate()
+        self._hash = hashlib.new(self._checksum) if self._checksum else None
+        self.size = 0
+
+    def close(self):
+        """
+        Closes the file, .part file is kept for resuming if it has data
+        """
+        if self._owns_file and not self._file.closed:
+            self._file.close()
+            if self.size == 0:
+                os.remove(self.part_path)
+
+    def finish(self):
+        """
+        Closes the file and renames the .part file to the destination
+        """
+        if self._owns_file:
+            self._file.close()
+            os.replace(self.part_path, self.path)
+        elif hasattr(self._file, 'flush'):
+            self._file.flush()
+
+
+class DownloadResult:
+    """
+    Result of RestAPI.download()
+    """
+
+    def __init__(self, response, target, resumes, elapsed):
+        """
+        :param response: Last response, its body is already consumed
+        :param target: DownloadTarget
+        :param resumes: Count of resumed transfers
+        :param elapsed: Download time in seconds
+        """
+        self.response = response
+        self.path = target.path
+        self.size = target.size
+        self.checksum = target.checksum
+        self.resumes = resumes
+        self.elapsed = elapsed
+
+    @property
+    def status_code(self):
+        return self.response.status_code
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        return self.response.status_code in (200, 206)
+
+    def __repr__(self):
+        return '<DownloadResult [{}] {} bytes to {}>'.format(self.status_code, self.size, self.path or 'sink')
@@ -0,0 +1,244 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for collecting latency, status code and transfer metrics of the REST requests
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets in seconds, the last bucket takes everything slower
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Path segments replaced with {id}: cloud ids, uuids and other long values containing digits.
+# Short numbers are kept, so LwM2M resource paths like /3/0/13 stay visible.
+_ID_SEGMENT = re.compile(r'^([0-9a-fA-F]{32}|[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}|\d{6,}|'
+                         r'(?=.*\d)[\w.:=~-]{16,})$')
+
+
+@lru_cache(maxsize=4096)
+def template_path(url):
+    """
+    Replaces the ids in url path with {id}
+    :param url: Request url or path
+    :return: Templated path, e.g. /v3/devices/{id}
+    """
+    path = urlsplit(url).path
+    return '/'.join('{id}' if _ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, observing a value is one bisect and two additions
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        """
+        Estimates the quantile by linear interpolation inside the bucket, like Prometheus histogram_quantile()
+        :param fraction: Quantile 0..1, e.g. 0.95
+        :return: Estimated value or None if nothing is observed
+        """
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - cumulative) / count, self.max)
+            cumulative += count
+        return self.max
+
+    def cumulative_counts(self):
+        """
+        :return: [(upper bound, count of values <= bound)], the last bound is '+Inf'
+        """
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+
+class EndpointMetrics:
+    """
+    Metrics of one method and templated path
+    """
+
+    def __init__(self, buckets):
+        self.latency = Histogram(buckets)
+        self.status_codes = {}
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def snapshot(self):
+        status_codes = sorted(self.status_codes.items(), key=lambda item: str(item[0]))
+        return {'count': self.latency.count,
+                'latency_sum': round(self.latency.sum, 6),
+                'latency_max': round(self.latency.max, 6),
+                'p50': _rounded(self.latency.quantile(0.5)),
+                'p95': _rounded(self.latency.quantile(0.95)),
+                'p99': _rounded(self.latency.quantile(0.99)),
+                'buckets': {str(bound): count for bound, count in self.latency.cumulative_counts()},
+                'status_codes': {str(status): count for status, count in status_codes},
+                'bytes_out': self.bytes_out,
+                'bytes_in': self.bytes_in}
+
+
+class MetricsRegistry:
+    """
+    In-process registry of REST request metrics, keyed by method and templated path (e.g. GET /v3/devices/{id}).
+    Records latency histogram, status code counts and sent and received bytes. Requests raising an exception
+    are counted with status 'error'.
+
+    RestAPI records to the process wide metrics_registry unless rest_metrics is set False in config.
+    Export with to_json(), to_prometheus() or write(), the pytest session writes them at the end of the run.
+    :param buckets: Latency bucket upper bounds in seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, url, status, elapsed, bytes_out=0, bytes_in=0):
+        """
+        Records one request
+        :param method: Request method
+        :param url: Request url or path
+        :param status: Response status code or 'error'
+        :param elapsed: Request duration in seconds
+        :param bytes_out: Sent body size
+        :param bytes_in: Received body size
+        """
+        key = (method.upper(), template_path(url))
+        with self._lock:
+            endpoint = self._endpoints.get(key)
+            if endpoint is None:
+                endpoint = self._endpoints[key] = EndpointMetrics(self.buckets)
+            endpoint.latency.observe(elapsed)
+            endpoint.status_codes[status] = endpoint.status_codes.get(status, 0) + 1
+            endpoint.bytes_out += bytes_out
+            endpoint.bytes_in += bytes_in
+
+    def __len__(self):
+        return len(self._endpoints)
+
+    def reset(self):
+        """
+        Drops all recorded metrics
+        """
+        with self._lock:
+            self._endpoints.clear()
+
+    def snapshot(self):
+        """
+        :return: {'METHOD /templated/path': metrics dict}
+        """
+        with self._lock:
+            return {'{} {}'.format(method, path): endpoint.snapshot()
+                    for (method, path), endpoint in sorted(self._endpoints.items())}
+
+    def to_json(self, indent=2):
+        """
+        :param indent: Json indent
+        :return: Metrics as json string
+        """
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self):
+        """
+        :return: Metrics in Prometheus text exposition format
+        """
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = ['# HELP rest_request_duration_seconds REST request latency',
+                     '# TYPE rest_request_duration_seconds histogram']
+            for (method, path), endpoint in endpoints:
+                labels = 'method="{}",path="{}"'.format(method, _escape(path))
+                for bound, count in endpoint.latency.cumulative_counts():
+                    lines.append('rest_request_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, count))
+                lines.append('rest_request_duration_seconds_sum{{{}}} {}'.format(labels, endpoint.latency.sum))
+                lines.append('rest_request_duration_seconds_count{{{}}} {}'.format(labels, endpoint.latency.count))
+
+            lines += ['# HELP rest_responses_total REST responses by status code',
+                      '# TYPE rest_responses_total counter']
+            for (method, path), endpoint in endpoints:
+                for status, count in sorted(endpoint.status_codes.items(), key=lambda item: str(item[0])):
+                    lines.append('rest_responses_total{{method="{}",path="{}",status="{}"}} {}'.format(
+                        method, _escape(path), status, count))
+
+            for name, attribute, help_text in (('rest_request_bytes_total', 'bytes_out', 'Sent REST body bytes'),
+                                               ('rest_response_bytes_total', 'bytes_in', 'Received REST body bytes')):
+                lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} counter'.format(name)]
+                for (method, path), endpoint in endpoints:
+                    lines.append('{}{{method="{}",path="{}"}} {}'.format(name, method, _escape(path),
+                                                                         getattr(endpoint, attribute)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path_prefix):
+        """
+        Writes the metrics to <path_prefix>.json and <path_prefix>.prom files
+        :param path_prefix: File path without extension
+        :return: Written file names
+        """
+        directory = os.path.dirname(path_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        files = ('{}.json'.format(path_prefix), '{}.prom'.format(path_prefix))
+        with open(files[0], 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+        with open(files[1], 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        return files
+
+
+def _rounded(value):
+    return None if value is None else round(value, 6)
+
+
+def _escape(label_value):
+    return label_value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,207 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for streaming multipart/form-data request bodies
+"""
+
+import hashlib
+import logging
+import os
+import uuid
+
+log = logging.getLogger(__name__)
+
+DEFAULT_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class _BytesSegment:
+    """
+    In-memory part of the body: part headers, form field values and boundaries
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self._position = 0
+
+    def read(self, size):
+        chunk = self.data[self._position:self._position + size]
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+class _FileSegment:
+    """
+    File content of the body, read in bounded chunks and hashed while read
+    """
+
+    def __init__(self, name, source, checksum, chunk_size):
+        """
+        :param name: Form field name
+        :param source: File path or binary file object
+        :param checksum: hashlib algorithm name or None
+        :param chunk_size: Maximum bytes read from the file at a time
+        """
+        self.name = name
+        self._hash = hashlib.new(checksum) if checksum else None
+        self._chunk_size = chunk_size
+        self._read = 0
+        if isinstance(source, (str, bytes, os.PathLike)):
+            self._path = source
+            self._file = None
+            self.size = os.path.getsize(source)
+        else:
+            self._path = None
+            self._file = source
+            self.size = os.fstat(source.fileno()).st_size - source.tell()
+
+    @property
+    def checksum(self):
+        return self._hash.hexdigest() if self._hash is not None and self._read == self.size else None
+
+    def read(self, size):
+        if self._read >= self.size:
+            return b''
+        if self._file is None:
+            self._file = open(self._path, 'rb')
+        chunk = self._file.read(min(size, self._chunk_size, self.size - self._read))
+        self._read += len(chunk)
+        if self._hash is not None:
+            self._hash.update(chunk)
+        if self._read >= self.size:
+            self.close()
+        return chunk
+
+    def close(self):
+        # Only files opened here are closed, file objects belong to the caller
+        if self._path is not None and self._file is not None:
+            self._file.close()
+            self._path = None
+
+
+class MultipartUpload:
+    """
+    Streaming multipart/form-data body. Works as a read-only file object with known length, so requests sends it
+    with Content-Length and reads it in transport sized blocks - memory use doesn't depend on the file sizes.
+    Checksum of each file is computed while it is sent and files opened here are closed as soon as they are read,
+    or latest on close(). Use with 'with' statement:
+
+        with MultipartUpload({'datafile': '/tmp/image.bin'}, progress=print) as body:
+            r = session.post(url, data=body, headers={'Content-Type': body.content_type})
+        log.info(body.checksums['datafile'])
+
+    :param files: {field name: file path, binary file object or (file name, path or file object[, content type])}
+    :param fields: {field name: value} of the other form fields
+    :param checksum: hashlib algorithm name or None
+    :param progress: Callback progress(sent bytes, total bytes) called after each read
+    :param chunk_size: Maximum bytes read from a file at a time
+    """
+
+    def __init__(self, files, fields=None, checksum='sha256', progress=None, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self._progress = progress
+        self._segments = []
+        self._files = []
+        self._index = 0
+        self._position = 0
+
+        for name, value in (fields or {}).items():
+            self._add_bytes('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(
+                self.boundary, name, value).encode('utf-8'))
+        for name, value in files.items():
+            content_type = 'application/octet-stream'
+            if isinstance(value, (tuple, list)):
+                filename, source = value[0], value[1]
+                if len(value) > 2:
+                    content_type = value[2]
+            else:
+                source = value
+                filename = os.path.basename(os.fspath(value) if isinstance(value, (str, bytes, os.PathLike))
+                                            else getattr(value, 'name', name))
+            if isinstance(filename, bytes):
+                filename = filename.decode('utf-8')
+            self._add_bytes('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                            'Content-Type: {}\r\n\r\n'.format(self.boundary, name, filename,
+                                                              content_type).encode('utf-8'))
+            segment = _FileSegment(name, source, checksum, chunk_size)
+            self._segments.append(segment)
+            self._files.append(segment)
+            self._add_bytes(b'\r\n')
+        self._add_bytes('--{}--\r\n'.format(self.boundary).encode('utf-8'))
+        self.len = sum(segment.size for segment in self._segments)
+
+    def _add_bytes(self, data):
+        self._segments.append(_BytesSegment(data))
+
+    def __len__(self):
+        return self.len
+
+    def __repr__(self):
+        return '<multipart upload of {} bytes, files: {}>'.format(self.len,
+                                                                  ', '.join(part.name for part in self._files))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def checksums(self):
+        """
+        :return: {field name: checksum hex digest} of the completely sent files
+        """
+        return {part.name: part.checksum for part in self._files if part.checksum is not None}
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        """
+        Reads next block of the body
+        :param size: Maximum bytes to read, -1 reads the rest
+        :return: Bytes, empty at the end
+        """
+        if size is None or size < 0:
+            size = self.len - self._position
+        data = []
+        remaining = size
+        while remaining > 0 and self._index < len(self._segments):
+            chunk = self._segments[self._index].read(remaining)
+            if not chunk:
+                self._index += 1
+                continue
+            data.append(chunk)
+            remaining -= len(chunk)
+        block = b''.join(data)
+        self._position += len(block)
+        if self._progress is not None and block:
+            self._progress(self._position, self.len)
+        return block
+
+    def close(self):
+        """
+        Closes the files opened by the upload
+        """
+        for part in self._files:
+            part.close()
@@ -24,13 +24,23 @@ This module is for RestAPI connection made with Requests library
 import inspect
 import json
 import logging
+import threading
 import time
 from os import getenv
+from types import MappingProxyType
 from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from izuma_systest_lib.tools import assert_status, create_curl_command
+from izuma_systest_lib.cloud.libraries.rest_api.cache import MUTATING_METHODS, ResponseCache
+from izuma_systest_lib.cloud.libraries.rest_api.cassette import CassetteAdapter, cassette_from_config
+from izuma_systest_lib.cloud.libraries.rest_api.download import DEFAULT_CHUNK_SIZE, DownloadResult, DownloadTarget
+from izuma_systest_lib.cloud.libraries.rest_api.metrics import metrics_registry
+from izuma_systest_lib.cloud.libraries.rest_api.multipart import DEFAULT_UPLOAD_CHUNK_SIZE, MultipartUpload
+from izuma_systest_lib.cloud.libraries.rest_api.throttle import RequestThrottle
+from izuma_systest_lib.tools import assert_status, config_flag, create_curl_command
 
 log = logging.getLogger(__name__)
 
@@ -38,6 +48,80 @@ urllib3_logger = logging.getLogger('urllib3')
 urllib3_logger.setLevel(logging.WARNING)
 
 REST_TIMEOUT = int(getenv('REST_TIMEOUT', default='10'))
+LOG_LEVELS = {'info': logging.INFO, 'debug': logging.DEBUG, 'error': logging.ERROR, 'warning': logging.WARNING}
+REST_SHARED_SESSION = getenv('REST_SHARED_SESSION', default='false').lower() == 'true'
+
+_shared_sessions = {}
+_shared_sessions_lock = threading.Lock()
+
+
+def _pool_settings(config):
+    """
+    Collects the connection pool settings from config
+    :param config: Config data
+    :return: Hashable tuple of pool settings
+    """
+    return (int(config.get('rest_pool_connections', 10)),
+            int(config.get('rest_pool_maxsize', 10)),
+            int(config.get('rest_max_retries', 0)),
+            float(config.get('rest_retry_backoff', 0.5)),
+            tuple(config.get('rest_retry_status_codes', (502, 503, 504))),
+            config_flag(config, 'rest_keep_alive', True))
+
+
+def create_session(config):
+    """
+    Creates requests session with keep-alive connection pool and retry adapter
+    :param config: Config data, see rest_pool_* and rest_*retry* keys
+    :return: requests.Session
+    """
+    pool_connections, pool_maxsize, max_retries, retry_backoff, retry_status_codes, keep_alive = \
+        _pool_settings(config)
+    retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                  backoff_factor=retry_backoff, status_forcelist=retry_status_codes,
+                  raise_on_status=False, respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    log.debug('Created REST session - pool connections: {}, pool max size: {}, retries: {}, keep-alive: {}'.format(
+        pool_connections, pool_maxsize, max_retries, keep_alive))
+    return session
+
+
+def get_shared_session(config):
+    """
+    Returns process wide session for the given pool settings, creates it on first call
+    :param config: Config data
+    :return: requests.Session
+    """
+    key = _pool_settings(config)
+    with _shared_sessions_lock:
+        if key not in _shared_sessions:
+            _shared_sessions[key] = create_session(config)
+        return _shared_sessions[key]
+
+
+def close_shared_sessions():
+    """
+    Closes all shared sessions and their pooled connections
+    """
+    with _shared_sessions_lock:
+        for session in _shared_sessions.values():
+            session.close()
+        _shared_sessions.clear()
+
+
+def use_shared_session(config):
+    """
+    Checks if shared session is switched on either in config or with REST_SHARED_SESSION env variable
+    :param config: Config data
+    :return: True/False
+    """
+    return config_flag(config, 'rest_shared_session', REST_SHARED_SESSION)
 
 
 class RestAPI:
@@ -45,12 +129,37 @@ class RestAPI:
     Rest API connection class - uses Requests library
     https://realpython.com/python-requests/
 
+    Requests are sent through a requests.Session, so connections to the api domain are kept alive and pooled.
+    Pool is configured with keys rest_pool_connections, rest_pool_maxsize, rest_max_retries, rest_retry_backoff,
+    rest_retry_status_codes and rest_keep_alive. With rest_shared_session (or REST_SHARED_SESSION=true env variable)
+    all RestAPI objects share the same pool. Call close() to release the connections of own pool.
+
+    RestAPI is thread-safe, one object can be shared by many worker threads. Each request builds its own read-only
+    header set and self.headers is only the template for them. Set rest_pool_maxsize to at least the number of
+    worker threads, otherwise extra connections are opened and dropped after use.
+
+    With rest_cache set in config, GET responses of read-mostly endpoints are cached, see ResponseCache.
+    Cache counters are read with cache.stats().
+
+    With rest_throttle set in config, requests are rate limited per endpoint class and 429/503 responses are
+    backed off and resent, see RequestThrottle. Rate, queue depth and throttle counters are read with
+    throttle.stats().
+
+    Latency, status codes and transferred bytes of every request are recorded to metrics_registry by method and
+    templated path, unless rest_metrics is set False in config.
+
+    With rest_cassette (or REST_CASSETTE env variable) set to a directory, the traffic is recorded to a cassette
+    or replayed from it, depending on rest_cassette_mode 'record' or 'replay'. See Cassette for the matching
+    policies set with rest_cassette_match.
+
     """
 
-    def __init__(self, rest_config_data, api_domain_key='api_gw'):
+    def __init__(self, rest_config_data, api_domain_key='api_gw', session=None):
         """
         Initializes the RestAPI request class
         :param rest_config_data: Config data
+        :param api_domain_key: Config key of the api domain url
+        :param session: requests.Session to use, caller owns it. By default session is created based on config
         """
         config = rest_config_data
 
@@ -73,6 +182,55 @@ class RestAPI:
                         'Content-type': '{}'.format(self.default_content_type),
                         'Authorization': 'Bearer {}'.format(self.api_key)}
 
+        self.cache = ResponseCache.from_config(config)
+        self.throttle = RequestThrottle.from_config(config)
+        self.metrics = metrics_registry if config_flag(config, 'rest_metrics', True) else None
+        self.cassette = cassette_from_config(config)
+
+        self._owns_session = False
+        self._session = None
+        self._init_session(config, session)
+
+    def _init_session(self, config, session):
+        """
+        Sets the session used for requests
+        :param config: Config data
+        :param session: Session given by the caller or None
+        """
+        if self.cassette is not None:
+            # Own session, so the cassette doesn't catch traffic of other users of a shared session
+            self._session = create_session(config)
+            self._owns_session = True
+            for prefix in ('https://', 'http://'):
+                self._session.mount(prefix, CassetteAdapter(self.cassette, self._session.get_adapter(prefix)))
+        elif session is not None:
+            self._session = session
+        elif use_shared_session(config):
+            self._session = get_shared_session(config)
+        else:
+            self._session = create_session(config)
+            self._owns_session = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def session(self):
+        """
+        Returns requests.Session used for the requests
+        """
+        return self._session
+
+    def close(self):
+        """
+        Closes the pooled connections, shared sessions are closed with close_shared_sessions()
+        """
+        if self._owns_session:
+            self._session.close()
+
     @staticmethod
     def _log(level, msg):
         """
@@ -80,16 +238,17 @@ class RestAPI:
         :param level: Logger level
         :param msg: Content to be logged
         """
-        if level == 'info':
-            log.info(msg)
-        elif level == 'debug':
-            log.debug(msg)
-        elif level == 'error':
-            log.error(msg)
-        elif level == 'warning':
-            log.warning(msg)
-        else:
-            log.debug(msg)
+        log.log(LOG_LEVELS.get(level, logging.DEBUG), msg)
+
+    @staticmethod
+    def _is_logged(level):
+        """
+        Checks if message with the given log setting would be written. Log messages are formatted only when
+        this is True, so with 'none' or disabled logger level the logging costs nothing.
+        :param level: Log setting, e.g. 'info', 'debug' or 'none'
+        :return: True/False
+        """
+        return level != 'none' and log.isEnabledFor(LOG_LEVELS.get(level, logging.DEBUG))
 
     @staticmethod
     def _add_request_params(url, **kwargs):
@@ -135,10 +294,43 @@ class RestAPI:
                     if 'password=' in param:
                         pwd = param.split('=')[1]
                         req_body = req_body.replace('password={}'.format(pwd), 'password=*')
-            if isinstance(req_body, bytes):
-                req_body = 'body content in binary data - removed from the log'
+            if isinstance(req_body, (bytes, bytearray, memoryview)):
+                req_body = 'body content in binary data of {} bytes - removed from the log'.format(
+                    RestAPI._body_size(req_body))
         return req_body
 
+    @staticmethod
+    def _body_size(body):
+        """
+        :param body: Request body, e.g. string, bytes, memoryview slice of a file or MultipartUpload
+        :return: Body size in bytes, 0 if unknown
+        """
+        if isinstance(body, memoryview):
+            return body.nbytes
+        if isinstance(body, (bytes, bytearray, str)):
+            return len(body)
+        return getattr(body, 'len', 0)
+
+    @staticmethod
+    def _body_read(r):
+        """
+        Checks if the response body is already read. Body of a streamed response is left for the caller to read,
+        so logging and metrics must not touch it.
+        :param r: Request response
+        :return: True/False
+        """
+        return getattr(r, '_content_consumed', True)
+
+    @staticmethod
+    def _resendable(request_data, files):
+        """
+        Checks if the request body can be sent again, file and stream bodies are consumed by the first send
+        :param request_data: Request payload data
+        :param files: Files to send
+        :return: True/False
+        """
+        return files is None and not hasattr(request_data, 'read')
+
     @staticmethod
     def _clean_response_text(resp):
         """
@@ -147,37 +339,169 @@ class RestAPI:
         :return: Cleaned response
         """
         resp_text = resp.text
+        # Parse the body only if it can contain the token
+        if '"token"' not in resp_text:
+            return resp_text
         try:
-            resp_dict = resp.json()
+            resp_dict = json.loads(resp_text)
             if resp_dict.get('token') is not None:
                 resp_dict['token'] = '*'
                 resp_text = str(resp_dict)
-        except (AttributeError, json.JSONDecodeError):
+        except (AttributeError, ValueError):
             pass
         return resp_text
 
+    def _record_metrics(self, api_url, r, measured_time):
+        """
+        Records the request to the metrics registry
+        :param api_url: API endpoint url where the response came from
+        :param r: The response itself
+        :param measured_time: Time spent on rest request
+        """
+        bytes_out = self._body_size(r.request.body)
+        length = r.headers.get('Content-Length')
+        if length is not None and length.isdigit():
+            bytes_in = int(length)
+        elif self._body_read(r):
+            bytes_in = len(r.content or b'')
+        else:
+            bytes_in = 0
+        self.metrics.record(r.request.method, api_url, r.status_code, measured_time, bytes_out, bytes_in)
+
     def _write_log_response(self, method, api_url, r, measured_time):
         """
-        Function handling the response logging
+        Function handling the response logging and metrics
         :param method: GET, PUT, POST, etc to be written in short response log
         :param api_url: API endpoint url where the response came from
         :param r: The response itself
         :param measured_time: Time spent on rest request
         """
-        if self._log_command_body != 'none':
+        if self.metrics is not None:
+            self._record_metrics(api_url, r, measured_time)
+        if self._is_logged(self._log_command_body):
             req_body = self._clean_request_body(r.request.body)
             self._log(self._log_command_body, 'Request body: {}'.format(req_body))
-        if self._log_responses != 'none':
+        if self._is_logged(self._log_responses):
             self._log(self._log_responses, '{} {} - Response: {} - X-Request-ID: {}'.
                       format(method, api_url, r.status_code, r.headers.get('X-Request-ID', '')))
-        if self._log_timing:
+        if self._log_timing and log.isEnabledFor(logging.DEBUG):
             log.debug('{} {} - [time][{:.4f} s]'.format(method, api_url, measured_time))
-        if self._log_response_texts != 'none':
+        if self._is_logged(self._log_response_texts) and self._body_read(r):
             resp_text = self._clean_response_text(r)
             self._log(self._log_response_texts, 'Response text: {}'.format(resp_text))
-        if self._log_response_headers != 'none':
+        if self._is_logged(self._log_response_headers):
             self._log(self._log_response_headers, 'Response headers: {}'.format(r.headers))
 
+    def _request_headers(self, api_key=None, content_type=None, append_headers=None, with_content_type=True):
+        """
+        Builds own read-only header set for one request, self.headers is used only as template and never modified
+        by the requests. This keeps RestAPI safe to share between threads.
+        :param api_key: Authentication key, defaults to the configured api key
+        :param content_type: Message content-type, defaults to application/json
+        :param append_headers: Add headers
+        :param with_content_type: Set False to leave the content-type out
+        :return: Request headers as read-only mapping
+        """
+        request_headers = dict(self.headers)
+
+        key = api_key if api_key else self.api_key
+        if key:
+            request_headers['Authorization'] = 'Bearer {}'.format(key)
+
+        request_headers['Content-type'] = content_type if content_type else self.default_content_type
+
+        if append_headers is not None:
+            request_headers.update(append_headers)
+
+        if not with_content_type:
+            request_headers.pop('Content-type', None)
+
+        return MappingProxyType(request_headers)
+
+    def _log_request(self, method, api_url, request_headers, request_data=None, logged_payload=None, **kwargs):
+        """
+        Function handling the request and cURL command logging
+        :param method: Request method 'get/put/post/etc'
+        :param api_url: API url
+        :param request_headers: Request headers
+        :param request_data: Request payload data
+        :param logged_payload: Payload to log instead of request data
+        :param kwargs: Other arguments used in the request, params are added to logged url
+        """
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(dict(request_headers))
+        log_commands = self._is_logged(self._log_commands)
+        log_curl = self._is_logged(self._add_curl_logging)
+        if not log_commands and not log_curl:
+            return
+
+        log_head = dict(request_headers)
+        logged_url = self._add_request_params(api_url, **kwargs)
+        if log_commands:
+            if not self._api_key_logging:
+                log_head['Authorization'] = 'Bearer API_KEY'
+            if not logged_payload:
+                logged_payload = request_data
+            if isinstance(logged_payload, (bytes, bytearray, memoryview)):
+                logged_payload = 'binary data of {} bytes'.format(self._body_size(logged_payload))
+            self._log(self._log_commands,
+                      '{}: {}  Headers: {}  Payload: {}'.format(method.upper(), logged_url, log_head, logged_payload))
+        if log_curl:
+            self._log(self._add_curl_logging, create_curl_command(log_head.get('Authorization'), None, method,
+                                                                  logged_url, '-v', self._api_key_logging))
+
+    def _cache_lookup(self, method, api_url, request_headers, certificate, **kwargs):
+        """
+        Finds cached response for GET request and invalidates the cached responses on modifying request
+        :param method: Request method 'get/put/post/etc'
+        :param api_url: API url
+        :param request_headers: Request headers
+        :param certificate: Client certificate
+        :param kwargs: Other arguments used in the request
+        :return: (cache key, cached entry, fresh, request headers) - If-None-Match is added to the headers
+                 when stale entry is revalidated
+        """
+        if self.cache is None:
+            return None, None, False, request_headers
+        method = method.lower()
+        if method in MUTATING_METHODS:
+            self.cache.invalidate(api_url)
+        if method != 'get':
+            return None, None, False, request_headers
+
+        cache_key = self.cache.key(api_url, request_headers, certificate, **kwargs)
+        if cache_key is None:
+            return None, None, False, request_headers
+        entry, fresh = self.cache.lookup(cache_key)
+        if entry is not None and not fresh:
+            request_headers = MappingProxyType(dict(request_headers, **{'If-None-Match': entry.etag}))
+        return cache_key, entry, fresh, request_headers
+
+    def _cache_response(self, cache_key, entry, r):
+        """
+        Stores the response to cache, or returns the cached one when the cloud answered 304 Not Modified
+        :param cache_key: Cache key from _cache_lookup() or None
+        :param entry: Revalidated cache entry or None
+        :param r: Request response
+        :return: Response to return to the caller
+        """
+        if cache_key is None:
+            return r
+        if r.status_code == 304 and entry is not None:
+            return self.cache.revalidated(cache_key, entry)
+        return self.cache.store(cache_key, r, entry)
+
+    def _log_cached_response(self, method, api_url, r):
+        """
+        Writes the short response log for response served from cache
+        :param method: Request method
+        :param api_url: API url
+        :param r: Cached response
+        """
+        if self._is_logged(self._log_responses):
+            self._log(self._log_responses,
+                      '{} {} - Response: {} - from cache'.format(method.upper(), api_url, r.status_code))
+
     def _do_request(self, method, api_url, request_headers=None, certificate=None, request_data=None, files=None,
                     timeout=REST_TIMEOUT, logged_payload=None, expected_status_code=None, **kwargs):
         """
@@ -193,38 +517,49 @@ class RestAPI:
         :param kwargs: Other arguments used in the requests. http://docs.python-requests.org/en/master/api/
         :return: Request response
         """
-        log.debug(request_headers)
-        log_head = request_headers.copy()
-        if self._log_commands != 'none':
-            if not self._api_key_logging:
-                log_head['Authorization'] = 'Bearer API_KEY'
-            if not logged_payload:
-                logged_payload = request_data
-            self._log(self._log_commands,
-                      '{}: {}  Headers: {}  Payload: {}'.format(method.upper(), self._add_request_params(api_url,
-                                                                                                         **kwargs),
-                                                                log_head, logged_payload))
-        if self._add_curl_logging != 'none':
-            self._log(self._add_curl_logging, create_curl_command(log_head['Authorization'], None, method,
-                                                                  self._add_request_params(api_url, **kwargs), '-v',
-                                                                  self._api_key_logging))
         if not certificate:
             certificate = self._client_certificate_and_key
+        cache_key, entry, fresh, request_headers = self._cache_lookup(method, api_url, request_headers, certificate,
+                                                                      **kwargs)
+        if fresh:
+            r = entry.response
+            self._log_cached_response(method, api_url, r)
+            if expected_status_code is not None:
+                assert_status(r, inspect.currentframe().f_back.f_code.co_name.upper(), expected_status_code, api_url)
+            return r
 
-        try:
-            time_start = time.time()
-
-            r = requests.request(method.upper(), api_url, headers=request_headers, cert=certificate,
-                                 data=request_data, files=files, timeout=timeout, **kwargs)
-
-            time_end = time.time()
+        self._log_request(method, api_url, request_headers, request_data, logged_payload, **kwargs)
 
-            self._write_log_response(method.upper(), api_url, r, time_end - time_start)
+        try:
+            attempt = 0
+            while True:
+                if self.throttle is not None:
+                    self.throttle.acquire(api_url)
+                time_start = time.perf_counter()
+
+                r = self._session.request(method.upper(), api_url, headers=request_headers, cert=certificate,
+                                          data=request_data, files=files, timeout=timeout, **kwargs)
+
+                time_end = time.perf_counter()
+
+                self._write_log_response(method.upper(), api_url, r, time_end - time_start)
+                if self.throttle is None or not self.throttle.should_retry(method, api_url, r.status_code, r.headers,
+                                                                           attempt,
+                                                                           resendable=self._resendable(request_data,
+                                                                                                       files)):
+                    break
+                # Release the connection of the throttled response before sending again
+                r.close()
+                attempt += 1
+
+            r = self._cache_response(cache_key, entry, r)
             if expected_status_code is not None:
-                assert_status(r, inspect.stack()[1][3].upper(), expected_status_code, api_url)
+                assert_status(r, inspect.currentframe().f_back.f_code.co_name.upper(), expected_status_code, api_url)
             return r
 
         except requests.exceptions.RequestException as e:
+            if self.metrics is not None:
+                self.metrics.record(method, api_url, 'error', time.perf_counter() - time_start)
             log.error('Requests library raised exception for call {} {} - '
                       'expected status code: {} - exception message: {}'.format(method.upper(), api_url,
                                                                                 expected_status_code, e))
@@ -257,13 +592,13 @@ class RestAPI:
         url = '{}{}'.format(self.api_gw, api_url)
         payload = {'username': username, 'password': password, 'account': account}
 
-        time_start = time.time()
-        r = requests.post(url, data=payload, timeout=REST_TIMEOUT)
-        time_end = time.time()
+        time_start = time.perf_counter()
+        r = self._session.post(url, data=payload, timeout=REST_TIMEOUT)
+        time_end = time.perf_counter()
 
         self._write_log_response('Login', api_url, r, time_end - time_start)
         if expected_status_code is not None:
-            assert_status(r, inspect.stack()[1][3], expected_status_code, api_url)
+            assert_status(r, inspect.currentframe().f_back.f_code.co_name, expected_status_code, api_url)
 
         return r
 
@@ -272,19 +607,19 @@ class RestAPI:
         User logout
         :return: Logout response
         """
-        headers = self.headers
+        headers = dict(self.headers)
         if rt_token is not None:
             headers['Authorization'] = rt_token
         api_url = '/auth/logout'
         url = '{}{}'.format(self.api_gw, api_url)
 
-        time_start = time.time()
-        r = requests.post(url, headers=headers, timeout=REST_TIMEOUT)
-        time_end = time.time()
+        time_start = time.perf_counter()
+        r = self._session.post(url, headers=headers, timeout=REST_TIMEOUT)
+        time_end = time.perf_counter()
 
         self._write_log_response('Logout', api_url, r, time_end - time_start)
         if expected_status_code is not None:
-            assert_status(r, inspect.stack()[1][3], expected_status_code, api_url)
+            assert_status(r, inspect.currentframe().f_back.f_code.co_name, expected_status_code, api_url)
 
         return r
 
@@ -297,18 +632,150 @@ class RestAPI:
         :param kwargs: Other arguments used in the requests. http://docs.python-requests.org/en/master/api/
         :return: Request response
         """
-        request_headers = self.headers
         url = '{}{}'.format(self.api_gw, api_url)
-
-        if api_key:
-            key = api_key
-        else:
-            key = self.api_key
-        if key:
-            request_headers['Authorization'] = 'Bearer {}'.format(key)
+        request_headers = self._request_headers(api_key)
 
         return self._do_request('get', url, request_headers, expected_status_code=expected_status_code, **kwargs)
 
+    def download(self, api_url, destination, api_key=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None,
+                 checksum='sha256', expected_checksum=None, resume=True, max_resumes=3, expected_status_code=None,
+                 **kwargs):
+        """
+        Streaming GET writing the response body in chunks to a file or sink, the body is never kept in memory.
+        File is written to <destination>.part and renamed when complete. Interrupted transfer is continued with
+        HTTP Range request, both inside the call (max_resumes times) and on the next call for the same file.
+        :param api_url: API URL
+        :param destination: File path or writable sink with write() method
+        :param api_key: Authentication key
+        :param chunk_size: Bytes read and written at a time
+        :param progress: Callback progress(downloaded bytes, total bytes or None) called after each chunk
+        :param checksum: hashlib algorithm computed from the written data, None to skip
+        :param expected_checksum: Asserts the checksum of the complete download
+        :param resume: Continue existing .part file of the destination
+        :param max_resumes: How many times interrupted transfer is continued
+        :param expected_status_code: Asserts the result's status code, partial content of resumed download
+                                     is accepted as 200
+        :param kwargs: Other arguments used in the requests. http://docs.python-requests.org/en/master/api/
+        :return: DownloadResult with response, path, size, checksum and resume count
+        """
+        url = '{}{}'.format(self.api_gw, api_url)
+        target = DownloadTarget(destination, checksum, resume)
+        resumes = 0
+        time_start = time.perf_counter()
+        try:
+            while True:
+                range_headers = {'Range': 'bytes={}-'.format(target.size)} if target.size else None
+                request_headers = self._request_headers(api_key, append_headers=range_headers)
+                r = None
+                try:
+                    r = self._do_request('get', url, request_headers, stream=True, **kwargs)
+                    if r.status_code == 416 and target.size:
+                        # Stored part doesn't fit to the current content, start over
+                        target.restart()
+                        continue
+                    if r.status_code not in (200, 206):
+                        break
+                    if r.status_code == 200 and target.size:
+                        target.restart()
+
+                    length = r.headers.get('Content-Length')
+                    total = target.size + int(length) if length is not None and length.isdigit() else None
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        target.write(chunk)
+                        if progress is not None:
+                            progress(target.size, total)
+                    if total is not None and target.size < total:
+                        raise requests.exceptions.ChunkedEncodingError(
+                            'Connection closed at {} of {} bytes'.format(target.size, total))
+                    target.finish()
+                    break
+                except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as e:
+                    if resumes >= max_resumes:
+                        raise
+                    resumes += 1
+                    log.warning('Download of {} interrupted at {} bytes, resuming ({}/{}) - {}'.format(
+                        api_url, target.size, resumes, max_resumes, e))
+                finally:
+                    if r is not None:
+                        r.close()
+        finally:
+            target.close()
+
+        return self._finish_download(inspect.currentframe().f_back.f_code.co_name.upper(), api_url,
+                                     DownloadResult(r, target, resumes, time.perf_counter() - time_start),
+                                     checksum, expected_checksum, expected_status_code)
+
+    @staticmethod
+    def _finish_download(caller, api_url, result, checksum, expected_checksum, expected_status_code):
+        """
+        Logs the completed download and checks its status code and checksum
+        :param caller: Calling function name for assertion message
+        :param api_url: API URL
+        :param result: DownloadResult
+        :param checksum: hashlib algorithm of the result checksum
+        :param expected_checksum: Asserts the checksum of the complete download
+        :param expected_status_code: Asserts the result's status code, partial content is accepted as 200
+        :return: DownloadResult
+        """
+        log.info('GET {} - downloaded {} bytes to {} in {:.2f} s'.format(
+            api_url, result.size, result.path or 'sink', result.elapsed))
+        if expected_status_code is not None and result.status_code != 206:
+            assert_status(result.response, caller, expected_status_code, api_url)
+        if expected_checksum is not None and result.ok:
+            assert result.checksum == expected_checksum, 'Downloaded {} {} checksum {} doesn\'t match to {}'.format(
+                api_url, checksum, result.checksum, expected_checksum)
+        return result
+
+    @staticmethod
+    def _finish_upload(api_url, r, body, checksum_field=None):
+        """
+        Attaches the checksums of the sent files to the response and compares them to the one cloud computed
+        :param api_url: API URL
+        :param r: Upload response
+        :param body: Sent MultipartUpload
+        :param checksum_field: Response json field having the checksum of the only file, None to skip the check
+        :return: Upload response
+        """
+        r.upload_checksums = body.checksums
+        log.info('POST {} - uploaded {} bytes, checksums: {}'.format(api_url, len(body), r.upload_checksums))
+        if checksum_field is not None and r.status_code in (200, 201) and len(r.upload_checksums) == 1:
+            try:
+                cloud_checksum = r.json().get(checksum_field)
+            except ValueError:
+                cloud_checksum = None
+            sent_checksum = next(iter(r.upload_checksums.values()))
+            if cloud_checksum is not None:
+                assert cloud_checksum == sent_checksum, 'Uploaded {} checksum {} doesn\'t match to sent {}'.format(
+                    api_url, cloud_checksum, sent_checksum)
+        return r
+
+    def upload(self, api_url, files, fields=None, api_key=None, chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, progress=None,
+               checksum='sha256', checksum_field=None, expected_status_code=None, **kwargs):
+        """
+        Streaming multipart/form-data POST, files are read in bounded chunks while they are sent, so big images
+        are never kept in memory. Checksum of each file is computed on the fly and files are closed when the
+        call returns. Throttled upload is not resent.
+        :param api_url: API URL
+        :param files: {field name: file path, binary file object or (file name, path or file object[, content type])}
+        :param fields: {field name: value} of the other form fields
+        :param api_key: Authentication key
+        :param chunk_size: Maximum bytes read from a file at a time
+        :param progress: Callback progress(sent bytes, total bytes) called after each read
+        :param checksum: hashlib algorithm computed from the sent files, None to skip
+        :param checksum_field: Asserts the checksum to response json field, e.g. 'datafile_checksum'
+        :param expected_status_code: Asserts the result's status code
+        :param kwargs: Other arguments used in the requests. http://docs.python-requests.org/en/master/api/
+        :return: Request response, upload_checksums attribute has {field name: checksum} of the sent files
+        """
+        url = '{}{}'.format(self.api_gw, api_url)
+        with MultipartUpload(files, fields, checksum, progress, chunk_size) as body:
+            request_headers = self._request_headers(api_key, body.content_type)
+            r = self._do_request('post', url, request_headers, request_data=body,
+                                 logged_payload='multipart upload of {} bytes'.format(len(body)),
+                                 expected_status_code=expected_status_code, **kwargs)
+        return self._finish_upload(api_url, r, body, checksum_field)
+
     def put(self, api_url, api_key=None, payload=None, content_type=None, expected_status_code=None, **kwargs):
         """
         PUT
@@ -319,20 +786,8 @@ class RestAPI:
         :param expected_status_code: Asserts the result's status code
         :return: Request response
         """
-        request_headers = self.headers
         url = '{}{}'.format(self.api_gw, api_url)
-
-        if api_key:
-            key = api_key
-        else:
-            key = self.api_key
-        if key:
-            request_headers['Authorization'] = 'Bearer {}'.format(key)
-
-        if content_type:
-            request_headers['Content-type'] = content_type
-        else:
-            request_headers['Content-type'] = self.default_content_type
+        request_headers = self._request_headers(api_key, content_type)
 
         request_data = self._data_content(request_headers, payload)
 
@@ -355,28 +810,10 @@ class RestAPI:
         :param kwargs: Other arguments used in the requests. http://docs.python-requests.org/en/master/api/
         :return: Request response
         """
-        request_headers = self.headers
         url = '{}{}'.format(self.api_gw, api_url)
-
-        if api_key:
-            key = api_key
-        else:
-            key = self.api_key
-        if key:
-            request_headers['Authorization'] = 'Bearer {}'.format(key)
-
-        if content_type:
-            request_headers['Content-type'] = content_type
-        else:
-            request_headers['Content-type'] = self.default_content_type
-
-        # Add custom headers
-        if append_headers is not None:
-            request_headers.update(append_headers)
-
         # This is our cloud's bug IOTUPD-3685 - when sending files with requests library, leave the content-type out
-        if files is not None:
-            request_headers.pop('Content-type')
+        request_headers = self._request_headers(api_key, content_type, append_headers,
+                                                with_content_type=files is None)
 
         if log_payload:
             logged_payload = payload
@@ -399,15 +836,8 @@ class RestAPI:
         :param expected_status_code: Asserts the result's status code
         :return: Request response
         """
-        request_headers = self.headers
         url = '{}{}'.format(self.api_gw, api_url)
-
-        if api_key:
-            key = api_key
-        else:
-            key = self.api_key
-        if key:
-            request_headers['Authorization'] = 'Bearer {}'.format(key)
+        request_headers = self._request_headers(api_key)
 
         request_data = self._data_content(request_headers, payload)
 
@@ -424,20 +854,8 @@ class RestAPI:
         :param expected_status_code: Asserts the result's status code
         :return: Request response
         """
-        request_headers = self.headers
         url = '{}{}'.format(self.api_gw, api_url)
-
-        if api_key:
-            key = api_key
-        else:
-            key = self.api_key
-        if key:
-            request_headers['Authorization'] = 'Bearer {}'.format(key)
-
-        if content_type:
-            request_headers['Content-type'] = content_type
-        else:
-            request_headers['Content-type'] = self.default_content_type
+        request_headers = self._request_headers(api_key, content_type)
 
         request_data = self._data_content(request_headers, payload)
 
@@ -453,15 +871,8 @@ class RestAPI:
         :param kwargs: Other arguments used in the requests. http://docs.python-requests.org/en/master/api/
         :return: Request response
         """
-        request_headers = self.headers
         url = '{}{}'.format(self.api_gw, api_url)
-
-        if api_key:
-            key = api_key
-        else:
-            key = self.api_key
-        if key:
-            request_headers['Authorization'] = 'Bearer {}'.format(key)
+        request_headers = self._request_headers(api_key)
 
         return self._do_request('head', url, request_headers, expected_status_code=expected_status_code, **kwargs)
 
@@ -474,14 +885,7 @@ class RestAPI:
         :param kwargs: Other arguments used in the requests. http://docs.python-requests.org/en/master/api/
         :return: Request response
         """
-        request_headers = self.headers
         url = '{}{}'.format(self.api_gw, api_url)
-
-        if api_key:
-            key = api_key
-        else:
-            key = self.api_key
-        if key:
-            request_headers['Authorization'] = 'Bearer {}'.format(key)
+        request_headers = self._request_headers(api_key)
 
         return self._do_request('options', url, request_headers, expected_status_code=expected_status_code, **kwargs)
@@ -0,0 +1,292 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+This module is for client side rate limiting of the cloud REST requests
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from fnmatch import fnmatchcase
+from urllib.parse import urlsplit
+
+from izuma_systest_lib.tools import config_flag
+
+log = logging.getLogger(__name__)
+
+# Endpoint class path pattern: (requests per second, burst size), first matching pattern is used.
+# Adjust with rest_rate_limits config key to the limits of the used account.
+DEFAULT_RATE_LIMITS = {'/v2/device-requests/*': (20, 40),
+                       '/v2/endpoints/*': (20, 40),
+                       '*': (10, 20)}
+
+THROTTLE_STATUS_CODES = (429, 503)
+# 503 may come after the request was processed, so only idempotent requests are resent
+IDEMPOTENT_METHODS = ('get', 'head', 'options', 'put', 'delete')
+RATE_WINDOW = 10
+
+
+def parse_retry_after(value):
+    """
+    Parses Retry-After header value
+    :param value: Delay in seconds or HTTP date
+    :return: Delay in seconds or None if value is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time.tzinfo is None:
+        retry_time = retry_time.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_time - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Token bucket of one endpoint class. Callers reserve the send times in arrival order, so concurrent callers are
+    served first come first served and never all at once after a wait.
+    Rate is halved on every throttle response and recovers step by step on successful responses.
+    """
+
+    min_rate_factor = 0.1
+    recovery_step = 0.05
+
+    def __init__(self, name, rate, burst):
+        """
+        :param name: Endpoint class name
+        :param rate: Requests per second
+        :param burst: Requests that can be sent at once after idle time
+        """
+        self.name = name
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.rate_factor = 1.0
+        self.queue_depth = 0
+        self.throttle_events = 0
+        self.retries = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self._next_send = 0.0
+        self._backoff_until = 0.0
+        self._sent = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def current_rate(self):
+        return self.rate * self.rate_factor
+
+    def reserve(self):
+        """
+        Reserves the next send time
+        :return: Seconds to wait before sending
+        """
+        with self._lock:
+            now = time.monotonic()
+            interval = 1.0 / self.current_rate
+            tolerance = (self.burst - 1) * interval
+            next_send = max(self._next_send, now, self._backoff_until)
+            send_time = max(now, self._backoff_until, next_send - tolerance)
+            self._next_send = next_send + interval
+            self._sent.append(send_time)
+            while self._sent and self._sent[0] < now - RATE_WINDOW:
+                self._sent.popleft()
+            delay = send_time - now
+            if delay > 0:
+                self.queue_depth += 1
+                self.waits += 1
+                self.wait_time += delay
+            return delay
+
+    def waited(self):
+        """
+        Marks the reserved wait done
+        """
+        with self._lock:
+            self.queue_depth -= 1
+
+    def throttled(self, delay, retry):
+        """
+        Stops sending for the delay and lowers the rate
+        :param delay: Seconds to wait before next request
+        :param retry: True if the throttled request is sent again
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.throttle_events += 1
+            if retry:
+                self.retries += 1
+            self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+            self._backoff_until = max(self._backoff_until, now + delay)
+            # No burst after the backoff, requests continue one interval apart
+            tolerance = (self.burst - 1) / self.current_rate
+            self._next_send = max(self._next_send, self._backoff_until + tolerance)
+
+    def succeeded(self):
+        """
+        Raises the lowered rate back towards the configured one
+        """
+        if self.rate_factor < 1.0:
+            with self._lock:
+                self.rate_factor = min(1.0, self.rate_factor + self.recovery_step)
+
+    def stats(self):
+        """
+        Returns the bucket counters
+        :return: Dict of configured, current and observed rate, queue depth and throttle counters
+        """
+        with self._lock:
+            now = time.monotonic()
+            sent = sum(1 for send_time in self._sent if now - RATE_WINDOW <= send_time <= now)
+            return {'rate': self.rate,
+                    'current_rate': round(self.current_rate, 3),
+                    'observed_rate': round(sent / RATE_WINDOW, 3),
+                    'queue_depth': self.queue_depth,
+                    'throttle_events': self.throttle_events,
+                    'retries': self.retries,
+                    'waits': self.waits,
+                    'wait_time': round(self.wait_time, 3),
+                    'backoff': round(max(0.0, self._backoff_until - now), 3)}
+
+
+class RequestThrottle:
+    """
+    Client side rate limiter for RestAPI requests.
+
+    Every request takes a token from the bucket of its endpoint class, endpoint classes are fnmatch patterns
+    of the url path with (requests per second, burst size) budget. Callers wait for their turn in arrival order.
+    On 429 or 503 response the endpoint class is paused for Retry-After seconds (or exponential backoff
+    if the header is missing), its rate is halved and the request is sent again, up to max_retries times.
+    503 is resent only for idempotent methods.
+
+    Throttle is switched on with config key rest_throttle, tuned with rest_rate_limits {pattern: [rate, burst]},
+    rest_throttle_retries and rest_throttle_max_backoff. stats() gives the rate, queue depth and throttle
+    counters of each endpoint class.
+    :param rate_limits: {path pattern: (requests per second, burst size)}, defaults to DEFAULT_RATE_LIMITS
+    :param max_retries: Resend count of throttled request
+    :param max_backoff: Maximum wait in seconds after throttle response
+    """
+
+    def __init__(self, rate_limits=None, max_retries=3, max_backoff=60.0):
+        rate_limits = DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._buckets = [(pattern, TokenBucket(pattern, rate, burst)) for pattern, (rate, burst) in rate_limits.items()]
+        if not any(pattern == '*' for pattern, _ in self._buckets):
+            self._buckets.append(('*', TokenBucket('*', *DEFAULT_RATE_LIMITS['*'])))
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates the throttle if it is switched on in config
+        :param config: Config data, see rest_throttle, rest_rate_limits, rest_throttle_retries and
+                       rest_throttle_max_backoff keys
+        :return: RequestThrottle or None
+        """
+        if not config_flag(config, 'rest_throttle'):
+            return None
+        return cls(config.get('rest_rate_limits'), int(config.get('rest_throttle_retries', 3)),
+                   float(config.get('rest_throttle_max_backoff', 60)))
+
+    def bucket(self, url):
+        """
+        Finds the token bucket of the endpoint class
+        :param url: Request url
+        :return: TokenBucket
+        """
+        path = urlsplit(url).path
+        for pattern, bucket in self._buckets:
+            if fnmatchcase(path, pattern):
+                return bucket
+        return self._buckets[-1][1]
+
+    def acquire(self, url):
+        """
+        Waits for the turn to send the request
+        :param url: Request url
+        :return: Waited seconds
+        """
+        bucket = self.bucket(url)
+        delay = bucket.reserve()
+        if delay > 0:
+            log.debug('Throttling request to {} for {:.3f} s, queue depth {}'.format(url, delay, bucket.queue_depth))
+            try:
+                time.sleep(delay)
+            finally:
+                bucket.waited()
+        return delay
+
+    async def acquire_async(self, url):
+        """
+        Waits for the turn to send the request without blocking the event loop
+        :param url: Request url
+        :return: Waited seconds
+        """
+        bucket = self.bucket(url)
+        delay = bucket.reserve()
+        if delay > 0:
+            log.debug('Throttling request to {} for {:.3f} s, queue depth {}'.format(url, delay, bucket.queue_depth))
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                bucket.waited()
+        return delay
+
+    def should_retry(self, method, url, status_code, headers, attempt, resendable=True):
+        """
+        Handles the response status, backs off the endpoint class on throttle response
+        :param method: Request method
+        :param url: Request url
+        :param status_code: Response status code
+        :param headers: Response headers
+        :param attempt: Count of already resent requests
+        :param resendable: False if the request body can't be sent again, e.g. it was read from a file
+        :return: True if the request should be sent again
+        """
+        bucket = self.bucket(url)
+        if status_code not in THROTTLE_STATUS_CODES:
+            bucket.succeeded()
+            return False
+
+        delay = parse_retry_after(headers.get('Retry-After'))
+        if delay is None:
+            delay = 2 ** attempt
+        delay = min(delay, self.max_backoff)
+        retry = resendable and attempt < self.max_retries and \
+            (status_code == 429 or method.lower() in IDEMPOTENT_METHODS)
+        bucket.throttled(delay, retry)
+        log.warning('{} {} - Response: {} - backing off "{}" requests for {:.1f} s, rate lowered to {:.2f}/s'.format(
+            method.upper(), url, status_code, bucket.name, delay, bucket.current_rate))
+        return retry
+
+    def stats(self):
+        """
+        Returns the counters of each endpoint class
+        :return: {endpoint class: counters}
+        """
+        return {pattern: bucket.stats() for pattern, bucket in self._buckets}
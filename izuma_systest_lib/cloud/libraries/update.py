@@ -24,6 +24,9 @@ This module is for cloud's Update API functions
 from hashlib import md5
 from base64 import b64encode
 
+from izuma_systest_lib.cloud.libraries.firmware_upload import DEFAULT_UPLOAD_CHUNK_SIZE, ChunkedFirmwareUpload
+from izuma_systest_lib.cloud.libraries.pagination import PageIterator
+
 
 class UpdateAPI:
     """
@@ -40,22 +43,23 @@ class UpdateAPI:
         self.api_version = 'v3'
         self.cloud_api = rest_api
 
-    def upload_firmware_image(self, firmware_binary_path, firmware_data=None, api_key=None, expected_status_code=None):
+    def upload_firmware_image(self, firmware_binary_path, firmware_data=None, api_key=None, expected_status_code=None,
+                              progress=None):
         """
-        Upload firmware image
+        Upload firmware image. The image is streamed from the file, its sha256 is computed while sending and
+        compared to the datafile_checksum of the created image.
         :param firmware_binary_path: Path to firmware binary
-        :param firmware_data: Firmware payload (optional)
+        :param firmware_data: Firmware form fields, e.g. name and description (optional)
         :param api_key: Authentication key
         :param expected_status_code: Asserts the result in the function
+        :param progress: Callback progress(sent bytes, total bytes)
         :return: POST /firmware-images response
         """
         api_url = '/{}/firmware-images'.format(self.api_version)
 
-        header_content = 'multipart/form-data'
-        fw_image = {'datafile': open(firmware_binary_path, 'rb')}
-
-        r = self.cloud_api.post(api_url, api_key, firmware_data, content_type=header_content, files=fw_image,
-                                expected_status_code=expected_status_code)
+        r = self.cloud_api.upload(api_url, {'datafile': firmware_binary_path}, firmware_data, api_key,
+                                  progress=progress, checksum_field='datafile_checksum',
+                                  expected_status_code=expected_status_code)
         return r
 
     def get_firmware_image(self, image_id, api_key=None, expected_status_code=None):
@@ -84,6 +88,16 @@ class UpdateAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_firmware_images(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all firmware images page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'order': 'ASC'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the firmware images of GET /firmware-images pages
+        """
+        return PageIterator(self.get_firmware_images, query_params, api_key=api_key, **page_options)
+
     def get_firmware_images_count(self, api_key=None, expected_status_code=None):
         """
         Get firmware images count
@@ -190,19 +204,33 @@ class UpdateAPI:
         r = self.cloud_api.post(api_url, api_key, expected_status_code=expected_status_code)
         return r
 
-    def get_firmware_upload_job_all_chunks_metadata(self, upload_job_id, api_key=None, expected_status_code=None):
+    def get_firmware_upload_job_all_chunks_metadata(self, upload_job_id, api_key=None, expected_status_code=None,
+                                                    query_params=None):
         """
         List all metadata for uploaded chunks
         :param upload_job_id: Upload job id
         :param api_key: Authentication key
         :param expected_status_code: Asserts the result in the function
+        :param query_params: e.g.{'limit': '1000', 'order': 'ASC'}
         :return: GET /firmware-images/upload-jobs/{upload_job_id}/chunks response
         """
         api_url = '/{}/firmware-images/upload-jobs/{}/chunks'.format(self.api_version, upload_job_id)
 
-        r = self.cloud_api.get(api_url, api_key, expected_status_code=expected_status_code)
+        r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_firmware_upload_job_chunks(self, upload_job_id, query_params=None, api_key=None, **page_options):
+        """
+        Iterate metadata of all uploaded chunks page by page
+        :param upload_job_id: Upload job id
+        :param query_params: e.g.{'order': 'ASC'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the chunks of GET /firmware-images/upload-jobs/{upload_job_id}/chunks pages
+        """
+        return PageIterator(self.get_firmware_upload_job_all_chunks_metadata, query_params,
+                            upload_job_id=upload_job_id, api_key=api_key, **page_options)
+
     def get_firmware_upload_job_chunk_metadata(self, upload_job_id, chunk_id, api_key=None, expected_status_code=None):
         """
         Get metadata about a chunk
@@ -217,22 +245,21 @@ class UpdateAPI:
         r = self.cloud_api.get(api_url, api_key, expected_status_code=expected_status_code)
         return r
 
-    def upload_firmware_manifest(self, manifest_file_path, manifest_data=None, api_key=None, expected_status_code=None):
+    def upload_firmware_manifest(self, manifest_file_path, manifest_data=None, api_key=None, expected_status_code=None,
+                                 progress=None):
         """
-        Upload firmware manifest
+        Upload firmware manifest, the file is streamed and closed when the upload is done
         :param manifest_file_path: Manifest file to post
-        :param manifest_data: Manifest payload
+        :param manifest_data: Manifest form fields, e.g. name and description (optional)
         :param api_key: Authentication key
         :param expected_status_code: Asserts the result in the function
+        :param progress: Callback progress(sent bytes, total bytes)
         :return: POST /firmware-manifests response
         """
         api_url = '/{}/firmware-manifests'.format(self.api_version)
 
-        header_content = 'multipart/form-data'
-        manifest_file = {'datafile': open(manifest_file_path, 'rb')}
-
-        r = self.cloud_api.post(api_url, api_key, manifest_data, files=manifest_file, content_type=header_content,
-                                expected_status_code=expected_status_code)
+        r = self.cloud_api.upload(api_url, {'datafile': manifest_file_path}, manifest_data, api_key,
+                                  progress=progress, expected_status_code=expected_status_code)
         return r
 
     def get_firmware_manifest(self, manifest_id, api_key=None, expected_status_code=None):
@@ -261,6 +288,16 @@ class UpdateAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_firmware_manifests(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all firmware manifests page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'order': 'ASC'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the firmware manifests of GET /firmware-manifests pages
+        """
+        return PageIterator(self.get_firmware_manifests, query_params, api_key=api_key, **page_options)
+
     def get_firmware_manifests_count(self, api_key=None, expected_status_code=None):
         """
         Get firmware manifests count
@@ -407,6 +444,16 @@ class UpdateAPI:
         r = self.cloud_api.get(api_url, api_key, params=query_params, expected_status_code=expected_status_code)
         return r
 
+    def iterate_update_campaigns(self, query_params=None, api_key=None, **page_options):
+        """
+        Iterate all update campaigns page by page, next page is requested while the current one is consumed
+        :param query_params: e.g.{'order': 'ASC'}, 'limit' sets the page size
+        :param api_key: Authentication key
+        :param page_options: PageIterator options max_items, max_pages, page_size and prefetch
+        :return: PageIterator yielding the update campaigns of GET /update-campaigns pages
+        """
+        return PageIterator(self.get_update_campaigns, query_params, api_key=api_key, **page_options)
+
     def get_update_campaigns_count(self, api_key=None, expected_status_code=None):
         """
         Get update campaigns count
@@ -448,20 +495,38 @@ class UpdateAPI:
         r = self.cloud_api.delete(api_url, api_key, expected_status_code=expected_status_code)
         return r
 
-    def upload_firmware_chunk(self, job_id, chunk, api_key=None, expected_status_code=None):
+    def upload_firmware_chunk(self, job_id, chunk, api_key=None, expected_status_code=None, content_md5=None):
         """
         Upload chunk of firmware into cloud
 
         :param job_id: Upload job id
-        :param chunk: Chunk of firmware to uplaod
+        :param chunk: Chunk of firmware to uplaod, bytes or memoryview
         :param api_key: Authentication key
         :param expected_status_code: Asserts the result in the function
+        :param content_md5: Precomputed Content-MD5 of the chunk
         """
         api_url = '/{}/firmware-images/upload-jobs/{}/chunks'.format(self.api_version, job_id)
-        headers = {'Content-MD5': b64encode(md5(chunk).digest()).decode('utf-8'),
+        if content_md5 is None:
+            content_md5 = b64encode(md5(chunk).digest()).decode('utf-8')
+        headers = {'Content-MD5': content_md5,
                    'Content-type': 'binary/octet-stream',
                    'Content-Length': str(len(chunk))}
 
         r = self.cloud_api.post(api_url, api_key, payload=chunk, append_headers=headers, json_payload=False,
                                 log_payload=False, expected_status_code=expected_status_code)
         return r
+
+    def upload_firmware_image_chunked(self, firmware_binary_path, upload_job_data=None, job_id=None, api_key=None,
+                                      chunk_size=DEFAULT_UPLOAD_CHUNK_SIZE, progress=None):
+        """
+        Upload firmware image in chunks with an upload job, see ChunkedFirmwareUpload
+        :param firmware_binary_path: Path to firmware binary
+        :param upload_job_data: Upload job payload, e.g. {'name': 'edge-os'}
+        :param job_id: Id of an interrupted upload job to continue
+        :param api_key: Authentication key
+        :param chunk_size: Chunk size in bytes
+        :param progress: Callback progress(uploaded bytes, total bytes)
+        :return: ChunkedUploadResult with job id, firmware image id and throughput
+        """
+        uploader = ChunkedFirmwareUpload(self, chunk_size=chunk_size, progress=progress, api_key=api_key)
+        return uploader.upload(firmware_binary_path, upload_job_data, job_id)
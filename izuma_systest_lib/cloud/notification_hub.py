@@ -0,0 +1,297 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+"""
+Shared WebSocket notification channel with per test views
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+from izuma_systest_lib.cloud.websocket_handler import WebSocketHandler, WebsSocketNotificationChannel
+from izuma_systest_lib.tools import config_flag
+
+log = logging.getLogger(__name__)
+
+WEBSOCKET_SHARED_CHANNEL = os.getenv('WEBSOCKET_SHARED_CHANNEL', default='false').lower() == 'true'
+
+
+def use_shared_channel(config):
+    """
+    :param config: Config data
+    :return: True if the tests should use views of the shared notification channel
+    """
+    return config_flag(config, 'websocket_shared_channel', WEBSOCKET_SHARED_CHANNEL)
+
+
+class EventLogView:
+    """
+    Part of an EventLog visible to a view: events appended after the view was opened, of the view's devices
+    :param event_log: EventLog
+    :param start: Sequence number of the first visible event
+    :param view: NotificationView
+    """
+
+    def __init__(self, event_log, start, view):
+        self.event_log = event_log
+        self.start = start
+        self.view = view
+
+    def find(self, endpoint, path=None, after=None):
+        """
+        :param endpoint: Endpoint name
+        :param path: Resource path
+        :param after: Only events with sequence number >= after
+        :return: List of the visible events in arrival order
+        """
+        if not self.view.watches(endpoint):
+            return []
+        return self.event_log.find(endpoint, path, after=max(self.start, after or 0))
+
+    def read(self, endpoint, cursor, path=None):
+        """
+        :param endpoint: Endpoint name
+        :param cursor: Sequence number of the first unread event
+        :param path: Resource path
+        :return: (list of events, cursor after them)
+        """
+        if not self.view.watches(endpoint):
+            return [], max(self.start, cursor)
+        return self.event_log.read(endpoint, max(self.start, cursor), path)
+
+    def first(self, endpoint, path=None):
+        if not self.view.watches(endpoint):
+            return None
+        return self.event_log.first(endpoint, path, after=self.start)
+
+    def last(self, endpoint, path=None):
+        if not self.view.watches(endpoint):
+            return None
+        return self.event_log.last(endpoint, path, after=self.start)
+
+    def count(self, endpoint, path=None):
+        if not self.view.watches(endpoint):
+            return 0
+        return self.event_log.count(endpoint, path, after=self.start)
+
+    def endpoints(self):
+        return [endpoint for endpoint in self.event_log.endpoints() if self.count(endpoint)]
+
+    @property
+    def next_seq(self):
+        return self.event_log.next_seq
+
+    def after(self, seq):
+        return list(self.iter_after(seq)), self.event_log.next_seq
+
+    def iter_after(self, seq):
+        """
+        :param seq: Sequence number of the first wanted event
+        :return: Generator of the visible events from the cursor on
+        """
+        return (event for event in self.event_log.iter_after(max(self.start, seq))
+                if self.view.watches(event.get('ep')))
+
+    def stats(self):
+        return self.event_log.stats()
+
+    def __iter__(self):
+        return self.iter_after(self.start)
+
+    def __len__(self):
+        endpoints = self.view.devices if self.view.devices is not None else self.event_log.endpoints()
+        return sum(self.event_log.count(endpoint, after=self.start) for endpoint in list(endpoints))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        position = index + len(self) if index < 0 else index
+        event = next(itertools.islice(self, position, None), None) if position >= 0 else None
+        if event is None:
+            raise IndexError('EventLogView index {} out of range'.format(index))
+        return event
+
+
+class ResponseView:
+    """
+    Async-responses visible to a view: arrived after the view was opened, of the view's async-ids
+    :param responses: ResponseStore
+    :param view: NotificationView
+    """
+
+    def __init__(self, responses, view):
+        self.responses = responses
+        self.view = view
+
+    def get(self, async_id, default=None):
+        response = self.responses.get(async_id)
+        if response is None or not self.view.watches_response(async_id, response):
+            return default
+        return response
+
+    def __getitem__(self, async_id):
+        response = self.get(async_id)
+        if response is None:
+            raise KeyError(async_id)
+        return response
+
+    def __contains__(self, async_id):
+        return self.get(async_id) is not None
+
+    def stats(self):
+        return self.responses.stats()
+
+
+class EventStoreView:
+    """
+    EventStore of a view, the waits run on the hub's store
+    :param events: EventStore
+    :param view: NotificationView
+    """
+
+    def __init__(self, events, view):
+        self.events = events
+        self.view = view
+        self.waiters = events.waiters
+        self.in_flight = events.in_flight
+        self.async_responses = ResponseView(events.async_responses, view)
+        self._starts = {notification_type: event_log.next_seq for notification_type, event_log in list(events.items())}
+        self._logs = {}
+
+    def __getitem__(self, notification_type):
+        if notification_type not in self._logs:
+            # Log created after the view was opened has only visible events
+            self._logs[notification_type] = EventLogView(self.events[notification_type],
+                                                         self._starts.get(notification_type, 0), self.view)
+        return self._logs[notification_type]
+
+    def wait(self, notification_type, endpoint, check, timeout, path=None):
+        return self.events.wait(notification_type, endpoint, check, timeout, path=path)
+
+    async def async_wait(self, notification_type, endpoint, check, timeout, path=None):
+        return await self.events.async_wait(notification_type, endpoint, check, timeout, path=path)
+
+    def stats(self):
+        return self.events.stats()
+
+
+class NotificationView:
+    """
+    Runner-like view of the hub's channel for one test, WebSocketHandler works on it as on WebSocketRunner.
+    Only events arrived after the view was opened are visible, so the tests don't see each other's earlier
+    events. Device ids and async-ids the test checks or waits for through WebSocketHandler are added to the visible
+    ones, so a view opened with empty devices and async-ids sees only the test's own devices and requests.
+    Without devices (None) the isolation is only by the time window, events of concurrently running tests are
+    visible too.
+    :param runner: WebSocketRunner of the hub
+    :param devices: Visible device ids, None for all
+    :param async_ids: Visible async-ids, None for all
+    """
+
+    def __init__(self, runner, devices=None, async_ids=None):
+        self.runner = runner
+        self.opened = time.time()
+        self.devices = set(devices) if devices is not None else None
+        self.async_ids = set(async_ids) if async_ids is not None else None
+        self.events = EventStoreView(runner.events, self)
+        self.async_responses = self.events.async_responses
+
+    @property
+    def api_key(self):
+        return self.runner.api_key
+
+    def watch(self, device_id=None, async_id=None):
+        """
+        Adds device id or async-id to the visible ones when the view is filtered, WebSocketHandler calls this
+        for the device ids and async-ids it is asked for
+        :param device_id: Device id
+        :param async_id: Async-id
+        """
+        if device_id is not None and self.devices is not None:
+            self.devices.add(device_id)
+        if async_id is not None and self.async_ids is not None:
+            self.async_ids.add(async_id)
+
+    def watches(self, endpoint):
+        return self.devices is None or endpoint in self.devices
+
+    def watches_response(self, async_id, response):
+        if self.async_ids is not None and async_id not in self.async_ids:
+            return False
+        return getattr(response, 'received', self.opened) >= self.opened
+
+
+class NotificationHub:
+    """
+    One WebSocket notification channel shared by the tests of a session. Registering, opening and deleting
+    a channel takes seconds, a view of the hub's channel is created instantly.
+
+        hub = NotificationHub(cloud_api, api_key)
+        websocket = hub.view(devices=[device_id])
+        websocket.wait_for_registration(device_id)
+        hub.close_view(websocket)
+
+    :param cloud_api: Cloud API object
+    :param api_key: Api key of the channel
+    :param configuration: Channel configuration
+    :param retention: RetentionPolicy of the stored events
+    """
+
+    def __init__(self, cloud_api, api_key, configuration=None, retention=None):
+        self.channel = WebsSocketNotificationChannel(cloud_api, api_key, configuration, retention)
+        self.views = []
+        self._lock = threading.Lock()
+
+    @property
+    def api_key(self):
+        return self.channel.api_key
+
+    def view(self, devices=None, async_ids=None):
+        """
+        Opens a view of the channel
+        :param devices: Visible device ids, None for all
+        :param async_ids: Visible async-ids, None for all
+        :return: WebSocketHandler on the view
+        """
+        view = NotificationView(self.channel.ws, devices, async_ids)
+        with self._lock:
+            self.views.append(view)
+        log.debug('Opened notification view {} of {} open'.format(id(view), len(self.views)))
+        return WebSocketHandler(view)
+
+    def close_view(self, handler):
+        """
+        Closes a view opened with view()
+        :param handler: WebSocketHandler returned by view()
+        """
+        with self._lock:
+            if handler.ws in self.views:
+                self.views.remove(handler.ws)
+
+    def close(self):
+        """
+        Closes the channel
+        """
+        with self._lock:
+            if self.views:
+                log.warning('Closing notification hub with {} open views'.format(len(self.views)))
+            self.views = []
+        self.channel.close()
@@ -21,49 +21,110 @@
 WebSocket notification channel related helpers.
 """
 
-import base64
-import datetime
 import json
 import logging
+import os
 import queue
 import threading
+import time
+from concurrent.futures import wait
 from time import sleep
 
 from ws4py.client.threadedclient import WebSocketClient
 from ws4py.exc import WebSocketException
 
+from izuma_systest_lib.cloud.event_store import ASYNC_RESPONSES, EventStore, Record
 from izuma_systest_lib.tools import build_random_string
 
 log = logging.getLogger(__name__)
 
+# Ceilings of waiting the channel to be ready after registering and drained before deleting
+WEBSOCKET_READY_TIMEOUT = float(os.getenv('WEBSOCKET_READY_TIMEOUT', default='5'))
+WEBSOCKET_DRAIN_TIMEOUT = float(os.getenv('WEBSOCKET_DRAIN_TIMEOUT', default='2'))
+
+
+def poll(check, timeout, delay=0.1, max_delay=1.0):
+    """
+    Calls check() with exponential backoff until it returns a true value or the timeout passes
+    :param check: Function returning the waited result or false value
+    :param timeout: Seconds to poll
+    :param delay: First delay in seconds, doubled after each call
+    :param max_delay: Maximum delay in seconds
+    :return: Result of the last check()
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = check()
+        remaining = deadline - time.monotonic()
+        if result or remaining <= 0:
+            return result
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
 
 class WebsSocketNotificationChannel:
+    """
+    Registers WebSocket notification channel and opens WebSocketRunner to it. Instead of fixed sleeps, the channel
+    status is polled until it's ready before connecting and until it's disconnected before deleting (IOTNS-205).
+    WEBSOCKET_READY_TIMEOUT (5 s) and WEBSOCKET_DRAIN_TIMEOUT (2 s) env variables are the worst case waits.
+    Time spent is stored to setup_time and teardown_time.
+    """
 
-    def __init__(self, cloud_api, api_key, configuration=None):
+    def __init__(self, cloud_api, api_key, configuration=None, retention=None):
         log.info('Register and open WebSocket notification channel')
         self.api_key = api_key
         self.cloud_api = cloud_api
+        self.cassette = cloud_api.rest_api.cassette
+        self.teardown_time = None
+        self._replaying = self.cassette is not None and self.cassette.replaying
+        time_start = time.monotonic()
         cloud_api.connect.register_websocket_channel(api_key,
                                                      configuration=configuration,
                                                      expected_status_code=[200, 201])
-        # IOTNS-205
-        sleep(5)
+        deadline = time_start + WEBSOCKET_READY_TIMEOUT
+        # IOTNS-205, connecting right after registering fails
+        if not self._replaying and not poll(self._channel_status, WEBSOCKET_READY_TIMEOUT):
+            log.warning('WebSocket channel was not ready in {} s, connecting anyway'.format(WEBSOCKET_READY_TIMEOUT))
         # Get host part from api address
         host = cloud_api.rest_api.api_gw.split('//')[1]
 
         log.info('Opening WebSocket handler')
         self.ws = WebSocketRunner('wss://{}/v2/notification/websocket-connect'.format(host),
-                                  api_key)
+                                  api_key, self.cassette, retention)
         self.handler = WebSocketHandler(self.ws)
+        if not self._replaying:
+            opened = self.ws.wait_connected(max(0.0, deadline - time.monotonic())) and \
+                poll(lambda: self._channel_status() == 'connected', max(0.0, deadline - time.monotonic()))
+            if not opened:
+                log.warning('WebSocket channel was not connected in {} s'.format(WEBSOCKET_READY_TIMEOUT))
+        self.setup_time = time.monotonic() - time_start
+        log.info('WebSocket notification channel set up in {:.2f} s'.format(self.setup_time))
+
+    def _channel_status(self):
+        """
+        :return: Status of the registered channel, e.g. 'connected' or 'disconnected', None if not found
+        """
+        r = self.cloud_api.connect.get_websocket_channel(self.api_key)
+        if r.status_code != 200:
+            return None
+        return r.json().get('status') or 'registered'
 
     def close(self):
+        time_start = time.monotonic()
         try:
             self.ws.close()
         except BaseException as e:
             log.warning('Websocket closing error: {}'.format(e))
-        sleep(2)
+        if not self._replaying:
+            deadline = time_start + WEBSOCKET_DRAIN_TIMEOUT
+            drained = self.ws.wait_disconnected(WEBSOCKET_DRAIN_TIMEOUT) and \
+                poll(lambda: self._channel_status() != 'connected', max(0.0, deadline - time.monotonic()))
+            if not drained:
+                log.warning('WebSocket channel was not disconnected in {} s'.format(WEBSOCKET_DRAIN_TIMEOUT))
         log.info('Deleting WebSocket channel')
         self.cloud_api.connect.delete_websocket_channel(self.api_key, expected_status_code=204)
+        self.teardown_time = time.monotonic() - time_start
+        log.info('WebSocket notification channel closed in {:.2f} s'.format(self.teardown_time))
 
 
 class WebSocketHandler:
@@ -90,11 +151,9 @@ class WebSocketHandler:
         :param device_id: string
         :return:
         """
-        for item in self.ws.events['registrations']:
-            # If asked device_id is found return its data. Otherwise return False
-            if item['ep'] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its first message. Otherwise return False
+        self.ws.watch(device_id=device_id)
+        return self.ws.events['registrations'].first(device_id) or False
 
     def check_deregistration(self, device_id):
         """
@@ -103,11 +162,9 @@ class WebSocketHandler:
         :param device_id: string
         :return:
         """
-        for item in self.ws.events['de-registrations']:
-            # If asked device_id is found return its data. Otherwise return False
-            if item['ep'] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its first message. Otherwise return False
+        self.ws.watch(device_id=device_id)
+        return self.ws.events['de-registrations'].first(device_id) or False
 
     def check_registration_updates(self, device_id):
         """
@@ -116,11 +173,9 @@ class WebSocketHandler:
         :param device_id: string
         :return: False / dict
         """
-        for item in self.ws.events['reg-updates']:
-            # If asked device_id is found return its data. Otherwise return False
-            if item['ep'] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its first message. Otherwise return False
+        self.ws.watch(device_id=device_id)
+        return self.ws.events['reg-updates'].first(device_id) or False
 
     def check_registration_expiration(self, device_id):
         """
@@ -129,20 +184,26 @@ class WebSocketHandler:
         :param device_id: string
         :return: False / dict
         """
-        for item in self.ws.events['registrations-expired']:
-            # If asked device_id is found return its data. Otherwise return False
-            if item['ep'] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its first message. Otherwise return False
+        self.ws.watch(device_id=device_id)
+        return self.ws.events['registrations-expired'].first(device_id) or False
 
     def get_notifications(self):
         """
         Get all notifications from WebSocket data
 
-        :return: dict
+        :return: EventLog of the notifications, iterates like a list
         """
         return self.ws.events['notifications']
 
+    def get_event_stats(self):
+        """
+        Get memory and eviction statistics of the stored WebSocket data
+
+        :return: dict
+        """
+        return self.ws.events.stats()
+
     def get_async_response(self, async_response_id):
         """
         Get async-response from WebSocket data for given async_id
@@ -150,8 +211,35 @@ class WebSocketHandler:
         :param async_response_id: string
         :return: dict
         """
+        self.ws.watch(async_id=async_response_id)
         return self.ws.async_responses.get(async_response_id)
 
+    def expect_async_response(self, async_response_id, timeout=30):
+        """
+        Registers async-id of a device request, call before sending the request
+
+        :param async_response_id: string
+        :param timeout: Seconds until the registration expires
+        :return: concurrent.futures.Future resolved with the async-response, or failing with TimeoutError
+        """
+        self.ws.watch(async_id=async_response_id)
+        return self.ws.events.in_flight.register(async_response_id, timeout)
+
+    def wait_for_async_responses(self, async_response_ids, timeout=30):
+        """
+        Wait for many async-responses at once
+
+        :param async_response_ids: list of strings
+        :param timeout: Seconds to wait
+        :return: dict of async-id: async-response or False if not received
+        """
+        futures = {async_id: self.expect_async_response(async_id, timeout) for async_id in async_response_ids}
+        wait(futures.values(), timeout)
+        for future in futures.values():
+            future.cancel()
+        return {async_id: future.result() if not future.cancelled() and future.exception() is None else False
+                for async_id, future in futures.items()}
+
     def wait_for_multiple_notification(self, device_id, expected_notifications, timeout=30, assert_errors=False):
         """
         Wait for given device id + resource path(s) + expected value(s) to appear in CALLBACK-HANDLER
@@ -162,25 +250,16 @@ class WebSocketHandler:
                                         {'resource_path_2}: {'excepted_value_2},
                                         ...
                                         ]
-        :param timeout: int
+        :param timeout: Seconds to wait
         :param assert_errors: boolean for user if to fail test case in case of expected notifications not received
         :return: False / list of received notifications or fail the test case if confirm_resp=True
         """
-        item_list = []
-        for _ in range(timeout):
-            notifications = self.get_notifications()
-            for item in notifications:
-                if item['ep'] == device_id:
-                    # Check if received notification contains any combinations defined in expected_notifications.
-                    # If found, append item to item_list. If as many items are found as are expected, return list.
-                    if [expect_item for expect_item in expected_notifications if
-                        item['path'] in expect_item.keys() and base64.b64decode(
-                            item['payload']).decode('utf8') in expect_item.values()]:
-                        item_list.append(item)
-                        if len(item_list) == len(expected_notifications):
-                            return item_list
-            sleep(1)
-        log.debug('Expected {}, found only {}!'.format(expected_notifications, item_list))
+        self.ws.watch(device_id=device_id)
+        matcher = NotificationMatcher(self.ws.events['notifications'], device_id, expected_notifications)
+        item_list = self.ws.events.wait('notifications', device_id, matcher.update, timeout)
+        if item_list:
+            return item_list
+        log.debug('Expected {}, found only {}!'.format(expected_notifications, matcher.matched))
         if assert_errors:
             assert False, 'Failed to receive all expected notifications from device on websocket channel by ' \
                           'timeout:{} seconds'.format(timeout)
@@ -193,20 +272,24 @@ class WebSocketHandler:
         :param device_id: string
         :param resource_path: string
         :param expected_value: string
-        :param timeout: int
+        :param timeout: Seconds to wait
         :param assert_errors: boolean for user if to fail test case in case of expected notification not received
-        :param delay: Delay to check notification
+        :param delay: Not used, the wait wakes up when a notification arrives
         :return: dict or fail the test case if confirm_resp=True
         """
-        wait = 0
+        del delay  # kept for compatibility
+        self.ws.watch(device_id=device_id)
         expected_value = str(expected_value)
-        while wait <= timeout:
-            for item in self.ws.events['notifications']:
-                if item['ep'] == device_id and item['path'] == resource_path and \
-                        base64.b64decode(item['payload']).decode('utf8') == expected_value:
+
+        def check():
+            for item in self.ws.events['notifications'].find(device_id, resource_path):
+                if item.text == expected_value:
                     return item
-            sleep(delay)
-            wait += delay
+            return None
+
+        item = self.ws.events.wait('notifications', device_id, check, timeout, path=resource_path)
+        if item:
+            return item
         if assert_errors:
             assert False, 'Failed to receive notification from device on websocket channel by timeout: {}'.format(
                 timeout)
@@ -218,18 +301,18 @@ class WebSocketHandler:
 
         :param device_id: string
         :param resource_path: string
-        :param timeout: int
+        :param timeout: Seconds to wait
         :param assert_errors: boolean for user if to fail test case in case of expected notification not received
-        :param delay: Delay to check notification
+        :param delay: Not used, the wait wakes up when a notification arrives
         :return: dict or fail the test case if confirm_resp=True
         """
-        wait = 0
-        while wait <= timeout:
-            for item in self.ws.events['notifications']:
-                if item['ep'] == device_id and item['path'] == resource_path:
-                    return item
-            sleep(delay)
-            wait += delay
+        del delay  # kept for compatibility
+        self.ws.watch(device_id=device_id)
+        notifications = self.ws.events['notifications']
+        item = self.ws.events.wait('notifications', device_id, lambda: notifications.first(device_id, resource_path),
+                                   timeout, path=resource_path)
+        if item:
+            return item
         if assert_errors:
             assert False, 'Failed to receive notification from device on websocket channel by timeout: {}'.format(
                 timeout)
@@ -240,15 +323,15 @@ class WebSocketHandler:
         Wait for given async-response to appear in WebSocket data
 
         :param async_response_id: string
-        :param timeout: int
+        :param timeout: Seconds to wait
         :param assert_errors: boolean for user if to fail test case in case of expected response not received
         :return: dict or fail the test case if confirm_resp=True
         """
-        for _ in range(timeout):
-            async_response = self.ws.async_responses.get(async_response_id)
-            if async_response:
-                return async_response
-            sleep(1)
+        self.ws.watch(async_id=async_response_id)
+        async_response = self.ws.events.waiters.wait((ASYNC_RESPONSES, async_response_id),
+                                                     lambda: self.ws.async_responses.get(async_response_id), timeout)
+        if async_response:
+            return async_response
         if assert_errors:
             assert False, 'Failed to receive async response from device with async_id:{} on websocket channel by ' \
                           'timeout:{} seconds'.format(async_response_id, timeout)
@@ -259,90 +342,192 @@ class WebSocketHandler:
         Wait for given device id registration to appear in WebSocket
 
         :param device_id: string
-        :param timeout: int
+        :param timeout: Seconds to wait
         :return: False / dict
         """
-        for _ in range(timeout):
-            registration = self.check_registration(device_id)
-            if registration:
-                return registration
-            sleep(1)
-        return False
+        return self.ws.events.wait('registrations', device_id, lambda: self.check_registration(device_id), timeout)
 
     def wait_for_registration_updates(self, device_id, timeout=30):
         """
         Wait for given device id registration update notification to appear in WebSocket
 
         :param device_id: string
-        :param timeout: int
+        :param timeout: Seconds to wait
         :return: False / dict
         """
-        for _ in range(timeout):
-            registration = self.check_registration_updates(device_id)
-            if registration:
-                return registration
-            sleep(1)
-        return False
+        return self.ws.events.wait('reg-updates', device_id, lambda: self.check_registration_updates(device_id), timeout)
 
     def wait_for_registration_expiration(self, device_id, timeout=30):
         """
         Wait for given device id registration expiration notification to appear in WebSocket
 
         :param device_id: string
-        :param timeout: int
+        :param timeout: Seconds to wait
         :return: False / dict
         """
-        for _ in range(timeout):
-            registration = self.check_registration_expiration(device_id)
-            if registration:
-                return registration
-            sleep(1)
-        return False
+        return self.ws.events.wait('registrations-expired', device_id,
+                                   lambda: self.check_registration_expiration(device_id), timeout)
 
     def wait_for_deregistration(self, device_id, timeout=30):
         """
         Wait for given device id de-registration to appear in WebSocket
 
         :param device_id: string
-        :param timeout: int
+        :param timeout: Seconds to wait
         :return: False / dict
         """
-        for _ in range(timeout):
-            deregistration = self.check_deregistration(device_id)
-            if deregistration:
-                return deregistration
-            sleep(1)
-        return False
+        return self.ws.events.wait('de-registrations', device_id, lambda: self.check_deregistration(device_id), timeout)
 
 
-class WebSocketRunner:
+class NotificationMatcher:
+    """
+    Incremental matcher of expected notifications. Keeps a read cursor to the endpoint's notifications, so every
+    notification is checked once, and looks its (path, value) up from a hash of the expectations.
+    A notification satisfies one expectation, which is given as {resource path: expected value} dict.
+    :param notifications: EventLog of the notifications
+    :param device_id: Endpoint name
+    :param expected_notifications: List of {resource path: expected value} dicts
+    """
+
+    def __init__(self, notifications, device_id, expected_notifications):
+        self.notifications = notifications
+        self.device_id = device_id
+        self.matched = []
+        self.cursor = 0
+        self._expected = {}
+        for index, expect_item in enumerate(expected_notifications):
+            for path, value in expect_item.items():
+                self._expected.setdefault((path, str(value)), []).append(index)
+        self._remaining = len(expected_notifications)
+        self._satisfied = set()
+
+    @property
+    def done(self):
+        return self._remaining == 0
+
+    def update(self):
+        """
+        Checks the notifications arrived after the previous update
+        :return: List of matched notifications when all expectations are met, otherwise None
+        """
+        items, self.cursor = self.notifications.read(self.device_id, self.cursor)
+        for item in items:
+            if self.done:
+                break
+            indexes = self._expected.get((item['path'], item.text))
+            if not indexes:
+                continue
+            for index in indexes:
+                if index not in self._satisfied:
+                    self._satisfied.add(index)
+                    self._remaining -= 1
+                    self.matched.append(item)
+                    break
+        return self.matched if self.done else None
+
+
+class NotificationRunner:
+    """
+    Base class of the notification channel runners, stores the received messages to the event store
+    :param api: string URL for WebSocket connection endpoint
+    :param api_key: string
+    :param cassette: RestAPI cassette - async-responses are recorded to it or, in replay mode, received from it
+                     instead of the WebSocket connection
+    :param retention: RetentionPolicy of the stored events, defaults to RetentionPolicy.from_env()
+    """
+
+    def __init__(self, api, api_key, cassette=None, retention=None):
+        self.events = EventStore(retention)
+        self.async_responses = self.events.async_responses
+        self._api_url = api
+        self._api_key = api_key
+        self._cassette = cassette
+
+    @property
+    def api_key(self):
+        """
+        Make able to use exactly right apikey in other places
+        :return: api key
+        """
+        return self._api_key
+
+    def watch(self, device_id=None, async_id=None):
+        """
+        Runner stores all events of its channel, device ids and async-ids are watched only by NotificationView
+        :param device_id: Device id
+        :param async_id: Async-id
+        """
+
+    def _handle_message(self, data):
+        """
+        Handle received message
+        :param data: Message dict, {notification type: content list}
+        """
+        if data == {}:
+            log.info('Received callback is empty')
+        for notification_type, notification_value in data.items():
+            log.debug('Callback contains %s', notification_type)
+            self._handle_content(notification_type, notification_value)
+
+    def _handle_content(self, notification_type, data):
+        """
+        Handle received content
+        :param notification_type: Notification type
+        :param data: Content data
+        """
+        for content in data:
+            # De-registrations is plain list of endpoint names
+            if notification_type in ('de-registrations', 'registrations-expired'):
+                content = {'ep': content}
+            record = Record(content)
+            # Async-responses are saved by response, others are pushed to list
+            if notification_type == ASYNC_RESPONSES:
+                if self._cassette is not None and self._cassette.recording:
+                    self._cassette.record_async_response(record.to_dict())
+                self.async_responses[record['id']] = record
+                self.events.in_flight.resolve(record['id'], record)
+                self.events.waiters.notify((ASYNC_RESPONSES, record['id']))
+            else:
+                self.events.add(notification_type, record)
+
+
+class WebSocketRunner(NotificationRunner):
     """
     Class for handling WebSocket connection and storing data from notification service
     :param api: string URL for WebSocket connection endpoint
     :param api_key: string
+    :param cassette: RestAPI cassette - async-responses are recorded to it or, in replay mode, received from it
+                     instead of the WebSocket connection
+    :param retention: RetentionPolicy of the stored events, defaults to RetentionPolicy.from_env()
     """
 
-    def __init__(self, api, api_key):
-        self.async_responses = {}
-        self.events = {'registrations': [], 'notifications': [], 'reg-updates': [], 'de-registrations': [],
-                       'registrations-expired': []}
+    def __init__(self, api, api_key, cassette=None, retention=None):
+        super().__init__(api, api_key, cassette, retention)
         self.run = False
         self.exit = False
         self.ws = None
         self.message_queue = queue.Queue()
         self.ret_code = []
-        self._api_url = api
-        self._api_key = api_key
+        self.connected = threading.Event()
+        self.disconnected = threading.Event()
 
         self.open()
 
-    @property
-    def api_key(self):
+    def wait_connected(self, timeout=30):
         """
-        Make able to use exactly right apikey in other places
-        :return: api key
+        Waits until the WebSocket is opened
+        :param timeout: Seconds to wait
+        :return: True / False
         """
-        return self._api_key
+        return self.connected.wait(timeout)
+
+    def wait_disconnected(self, timeout=30):
+        """
+        Waits until the WebSocket is closed
+        :param timeout: Seconds to wait
+        :return: True / False
+        """
+        return self.disconnected.wait(timeout)
 
     def _input_thread(self, api, api_key):
         """
@@ -352,7 +537,8 @@ class WebSocketRunner:
         """
         while self.run:
             try:
-                self.ws = CallbackClient(self.message_queue, api, protocols=['wss', 'pelion_{}'.format(api_key)])
+                self.ws = CallbackClient(self.message_queue, api, protocols=['wss', 'pelion_{}'.format(api_key)],
+                                         connected=self.connected, disconnected=self.disconnected)
                 log.debug('Connecting WebSocket')
                 self.ws.connect()
                 log.debug('Run forever WebSocket handler')
@@ -380,12 +566,7 @@ class WebSocketRunner:
         Runner's handle thread
         """
         while self.run:
-            data = self.message_queue.get()
-            if data == {}:
-                log.info('Received callback is empty')
-            for notification_type, notification_value in data.items():
-                log.debug('Callback contains %s', notification_type)
-                self._handle_content(notification_type, notification_value)
+            self._handle_message(self.message_queue.get())
 
     def open(self):
         """
@@ -398,13 +579,18 @@ class WebSocketRunner:
         log.info('Starting WebSocket threads')
         self.exit = False
         self.run = True
+        _ht = threading.Thread(target=self._handle_thread, name='messages_{}'.format(build_random_string(3)))
+        _ht.daemon = True
+        _ht.start()
+        if self._cassette is not None and self._cassette.replaying:
+            log.info('Replaying WebSocket async-responses from cassette {}'.format(self._cassette.path))
+            self._cassette.add_listener(self.message_queue)
+            self.connected.set()
+            return
         _it = threading.Thread(target=self._input_thread, args=(self._api_url, self._api_key),
                                name='websocket_{}'.format(build_random_string(3)))
-        _ht = threading.Thread(target=self._handle_thread, name='messages_{}'.format(build_random_string(3)))
         _it.daemon = True
-        _ht.daemon = True
         _it.start()
-        _ht.start()
 
     def close(self):
         """
@@ -413,47 +599,39 @@ class WebSocketRunner:
         log.info('Closing WebSocket threads')
         self.exit = True
         self.run = False
+        if not self.connected.is_set():
+            self.disconnected.set()
+        log.info('WebSocket event store stats: {}'.format(self.events.stats()['total']))
+        self.events.close()
+        if self._cassette is not None and self._cassette.replaying:
+            self._cassette.remove_listener(self.message_queue)
+            return
         try:
             self.ws.close()
         except (WebSocketException, RuntimeError) as e:
             log.warning('WebSocket close failed! {}'.format(e))
 
-    def _handle_content(self, notification_type, data):
-        """
-        Handle received content
-        :param notification_type: Notification type
-        :param data: Content data
-        """
-        for content in data:
-            date_now = datetime.datetime.utcnow().isoformat('T') + 'Z'
-            # De-registrations is plain list, need to convert it to dict. Otherwise just add timestamp
-            if notification_type in ('de-registrations', 'registrations-expired'):
-                content = {'dt': date_now, 'ep': content}
-            else:
-                content['dt'] = date_now
-            # Async-responses are saved by response, others are pushed to list
-            if notification_type == 'async-responses':
-                self.async_responses[content['id']] = content
-            else:
-                self.events[notification_type].append(content)
-
 
 class CallbackClient(WebSocketClient):
     """
     WebSocket callback client class
     """
 
-    def __init__(self, message_queue, api, protocols):
+    def __init__(self, message_queue, api, protocols, connected=None, disconnected=None):
         super().__init__(api, protocols=protocols)
         self.message_queue = message_queue
         self.api = api
         self.ret_code = []
+        self.connected = connected or threading.Event()
+        self.disconnected = disconnected or threading.Event()
 
     def opened(self):
         """
         WebSocket opened logging
         """
         log.info('WebSocket opened to {}'.format(self.api))
+        self.disconnected.clear()
+        self.connected.set()
 
     def closed(self, code, reason=None):
         """
@@ -461,6 +639,8 @@ class CallbackClient(WebSocketClient):
         """
         self.ret_code.append(code)
         log.info('WebSocket closed with code {} reason {}'.format(code, reason))
+        self.connected.clear()
+        self.disconnected.set()
 
     def received_message(self, message):
         """
@@ -28,7 +28,9 @@ import pytest
 import izuma_systest_lib.tools as utils
 
 from izuma_systest_lib.cloud.cloud import IzumaCloud
-from izuma_systest_lib.cloud.libraries.rest_api.rest_api import RestAPI
+from izuma_systest_lib.cloud.libraries.rest_api.cassette import close_cassettes
+from izuma_systest_lib.cloud.libraries.rest_api.metrics import metrics_registry
+from izuma_systest_lib.cloud.libraries.rest_api.rest_api import RestAPI, close_shared_sessions
 
 log = logging.getLogger(__name__)
 
@@ -51,6 +53,43 @@ def tc_config_data(request):
     raise AssertionError('Test configuration is not defined. Use --config_path=<path to define config file>')
 
 
+@pytest.fixture(scope='session', autouse=True)
+def rest_shared_sessions():
+    """
+    Closes the shared rest connection pool at the end of the test session.
+    Pool is shared between all fixtures when 'rest_shared_session' is set in config or REST_SHARED_SESSION=true
+    """
+    yield
+    log.debug('Closing shared REST sessions')
+    close_shared_sessions()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def rest_cassettes():
+    """
+    Closes the REST traffic cassettes at the end of the test session.
+    Cassette is used when 'rest_cassette' is set in config or with REST_CASSETTE env variable
+    """
+    yield
+    close_cassettes()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def rest_metrics(request):
+    """
+    Writes the REST request metrics of the test session to <path>.json and <path>.prom files when the path prefix
+    is given with '--rest_metrics_path' argument or REST_METRICS_PATH env variable. Relative path is taken from
+    the pytest rootdir.
+    :param request: Request object
+    :return: Metrics registry
+    """
+    path = request.config.getoption('rest_metrics_path', default=None) or os.environ.get('REST_METRICS_PATH')
+    yield metrics_registry
+    if path and len(metrics_registry) > 0:
+        files = metrics_registry.write(os.path.join(str(request.config.rootpath), path))
+        log.info('REST request metrics written to {}'.format(', '.join(files)))
+
+
 @pytest.fixture(scope='session')
 def cloud_api(request):
     """
@@ -90,6 +129,8 @@ def cloud_api(request):
 
     yield cloud
 
+    cloud.close()
+
 
 @pytest.fixture(scope='function')
 def rest_api():
@@ -102,4 +143,6 @@ def rest_api():
               'api_key': os.environ.get('REST_API_TOKEN'),
               'rest_user_agent': os.environ.get('REST_API_USER_AGENT', 'SystemTesting')}
 
-    return RestAPI(config)
+    api = RestAPI(config)
+    yield api
+    api.close()
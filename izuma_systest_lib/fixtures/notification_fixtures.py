@@ -24,13 +24,48 @@ Notification service related pytest fixtures
 
 import logging
 import pytest
+import izuma_systest_lib.cloud.iam as iam_helpers
+from izuma_systest_lib.cloud.notification_hub import NotificationHub, use_shared_channel
 from izuma_systest_lib.cloud.websocket_handler import WebsSocketNotificationChannel
 
 log = logging.getLogger(__name__)
 
 
+@pytest.fixture(scope='session')
+def notification_hub(cloud_api):
+    """
+    Session level WebSocket notification channel, tests use it through views
+    """
+    log.info('Creating new developer api key for notification hub')
+    resp = iam_helpers.create_api_key(cloud_api, 'Developers').json()
+    hub = NotificationHub(cloud_api, resp['key'])
+    yield hub
+    hub.close()
+    log.info('Cleaning out the notification hub developer api key, id: {}'.format(resp['id']))
+    cloud_api.iam.delete_api_key(resp['id'], expected_status_code=204)
+
+
 @pytest.fixture(scope='function')
-def websocket(cloud_api, new_temp_test_case_developer_api_key, request):
+def websocket_view(notification_hub, request):
+    """
+    View of the session's notification channel, sees only the events arriving during the test, of the device ids
+    and async-ids the test checks or waits for. More visible device ids can be given via fixture request parameter.
+
+    @pytest.mark.parametrize('websocket_view', [[device_id]], indirect=True)
+    def test_registration(websocket_view, ...):
+        ...
+    """
+    try:
+        devices = request.param
+    except AttributeError:
+        devices = ()
+    ws = notification_hub.view(devices=devices, async_ids=())
+    yield ws
+    notification_hub.close_view(ws)
+
+
+@pytest.fixture(scope='function')
+def websocket(cloud_api, tc_config_data, request):
     """
     WebSocket channel fixture. Configuration object for notification service can be delivered via fixture request
     parameter. https://www.pelion.com/docs/device-management/current/service-api-references/notifications-api.html#registerWebhook
@@ -46,14 +81,27 @@ def websocket(cloud_api, new_temp_test_case_developer_api_key, request):
     @pytest.mark.parametrize('websocket', [CONFIG], indirect=True)
     def test_01_websocket_v2(websocket, linux_fcu_client, cloud_api, new_temp_test_case_developer_api_key):
         ...
+
+    Without configuration the test gets a view of the session's channel when 'websocket_shared_channel' is set in
+    config or WEBSOCKET_SHARED_CHANNEL=true. The view sees the events arriving during the test, of the device ids
+    and async-ids the test checks or waits for through it, so get_notifications() is empty until the test has
+    asked for a device. websocket.api_key is then the hub's key, use it for pre-subscriptions.
     """
-    log.info('Register and open WebSocket notification channel')
     try:
         configuration = request.param
     except AttributeError:
         configuration = None
 
-    ws = WebsSocketNotificationChannel(cloud_api, new_temp_test_case_developer_api_key, configuration)
+    if configuration is None and use_shared_channel(tc_config_data):
+        hub = request.getfixturevalue('notification_hub')
+        view = hub.view(devices=(), async_ids=())
+        yield view
+        hub.close_view(view)
+        return
+
+    log.info('Register and open WebSocket notification channel')
+    api_key = request.getfixturevalue('new_temp_test_case_developer_api_key')
+    ws = WebsSocketNotificationChannel(cloud_api, api_key, configuration)
     yield ws.handler
     ws.close()
 
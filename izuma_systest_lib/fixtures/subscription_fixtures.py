@@ -22,17 +22,43 @@ Subscriptions related pytest fixtures
 """
 
 import logging
+import threading
+
 import pytest
 
 
 log = logging.getLogger(__name__)
 
+_pre_subscriptions_lock = threading.Lock()
+
+
+def _update_pre_subscriptions(cloud_api, api_key, update):
+    """
+    Reads, updates and writes back the pre-subscriptions of the api key, so the tests sharing the key keep theirs
+    :param cloud_api: Cloud API object
+    :param api_key: Api key of the notification channel
+    :param update: Function taking and returning the list of pre-subscriptions
+    """
+    with _pre_subscriptions_lock:
+        current = cloud_api.connect.get_pre_subscriptions(api_key=api_key, expected_status_code=200).json()
+        data = update(current)
+        if data:
+            cloud_api.connect.set_pre_subscriptions(subscription_data=data, api_key=api_key, expected_status_code=204)
+        else:
+            cloud_api.connect.remove_pre_subscriptions(api_key=api_key, expected_status_code=204)
+
 
 @pytest.fixture(scope='function')
-def subscribe_to_resource(cloud_api, new_temp_test_case_developer_api_key):
+def subscribe_to_resource(cloud_api, new_temp_test_case_developer_api_key, request):
     """
-    Subscribe to resource fixture
+    Subscribe to resource fixture. Pre-subscriptions are set on the test case's developer api key, or on the api key
+    of the websocket channel when the test requests the websocket fixture, which is the hub's key when the test
+    uses a view of the shared channel. Only the pre-subscriptions added by the test are removed at teardown.
     """
+    if 'websocket' in request.fixturenames:
+        api_key = request.getfixturevalue('websocket').api_key
+    else:
+        api_key = new_temp_test_case_developer_api_key
     subscriptions = []
 
     def subscribe(resource_path):
@@ -41,12 +67,18 @@ def subscribe_to_resource(cloud_api, new_temp_test_case_developer_api_key):
         :param resource_path: Path to resource to subscribe
         """
         # Add subscription
-        data = [{'resource-path': [resource_path]}]
-        cloud_api.connect.set_pre_subscriptions(subscription_data=data, api_key=new_temp_test_case_developer_api_key,
-                                                expected_status_code=204)
+        _update_pre_subscriptions(cloud_api, api_key,
+                                  lambda current: current + [{'resource-path': [resource_path]}])
         subscriptions.append(resource_path)
 
     yield subscribe
 
+    def remove(current):
+        for resource_path in subscriptions:
+            if {'resource-path': [resource_path]} in current:
+                current.remove({'resource-path': [resource_path]})
+        return current
+
     # Remove subscriptions
-    cloud_api.connect.remove_pre_subscriptions(api_key=new_temp_test_case_developer_api_key, expected_status_code=204)
+    if subscriptions:
+        _update_pre_subscriptions(cloud_api, api_key, remove)
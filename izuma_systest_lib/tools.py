@@ -24,6 +24,7 @@ General utility functions for library and test cases
 import functools
 
 import inspect
+import itertools
 import json
 import logging
 import os
@@ -57,6 +58,18 @@ def load_config(config_path):
     return config_data
 
 
+def config_flag(config, key, default=False):
+    """
+    Reads a true/false setting, string values like "false" in config files are parsed the same way as the
+    env variables
+    :param config: Config data
+    :param key: Setting name
+    :param default: Value if the setting is missing
+    :return: True/False
+    """
+    return str(config.get(key, default)).lower() == 'true'
+
+
 def build_random_string(str_length, use_digits=False, use_punctuations=False):
     """
     Create random string
@@ -73,6 +86,78 @@ def build_random_string(str_length, use_digits=False, use_punctuations=False):
     return ''.join(random.choice(letters) for _ in range(str_length))
 
 
+def _base36(number):
+    digits = string.digits + string.ascii_lowercase
+    encoded = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        encoded = digits[remainder] + encoded
+        if number == 0:
+            return encoded
+
+
+class AsyncIdAllocator:
+    """
+    Allocates unique async-ids for device requests: '<prefix>-<counter>-<send time>'. Prefix is random per
+    allocator with the process id, counter and send time in milliseconds are base36, e.g. 'x7kq2m1kp-4c-lq0k1p3a'.
+    Ids don't collide within the prefix and the send time gives the round-trip latency when the response arrives.
+    :param prefix: Id prefix without '-', random by default
+    """
+
+    def __init__(self, prefix=None):
+        if prefix is None:
+            prefix = '{}{}'.format(build_random_string(6, use_digits=True).lower(), _base36(os.getpid()))
+        assert '-' not in prefix, 'Async-id prefix can not contain "-"'
+        self.prefix = prefix
+        self._counter = itertools.count()
+
+    def allocate(self):
+        """
+        :return: New async-id
+        """
+        return '{}-{}-{}'.format(self.prefix, _base36(next(self._counter)), _base36(time.time_ns() // 1000000))
+
+    def allocate_many(self, count):
+        """
+        :param count: Count of ids
+        :return: List of new async-ids sharing the send time
+        """
+        sent = _base36(time.time_ns() // 1000000)
+        return ['{}-{}-{}'.format(self.prefix, _base36(next(self._counter)), sent) for _ in range(count)]
+
+    def owns(self, async_id):
+        """
+        :param async_id: Async-id
+        :return: True if the id is allocated by this allocator
+        """
+        return isinstance(async_id, str) and async_id.startswith(self.prefix + '-')
+
+    def sent_at(self, async_id):
+        """
+        :param async_id: Async-id
+        :return: Epoch time in seconds when the id was allocated, None for ids of other allocators
+        """
+        if not self.owns(async_id):
+            return None
+        parts = async_id.split('-')
+        if len(parts) != 3:
+            return None
+        try:
+            return int(parts[2], 36) / 1000
+        except ValueError:
+            return None
+
+
+async_id_allocator = AsyncIdAllocator()
+
+
+def next_async_id():
+    """
+    :return: Unique async-id from the process wide allocator
+    """
+    return async_id_allocator.allocate()
+
+
 def assert_status(response, func, expected_resp, api_url=''):
     """
     Function for asserting response and creating proper msg on fail situation
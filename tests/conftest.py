@@ -42,3 +42,5 @@ def pytest_addoption(parser):
     """
     parser.addoption('--config_path', action='store', help='Test case config json')
     parser.addoption('--show_api_key', action='store', help='true/false to show api keys on logs')
+    parser.addoption('--rest_metrics_path', action='store',
+                     help='Path prefix of the REST request metrics files written at the end of the session')
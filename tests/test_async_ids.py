@@ -0,0 +1,69 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the async-id allocation and the async-response store
+# offline.
+# ----------------------------------------------------------------------------
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from izuma_systest_lib.cloud.event_store import ResponseStore
+from izuma_systest_lib.tools import AsyncIdAllocator
+
+log = logging.getLogger(__name__)
+
+
+def test_async_ids_unique_between_threads():
+    allocator = AsyncIdAllocator()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        batches = list(executor.map(lambda _: [allocator.allocate() for _ in range(1000)], range(8)))
+    async_ids = [async_id for batch in batches for async_id in batch]
+    assert len(set(async_ids)) == 8000
+    assert all(allocator.owns(async_id) for async_id in async_ids)
+    assert len(set(allocator.allocate_many(100) + async_ids)) == 8100
+
+
+def test_async_id_send_time():
+    allocator = AsyncIdAllocator(prefix='test')
+    async_id = allocator.allocate()
+    assert async_id.startswith('test-0-')
+    assert allocator.sent_at(async_id) == pytest.approx(time.time(), abs=1)
+    assert allocator.sent_at('other-0-lq0k1p3a') is None
+    assert allocator.sent_at('test-broken') is None
+    assert not AsyncIdAllocator(prefix='other').owns(async_id)
+    with pytest.raises(AssertionError):
+        AsyncIdAllocator(prefix='with-dash')
+
+
+def test_response_store_duplicates_and_latency():
+    allocator = AsyncIdAllocator(prefix='test')
+    responses = ResponseStore(max_items=2, allocator=allocator)
+    async_ids = [allocator.allocate() for _ in range(3)]
+    for async_id in async_ids:
+        responses[async_id] = {'id': async_id, 'status': 200}
+    responses[async_ids[2]] = {'id': async_ids[2], 'status': 200}
+    stats = responses.stats()
+    assert list(responses) == async_ids[1:]
+    assert stats['evicted'] == 1
+    assert stats['duplicates'] == 1
+    assert stats['latency']['count'] == 3
@@ -0,0 +1,48 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests that one cloud API object can be shared by many
+# worker threads. Requests with valid and invalid api keys are mixed, so any
+# request using headers of another thread would get a wrong status code.
+# ----------------------------------------------------------------------------
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+WORKERS = 16
+REQUESTS = 200
+
+
+def test_cloud_api_shared_between_threads(edge, cloud_api):
+    def get_device(index):
+        # Every other request uses invalid api key
+        if index % 2:
+            r = cloud_api.device_directory.get_device(edge.device_id, api_key='ak_invalid')
+            return index, r.status_code, 401
+        r = cloud_api.device_directory.get_device(edge.device_id)
+        return index, r.status_code, 200
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        results = list(executor.map(get_device, range(REQUESTS)))
+
+    failed = [(index, status) for index, status, expected in results if status != expected]
+    log.info('{} requests from {} threads, {} with unexpected status code'.format(REQUESTS, WORKERS, len(failed)))
+    assert not failed, 'Requests with unexpected status code (index, status): {}'.format(failed)
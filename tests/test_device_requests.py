@@ -0,0 +1,156 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the bulk device requests offline. Fake devices answer
+# through a fake notification channel.
+# ----------------------------------------------------------------------------
+
+import base64
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import requests
+
+from izuma_systest_lib.cloud.device_requests import DEVICE_ERROR, ERROR, OK, REJECTED, TIMEOUT, BulkDeviceRequests
+from izuma_systest_lib.cloud.event_store import InFlightRequests, Record, ResponseStore
+from izuma_systest_lib.tools import async_id_allocator
+
+log = logging.getLogger(__name__)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.api_key = 'ak_test'
+        self.in_flight = InFlightRequests(ResponseStore())
+
+    def expect_async_response(self, async_id, timeout=30):
+        return self.in_flight.register(async_id, timeout)
+
+
+class FakeDevices:
+    """
+    Answers requests after the delay, 'slow' devices after 2 s. Sending to 'busy' devices takes 50 ms. Device
+    'rejected' isn't accepted by the cloud, 'offline' never answers, 'unreachable' fails to send and 'missing'
+    responds with 404
+    """
+
+    def __init__(self, channel, delay=0.01):
+        self.channel = channel
+        self.delay = delay
+        self.sent = 0
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def send_async_request_to_device(self, device_id, request_data, async_id=None, **_):
+        if device_id == 'unreachable':
+            raise requests.exceptions.ConnectionError('Connection refused')
+        if device_id == 'rejected':
+            return SimpleNamespace(status_code=410, text='Device gone')
+        if device_id.startswith('busy'):
+            time.sleep(0.05)
+        with self._lock:
+            self.sent += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        timer = threading.Timer(2 if device_id.startswith('slow') else self.delay, self._respond,
+                                (device_id, request_data, async_id))
+        timer.daemon = True
+        timer.start()
+        return SimpleNamespace(status_code=202, text='')
+
+    def _respond(self, device_id, request_data, async_id):
+        with self._lock:
+            self.in_flight -= 1
+        if device_id == 'offline':
+            return
+        status = 404 if device_id == 'missing' else 200
+        payload = base64.b64encode('{} {}'.format(device_id, request_data['uri']).encode()).decode()
+        self.channel.in_flight.resolve(async_id, Record({'id': async_id, 'status': status, 'payload': payload,
+                                                         'ct': 'text/plain'}))
+
+
+def _bulk(timeout=1, delay=0.01, max_concurrency=8):
+    channel = FakeChannel()
+    devices = FakeDevices(channel, delay)
+    bulk = BulkDeviceRequests(SimpleNamespace(connect=devices), channel, max_concurrency=max_concurrency,
+                              timeout=timeout)
+    return bulk, devices, channel
+
+
+def test_bulk_device_request_states():
+    bulk, _, channel = _bulk(timeout=0.5)
+    device_ids = ['dev1', 'missing', 'rejected', 'unreachable', 'offline', 'dev2']
+    result = bulk.run([(device_id, 'GET', '/3/0/13') for device_id in device_ids])
+    log.info(result.summary())
+    assert [r.device_id for r in result] == device_ids
+    assert [r.state for r in result] == [OK, DEVICE_ERROR, REJECTED, ERROR, TIMEOUT, OK]
+    assert result.results[0].payload == 'dev1 /3/0/13'
+    assert result.results[2].status_code == 410
+    assert result.counts() == {OK: 2, DEVICE_ERROR: 1, REJECTED: 1, ERROR: 1, TIMEOUT: 1}
+    assert result.payloads() == {'dev1': 'dev1 /3/0/13', 'dev2': 'dev2 /3/0/13'}
+    assert not result.ok
+    assert len(channel.in_flight) == 0
+
+
+def test_bulk_device_requests_window():
+    bulk, devices, _ = _bulk(delay=0.02, max_concurrency=16)
+    taken = []
+
+    def device_requests():
+        for index in range(100):
+            taken.append(index)
+            yield 'dev{}'.format(index), 'GET', '/3/0/3'
+
+    results = bulk.iterate(device_requests(), window=10)
+    first = next(results)
+    assert first.ok
+    # The source is read only as far as the window allows
+    assert len(taken) <= 11
+    results = [first] + list(results)
+    assert len(results) == 100
+    assert all(result.ok for result in results)
+    assert devices.peak <= 10
+
+
+def test_bulk_device_requests_closed_early():
+    bulk, devices, channel = _bulk()
+    device_ids = ['dev0'] + ['slow{}'.format(index) for index in range(49)]
+    results = bulk.iterate(((device_id, 'GET', '/3/0/3') for device_id in device_ids), window=5)
+    for result in results:
+        assert result.device_id == 'dev0'
+        break
+    results.close()
+    # The slow requests are unregistered, and no more requests are sent
+    assert len(channel.in_flight) == 0
+    sent = devices.sent
+    assert sent <= 6
+    time.sleep(0.1)
+    assert devices.sent == sent
+
+
+def test_bulk_device_requests_async_id_allocated_at_send():
+    bulk, _, _ = _bulk(max_concurrency=1)
+    result = bulk.run([('busy{}'.format(index), 'GET', '/3/0/3') for index in range(5)])
+    assert result.ok
+    # Latency measured from the async-id doesn't include the time queued behind the other requests
+    for request in result:
+        assert abs(async_id_allocator.sent_at(request.async_id) - request.sent) < 0.03
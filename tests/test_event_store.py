@@ -0,0 +1,140 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the WebSocket event store retention and the in-flight
+# device requests offline, no cloud or device is needed.
+# ----------------------------------------------------------------------------
+
+import logging
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import pytest
+
+from izuma_systest_lib.cloud.event_store import COMPACT_THRESHOLD, EventLog, InFlightRequests, ResponseStore, \
+    RetentionPolicy
+
+log = logging.getLogger(__name__)
+
+
+def _notification(endpoint, value, path='/3/0/13'):
+    return {'ep': endpoint, 'path': path, 'payload': value}
+
+
+def test_event_log_max_events():
+    events = EventLog('notifications', retention=RetentionPolicy(max_events=100))
+    for i in range(10000):
+        events.append(_notification('ep{}'.format(i % 7), i))
+    stats = events.stats()
+    assert len(events) == 100
+    assert stats['evicted'] == 9900
+    assert stats['slots'] <= 2 * (COMPACT_THRESHOLD + 100)
+    assert [event['payload'] for event in events] == list(range(9900, 10000))
+
+
+def test_event_log_evicting_from_middle_stays_bounded():
+    # The one 'A' event is never the oldest evicted by max_per_endpoint, the 'B' events are evicted behind it
+    events = EventLog('notifications', retention=RetentionPolicy(max_events=1000, max_per_endpoint=10))
+    events.append(_notification('A', 0))
+    for i in range(200000):
+        events.append(_notification('B', i + 1))
+    stats = events.stats()
+    log.info('Event log stats {}'.format(stats))
+    assert len(events) == 11
+    assert stats['slots'] <= 2 * (COMPACT_THRESHOLD + 11)
+    assert events.first('A')['payload'] == 0
+    assert [event['payload'] for event in events.find('B')] == list(range(199991, 200001))
+    assert events.next_seq == 200001
+
+
+def test_event_log_cursor_after_compaction():
+    events = EventLog('notifications', retention=RetentionPolicy(max_per_endpoint=5))
+    events.append(_notification('A', 'a'))
+    cursor = events.next_seq
+    for i in range(5000):
+        events.append(_notification('B', i))
+    found, cursor = events.read('B', cursor)
+    assert [event['payload'] for event in found] == list(range(4995, 5000))
+    assert cursor == 5001
+    events.append(_notification('B', 5000))
+    found, cursor = events.read('B', cursor)
+    assert [event['payload'] for event in found] == [5000]
+    assert [event['payload'] for event in events.after(5000)[0]] == [4999, 5000]
+    assert events.last('A', '/3/0/13')['payload'] == 'a'
+    assert events[0]['payload'] == 'a'
+    assert events[-1]['payload'] == 5000
+
+
+def test_event_log_indexing_with_empty_slots():
+    events = EventLog('notifications', retention=RetentionPolicy(max_per_endpoint=2))
+    for i, endpoint in enumerate('BAAAB'):
+        events.append(_notification(endpoint, i))
+    # Evicted event of A leaves an empty slot between the stored ones
+    assert events.stats()['slots'] == 5
+    payloads = [event['payload'] for event in events]
+    assert payloads == [0, 2, 3, 4]
+    assert [events[i]['payload'] for i in range(-4, 4)] == payloads + payloads
+    assert [event['payload'] for event in events[1:3]] == [2, 3]
+    with pytest.raises(IndexError):
+        events[4]  # pylint: disable=pointless-statement
+    with pytest.raises(IndexError):
+        events[-5]  # pylint: disable=pointless-statement
+
+    iterator = iter(events)
+    assert next(iterator)['payload'] == 0
+    events.append(_notification('A', 5))
+    # Event 2 was evicted meanwhile, 5 was appended after the iteration started
+    assert [event['payload'] for event in iterator] == [3, 4]
+
+
+def test_event_log_max_age():
+    events = EventLog('notifications', retention=RetentionPolicy(max_age=0))
+    for i in range(3000):
+        events.append(_notification('A', i))
+    stats = events.stats()
+    assert len(events) <= 1
+    assert stats['slots'] <= 2 * COMPACT_THRESHOLD + 2
+
+
+def test_in_flight_requests_resolve_and_expire():
+    responses = ResponseStore()
+    in_flight = InFlightRequests(responses)
+    answered = in_flight.register('answered', timeout=30)
+    abandoned = in_flight.register('abandoned', timeout=0.05)
+    responses['early'] = {'id': 'early', 'status': 200}
+    early = in_flight.register('early', timeout=30)
+    assert early.result(timeout=0) == {'id': 'early', 'status': 200}
+
+    time.sleep(0.1)
+    # Resolving any response expires the abandoned entries
+    assert in_flight.resolve('answered', {'id': 'answered', 'status': 200})
+    assert answered.result(timeout=0)['status'] == 200
+    with pytest.raises(FutureTimeoutError):
+        abandoned.result(timeout=0)
+    assert len(in_flight) == 0
+    assert in_flight.stats() == {'in_flight': 0, 'resolved': 2, 'expired': 1}
+
+
+def test_in_flight_requests_cancel_drops_entry():
+    in_flight = InFlightRequests(ResponseStore())
+    future = in_flight.register('given-up', timeout=30)
+    assert 'given-up' in in_flight
+    future.cancel()
+    assert 'given-up' not in in_flight
+    assert not in_flight.resolve('given-up', {'id': 'given-up', 'status': 200})
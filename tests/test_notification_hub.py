@@ -0,0 +1,83 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+
+# ----------------------------------------------------------------------------
+# This test file tests the per test views of the shared notification channel offline.
+# ----------------------------------------------------------------------------
+
+import base64
+import logging
+
+import pytest
+
+from izuma_systest_lib.cloud.event_store import Record
+from izuma_systest_lib.cloud.notification_hub import NotificationView
+from izuma_systest_lib.cloud.websocket_handler import NotificationRunner, WebSocketHandler
+
+log = logging.getLogger(__name__)
+
+
+def _notify(runner, endpoint, path, value):
+    runner.events.add('notifications', Record({'ep': endpoint, 'path': path, 'ct': 'text/plain',
+                                               'payload': base64.b64encode(str(value).encode()).decode()}))
+
+
+def test_view_sees_only_watched_devices_after_opening():
+    runner = NotificationRunner('wss://api.example.com', 'ak_test')
+    _notify(runner, 'dev1', '/3/0/13', 0)
+    websocket = WebSocketHandler(NotificationView(runner, devices=(), async_ids=()))
+    other = WebSocketHandler(NotificationView(runner, devices=(), async_ids=()))
+    for i in range(1, 4):
+        _notify(runner, 'dev1', '/3/0/13', i)
+        _notify(runner, 'dev2', '/3/0/13', i * 10)
+    notifications = websocket.get_notifications()
+    assert len(notifications) == 0
+    assert notifications.first('dev1') is None
+
+    # Waiting for a device makes its events visible, the ones arrived before the test opened the view are not
+    assert websocket.wait_for_notification('dev1', '/3/0/13', 2, timeout=0).text == '2'
+    assert len(notifications) == 3
+    assert [item.text for item in notifications] == ['1', '2', '3']
+    assert [notifications[i].text for i in (0, -1, -3)] == ['1', '3', '1']
+    assert [item.text for item in notifications[1:]] == ['2', '3']
+    with pytest.raises(IndexError):
+        notifications[3]  # pylint: disable=pointless-statement
+    assert notifications.first('dev1').text == '1'
+    assert notifications.last('dev1', '/3/0/13').text == '3'
+    assert notifications.count('dev1') == 3
+    assert notifications.count('dev2') == 0
+    assert notifications.endpoints() == ['dev1']
+
+    # Concurrent test's view sees only its own device
+    assert other.wait_for_resource_notifications('dev2', '/3/0/13', timeout=0).text == '10'
+    assert [item.text for item in other.get_notifications()] == ['10', '20', '30']
+
+
+def test_view_sees_only_watched_async_responses():
+    runner = NotificationRunner('wss://api.example.com', 'ak_test')
+    websocket = WebSocketHandler(NotificationView(runner, devices=(), async_ids=()))
+    other = WebSocketHandler(NotificationView(runner, devices=(), async_ids=()))
+    future = websocket.expect_async_response('id-1', timeout=1)
+    runner._handle_message({'async-responses': [{'id': 'id-1', 'status': 200},  # pylint: disable=protected-access
+                                                {'id': 'id-2', 'status': 200}]})
+    assert future.result(0)['status'] == 200
+    assert websocket.get_async_response('id-1')['status'] == 200
+    assert 'id-2' not in websocket.ws.async_responses
+    assert other.wait_for_async_response('id-2', timeout=0)['status'] == 200
+    assert 'id-1' not in other.ws.async_responses
@@ -0,0 +1,80 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests matching the expected WebSocket notifications offline.
+# ----------------------------------------------------------------------------
+
+import base64
+import logging
+import threading
+
+from izuma_systest_lib.cloud.event_store import EventLog, Record
+from izuma_systest_lib.cloud.websocket_handler import NotificationMatcher
+
+log = logging.getLogger(__name__)
+
+
+def _notify(events, endpoint, path, value):
+    events.append(Record({'ep': endpoint, 'path': path, 'ct': 'text/plain',
+                          'payload': base64.b64encode(str(value).encode()).decode()}))
+
+
+def test_notification_matcher_incremental():
+    events = EventLog('notifications')
+    matcher = NotificationMatcher(events, 'dev1', [{'/3/0/13': 100}, {'/3/0/3': '1.2.3'}])
+    _notify(events, 'dev1', '/3/0/13', 99)
+    _notify(events, 'dev2', '/3/0/13', 100)
+    assert matcher.update() is None
+    assert not matcher.done
+    _notify(events, 'dev1', '/3/0/13', 100)
+    assert matcher.update() is None
+    cursor = matcher.cursor
+    assert matcher.update() is None
+    assert matcher.cursor == cursor
+    _notify(events, 'dev1', '/3/0/3', '1.2.3')
+    matched = matcher.update()
+    assert matcher.done
+    assert [(item['path'], item.text) for item in matched] == [('/3/0/13', '100'), ('/3/0/3', '1.2.3')]
+
+
+def test_notification_matcher_repeated_expectations():
+    events = EventLog('notifications')
+    # Same value expected twice needs two notifications
+    matcher = NotificationMatcher(events, 'dev1', [{'/5/0/1': 'on'}, {'/5/0/1': 'on'}])
+    _notify(events, 'dev1', '/5/0/1', 'on')
+    assert matcher.update() is None
+    _notify(events, 'dev1', '/5/0/1', 'on')
+    assert len(matcher.update()) == 2
+
+
+def test_notification_matcher_in_store_wait():
+    events = EventLog('notifications')
+    matcher = NotificationMatcher(events, 'dev1', [{'/1/0/{}'.format(index): index} for index in range(200)])
+    matched = []
+
+    def wait():
+        matched.append(events.waiters.wait(('notifications', 'dev1'), matcher.update, timeout=5))
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    for index in reversed(range(200)):
+        _notify(events, 'dev1', '/1/0/{}'.format(index), index)
+    waiter.join()
+    assert matched[0] is not None
+    assert len(matched[0]) == 200
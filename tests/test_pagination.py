@@ -0,0 +1,79 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the cursor pagination offline against a fake list
+# endpoint.
+# ----------------------------------------------------------------------------
+
+import logging
+
+from izuma_systest_lib.cloud.libraries.pagination import PageIterator
+
+log = logging.getLogger(__name__)
+
+ITEMS = [{'id': 'item{:04d}'.format(i)} for i in range(250)]
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeListEndpoint:
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, query_params=None, expected_status_code=None, **kwargs):
+        self.requests.append(dict(query_params))
+        after = query_params.get('after')
+        start = [item['id'] for item in ITEMS].index(after) + 1 if after else 0
+        data = ITEMS[start:start + query_params['limit']]
+        return FakeResponse({'data': data, 'has_more': start + len(data) < len(ITEMS)})
+
+
+def test_page_iterator_all_items():
+    endpoint = FakeListEndpoint()
+    with PageIterator(endpoint, {'filter': 'state=registered'}, page_size=100) as items:
+        assert list(items) == ITEMS
+    assert [request.get('after') for request in endpoint.requests] == [None, 'item0099', 'item0199']
+    assert all(request['filter'] == 'state=registered' for request in endpoint.requests)
+
+
+def test_page_iterator_max_items():
+    endpoint = FakeListEndpoint()
+    items = PageIterator(endpoint, page_size=100, max_items=130, prefetch=False)
+    assert list(items) == ITEMS[:130]
+    assert [request['limit'] for request in endpoint.requests] == [100, 30]
+
+
+def test_page_iterator_break_closes():
+    items = PageIterator(FakeListEndpoint(), page_size=10)
+    for item in items:
+        if item['id'] == 'item0015':
+            break
+    assert items.items_read == 15
+    # pylint: disable=protected-access
+    assert items._closed
+    assert items._executor._shutdown
+    for thread in items._executor._threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the REST GET response cache offline.
+# ----------------------------------------------------------------------------
+
+import logging
+import time
+from types import SimpleNamespace
+
+from izuma_systest_lib.cloud.libraries.rest_api.cache import ResponseCache
+
+log = logging.getLogger(__name__)
+
+API = 'https://api.example.com'
+
+
+def _response(status_code=200, etag=None):
+    return SimpleNamespace(status_code=status_code, headers={'ETag': etag} if etag else {})
+
+
+def test_response_cache_key():
+    cache = ResponseCache({'/v3/applications*': 60})
+    headers = {'Authorization': 'Bearer ak_1'}
+    assert cache.key(API + '/v3/devices', headers) is None
+    assert cache.key(API + '/v3/applications', headers, stream=True) is None
+    key = cache.key(API + '/v3/applications', headers, params={'limit': 10, 'after': 'x'})
+    assert key == (API + '/v3/applications', 'after=x&limit=10', 'Bearer ak_1', None)
+    assert key != cache.key(API + '/v3/applications', {'Authorization': 'Bearer ak_2'}, params={'limit': 10, 'after': 'x'})
+
+
+def test_response_cache_hit_and_expiry():
+    cache = ResponseCache({'/v3/applications': 0.05})
+    key = cache.key(API + '/v3/applications', {})
+    assert cache.lookup(key) == (None, False)
+    response = cache.store(key, _response())
+    entry, fresh = cache.lookup(key)
+    assert fresh
+    assert entry.response is response
+    time.sleep(0.06)
+    # Stale entry without ETag is dropped
+    assert cache.lookup(key) == (None, False)
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'revalidations': 0, 'evictions': 0, 'invalidations': 0,
+                             'entries': 0}
+
+
+def test_response_cache_revalidation():
+    cache = ResponseCache({'/v3/applications': 0.01})
+    key = cache.key(API + '/v3/applications', {})
+    response = cache.store(key, _response(etag='"v1"'))
+    time.sleep(0.02)
+    entry, fresh = cache.lookup(key)
+    assert not fresh
+    assert entry.etag == '"v1"'
+    assert cache.revalidated(key, entry) is response
+    assert cache.stats()['revalidations'] == 1
+    cache.store(key, _response(status_code=500), stale_entry=entry)
+    assert cache.lookup(key) == (None, False)
+
+
+def test_response_cache_lru_eviction():
+    cache = ResponseCache({'/v3/applications/*': 60}, max_entries=2)
+    keys = [cache.key(API + '/v3/applications/{}'.format(index), {}) for index in range(3)]
+    cache.store(keys[0], _response())
+    cache.store(keys[1], _response())
+    cache.lookup(keys[0])
+    cache.store(keys[2], _response())
+    assert cache.lookup(keys[1]) == (None, False)
+    assert cache.lookup(keys[0])[1]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_response_cache_invalidation():
+    cache = ResponseCache({'/v3/applications*': 60})
+    list_key = cache.key(API + '/v3/applications', {})
+    item_key = cache.key(API + '/v3/applications/app1', {})
+    other_key = cache.key(API + '/v3/applications-other', {})
+    for key in (list_key, item_key, other_key):
+        cache.store(key, _response())
+    cache.invalidate(API + '/v3/applications/app1/access-keys')
+    assert cache.lookup(list_key) == (None, False)
+    assert cache.lookup(item_key) == (None, False)
+    assert cache.lookup(other_key)[1]
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_response_cache_from_config():
+    assert ResponseCache.from_config({}) is None
+    assert ResponseCache.from_config({'rest_cache': 'false'}) is None
+    assert ResponseCache.from_config({'rest_cache': 'true', 'rest_cache_max_entries': 5}).max_entries == 5
@@ -0,0 +1,142 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the resumed streaming download offline.
+# ----------------------------------------------------------------------------
+
+import asyncio
+import hashlib
+import io
+import logging
+
+import pytest
+import requests
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from izuma_systest_lib.cloud.libraries.rest_api.async_rest_api import AsyncRestAPI
+from izuma_systest_lib.cloud.libraries.rest_api.rest_api import RestAPI
+
+log = logging.getLogger(__name__)
+
+CONTENT = bytes(range(256)) * 64
+API_URL = '/v3/firmware-images/test/datafile'
+
+
+class InterruptingAdapter(BaseAdapter):
+    """
+    Serves CONTENT, cuts the first body short and drops the connection on the given count of Range requests
+    """
+
+    def __init__(self, cut_at, dropped_resumes):
+        super().__init__()
+        self.cut_at = cut_at
+        self.dropped_resumes = dropped_resumes
+        self.ranges = []
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ,unused-argument
+        byte_range = request.headers.get('Range')
+        self.ranges.append(byte_range)
+        if byte_range is None:
+            return self._response(request, 200, CONTENT[:self.cut_at], len(CONTENT))
+        if self.dropped_resumes:
+            self.dropped_resumes -= 1
+            raise requests.exceptions.ConnectionError('Connection reset by peer')
+        start = int(byte_range[len('bytes='):-1])
+        return self._response(request, 206, CONTENT[start:], len(CONTENT) - start)
+
+    def _response(self, request, status_code, body, length):
+        r = requests.Response()
+        r.status_code = status_code
+        r.headers = CaseInsensitiveDict({'Content-Length': str(length)})
+        r.raw = io.BytesIO(body)
+        r.url = request.url
+        r.request = request
+        r.connection = self
+        return r
+
+    def close(self):
+        pass
+
+
+def _rest_api(adapter):
+    session = requests.Session()
+    session.mount('https://', adapter)
+    return RestAPI({'api_gw': 'https://api.example.com', 'api_key': 'ak_test', 'rest_metrics': 'false'},
+                   session=session)
+
+
+def test_download_resumes_after_dropped_resume_request(tmp_path):
+    adapter = InterruptingAdapter(cut_at=5000, dropped_resumes=1)
+    destination = tmp_path / 'image.bin'
+    result = _rest_api(adapter).download(API_URL, destination, max_resumes=3, expected_status_code=200,
+                                         expected_checksum=hashlib.sha256(CONTENT).hexdigest())
+    assert adapter.ranges == [None, 'bytes=5000-', 'bytes=5000-']
+    assert result.resumes == 2
+    assert result.status_code == 206
+    assert destination.read_bytes() == CONTENT
+
+
+def test_download_keeps_part_file_when_resumes_run_out(tmp_path):
+    adapter = InterruptingAdapter(cut_at=5000, dropped_resumes=2)
+    destination = tmp_path / 'image.bin'
+    with pytest.raises(requests.exceptions.ConnectionError):
+        _rest_api(adapter).download(API_URL, destination, max_resumes=2)
+    assert not destination.exists()
+    assert (tmp_path / 'image.bin.part').read_bytes() == CONTENT[:5000]
+
+    # Next call continues the stored part
+    adapter.ranges = []
+    result = _rest_api(adapter).download(API_URL, destination)
+    assert adapter.ranges == ['bytes=5000-']
+    assert result.resumes == 0
+    assert destination.read_bytes() == CONTENT
+
+
+def test_async_download_resumes(tmp_path):
+    ranges = []
+
+    async def datafile(request):
+        byte_range = request.headers.get('Range')
+        ranges.append(byte_range)
+        start = int(byte_range[len('bytes='):-1]) if byte_range else 0
+        resp = web.StreamResponse(status=206 if byte_range else 200)
+        resp.content_length = len(CONTENT) - start
+        await resp.prepare(request)
+        if byte_range is None:
+            await resp.write(CONTENT[:5000])
+            request.transport.close()
+            return resp
+        await resp.write(CONTENT[start:])
+        return resp
+
+    async def download():
+        app = web.Application()
+        app.router.add_get(API_URL, datafile)
+        async with TestServer(app) as server:
+            config = {'api_gw': str(server.make_url('')).rstrip('/'), 'api_key': 'ak_test', 'rest_metrics': 'false'}
+            async with AsyncRestAPI(config) as rest_api:
+                return await rest_api.download(API_URL, tmp_path / 'image.bin', expected_status_code=200)
+
+    result = asyncio.run(download())
+    assert ranges == [None, 'bytes=5000-']
+    assert result.resumes == 1
+    assert (tmp_path / 'image.bin').read_bytes() == CONTENT
@@ -0,0 +1,112 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the REST request metrics offline.
+# ----------------------------------------------------------------------------
+
+import json
+import logging
+
+import requests
+from requests.adapters import BaseAdapter
+
+from izuma_systest_lib.cloud.libraries.rest_api.metrics import Histogram, MetricsRegistry, template_path
+from izuma_systest_lib.cloud.libraries.rest_api.rest_api import RestAPI
+
+log = logging.getLogger(__name__)
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(0.1, 0.2, 0.5, 1.0))
+    assert histogram.quantile(0.5) is None
+    for _ in range(90):
+        histogram.observe(0.15)
+    for _ in range(10):
+        histogram.observe(0.8)
+    assert histogram.count == 100
+    assert histogram.max == 0.8
+    assert 0.1 <= histogram.quantile(0.5) <= 0.2
+    assert 0.5 <= histogram.quantile(0.95) <= 0.8
+    assert histogram.quantile(1.0) == 0.8
+    assert histogram.cumulative_counts() == [(0.1, 0), (0.2, 90), (0.5, 90), (1.0, 100), ('+Inf', 100)]
+
+
+def test_histogram_slower_than_buckets():
+    histogram = Histogram(buckets=(0.1,))
+    histogram.observe(5.0)
+    histogram.observe(0.1)
+    assert histogram.cumulative_counts() == [(0.1, 1), ('+Inf', 2)]
+    assert histogram.quantile(0.99) <= 5.0
+
+
+def test_template_path():
+    assert template_path('https://api.example.com/v3/devices/017f1e7a9b4c0a580a01451f00000000') == '/v3/devices/{id}'
+    assert template_path('/v2/endpoints/017f1e7a9b4c0a580a01451f00000000/3/0/13') == '/v2/endpoints/{id}/3/0/13'
+
+
+def test_metrics_registry_export(tmp_path):
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    registry.record('get', '/v3/devices/017f1e7a9b4c0a580a01451f00000000', 200, 0.05, bytes_in=100)
+    registry.record('GET', '/v3/devices/017f1e7a9b4c0a580a01451f00000001', 404, 0.5)
+    registry.record('GET', '/v3/devices/017f1e7a9b4c0a580a01451f00000002', 'error', 2.0)
+    snapshot = registry.snapshot()
+    endpoint = snapshot['GET /v3/devices/{id}']
+    assert endpoint['count'] == 3
+    assert endpoint['status_codes'] == {'200': 1, '404': 1, 'error': 1}
+    assert endpoint['bytes_in'] == 100
+    prometheus = registry.to_prometheus()
+    assert 'rest_request_duration_seconds_bucket{method="GET",path="/v3/devices/{id}",le="+Inf"} 3' in prometheus
+    assert 'rest_responses_total{method="GET",path="/v3/devices/{id}",status="404"} 1' in prometheus
+
+    files = registry.write(str(tmp_path / 'metrics' / 'rest'))
+    with open(files[0], encoding='utf-8') as f:
+        assert json.load(f) == snapshot
+
+
+class AcceptingAdapter(BaseAdapter):
+    """
+    Answers every request with empty 201 response
+    """
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ,unused-argument
+        r = requests.Response()
+        r.status_code = 201
+        r._content = b''  # pylint: disable=protected-access
+        r.request = request
+        r.url = request.url
+        return r
+
+    def close(self):
+        pass
+
+
+def test_binary_request_body_size(caplog):
+    session = requests.Session()
+    session.mount('https://', AcceptingAdapter())
+    rest_api = RestAPI({'api_gw': 'https://api.example.com', 'api_key': 'ak_test'}, session=session)
+    rest_api.metrics = MetricsRegistry()
+    chunk = memoryview(bytes(range(256)) * 16)[1000:3000]
+    with caplog.at_level(logging.DEBUG, logger='izuma_systest_lib'):
+        for body in (chunk, bytes(chunk), bytearray(chunk)):
+            rest_api.post('/v3/firmware-images/upload-jobs/1/chunks', payload=body, json_payload=False,
+                          expected_status_code=201)
+    assert [endpoint['bytes_out'] for endpoint in rest_api.metrics.snapshot().values()] == [6000]
+    assert 'Payload: binary data of 2000 bytes' in caplog.text
+    assert 'binary data of 2000 bytes - removed from the log' in caplog.text
+    assert '<memory at' not in caplog.text
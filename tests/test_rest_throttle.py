@@ -0,0 +1,137 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2023, Izuma Networks
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------
+# This test file tests the client side REST rate limiting offline.
+# ----------------------------------------------------------------------------
+
+import io
+import logging
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from izuma_systest_lib.cloud.libraries.rest_api.rest_api import RestAPI
+from izuma_systest_lib.cloud.libraries.rest_api.throttle import RequestThrottle, TokenBucket, parse_retry_after
+
+log = logging.getLogger(__name__)
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket('test', rate=10, burst=5)
+    delays = [bucket.reserve() for _ in range(15)]
+    # Burst is sent at once, then one request per interval in arrival order
+    assert all(delay == 0 for delay in delays[:5])
+    assert delays[5:] == sorted(delays[5:])
+    assert delays[14] == pytest.approx(1.0, abs=0.05)
+    assert bucket.stats()['queue_depth'] == 10
+    for _ in range(10):
+        bucket.waited()
+    assert bucket.stats()['queue_depth'] == 0
+
+
+def test_token_bucket_throttled_backs_off_and_recovers():
+    bucket = TokenBucket('test', rate=10, burst=5)
+    bucket.throttled(2.0, retry=True)
+    assert bucket.current_rate == 5
+    # No burst after the backoff
+    first, second = bucket.reserve(), bucket.reserve()
+    assert first == pytest.approx(2.0, abs=0.05)
+    assert second - first == pytest.approx(0.2, abs=0.01)
+    for _ in range(5):
+        bucket.throttled(0, retry=False)
+    assert bucket.rate_factor == TokenBucket.min_rate_factor
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate_factor == 1.0
+    stats = bucket.stats()
+    assert stats['throttle_events'] == 6
+    assert stats['retries'] == 1
+
+
+def test_request_throttle_endpoint_classes():
+    throttle = RequestThrottle({'/v2/endpoints/*': (20, 40)})
+    assert throttle.bucket('https://api.example.com/v2/endpoints/dev1/3/0/13').name == '/v2/endpoints/*'
+    assert throttle.bucket('https://api.example.com/v3/devices').name == '*'
+    assert set(throttle.stats()) == {'/v2/endpoints/*', '*'}
+
+
+def test_request_throttle_retries():
+    throttle = RequestThrottle(max_retries=2, max_backoff=0.5)
+    url = 'https://api.example.com/v3/devices'
+    assert not throttle.should_retry('GET', url, 200, {}, 0)
+    assert throttle.should_retry('GET', url, 429, {'Retry-After': '0'}, 0)
+    assert throttle.should_retry('GET', url, 503, {}, 1)
+    assert not throttle.should_retry('GET', url, 429, {}, 2)
+    # 503 may come after the request was processed, POST isn't sent again
+    assert not throttle.should_retry('POST', url, 503, {}, 0)
+    assert throttle.should_retry('POST', url, 429, {}, 0)
+    assert not throttle.should_retry('POST', url, 429, {}, 0, resendable=False)
+    assert throttle.bucket(url).stats()['backoff'] <= 0.5
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_request_throttle_from_config():
+    assert RequestThrottle.from_config({}) is None
+    assert RequestThrottle.from_config({'rest_throttle': 'false'}) is None
+    throttle = RequestThrottle.from_config({'rest_throttle': True, 'rest_throttle_retries': '5'})
+    assert throttle.max_retries == 5
+
+
+class ThrottlingAdapter(BaseAdapter):
+    """
+    Answers 429 to the first requests, then 200. Keeps the raw bodies to check they are closed.
+    """
+
+    def __init__(self, throttled):
+        super().__init__()
+        self.throttled = throttled
+        self.bodies = []
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ,unused-argument
+        r = requests.Response()
+        r.status_code = 429 if len(self.bodies) < self.throttled else 200
+        r.headers = CaseInsensitiveDict({'Retry-After': '0'})
+        r.raw = io.BytesIO(b'{}')
+        r.request = request
+        r.url = request.url
+        self.bodies.append(r.raw)
+        return r
+
+    def close(self):
+        pass
+
+
+def test_throttled_streamed_responses_are_closed():
+    adapter = ThrottlingAdapter(throttled=2)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    rest_api = RestAPI({'api_gw': 'https://api.example.com', 'api_key': 'ak_test', 'rest_metrics': 'false',
+                        'rest_throttle': 'true'}, session=session)
+    r = rest_api.get('/v3/devices', expected_status_code=200, stream=True)
+    assert [body.closed for body in adapter.bodies] == [True, True, False]
+    r.close()
@@ -27,7 +27,6 @@
 
 
 import logging
-import base64
 import time
 from izuma_systest_lib.cloud import connect_handler
 import pytest
@@ -108,7 +107,7 @@ def test_notification_device_cpu_usage(edge, cloud_api, websocket, subscribe_to_
     data = websocket.wait_for_resource_notifications(edge.device_id, cpu_usage, timeout=10 * 60, delay=5)
 
     if data:
-        payload = str(base64.b64decode(data['payload']))
+        payload = data.text
         log.info('Current cpu usage: {} %'.format(payload))
 
     assert payload, 'Unable to get cpu usage:{}  notifications from websocket channel'.format(cpu_usage)